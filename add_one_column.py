@@ -1,6 +1,21 @@
 import pymysql
+from typing import List
 from connection import getconnection, release_connection
 
+
+def trending_column_name(name):
+    """
+    The cat_is_trending column that counts a document, from its namespace.
+
+    Only letters, numbers and underscores are kept, and names that do not start
+    with a letter get an 'idx_' prefix, so any namespace maps to a SQL-safe column.
+    """
+    safe_column_name = ''.join(c for c in name if c.isalnum() or c == '_')
+    if not safe_column_name[:1].isalpha():
+        safe_column_name = 'idx_' + safe_column_name
+    return safe_column_name
+
+
 def add_one_to_column(column_name):
     """
     Adds a new column to the cat_is_trending table.
@@ -16,9 +31,7 @@ def add_one_to_column(column_name):
     data_type="INT"
     try:
         # Sanitize column name to prevent SQL injection
-        # Only allow alphanumeric characters and underscores
-        if not column_name.replace('_', '').isalnum():
-            return False, "Column name can only contain letters, numbers, and underscores"
+        column_name = trending_column_name(column_name)
         
         connection = getconnection()
         if not connection:
@@ -53,4 +66,55 @@ def add_one_to_column(column_name):
             cursor.close()
         if connection:
             release_connection(connection)
+
+
+def drop_columns(column_names: List[str]):
+    """
+    Drops documents' columns from the cat_is_trending table, with their counts,
+    in one ALTER TABLE. Columns that were never created are skipped.
+    
+    Args:
+        column_names: list of namespaces (sanitized with trending_column_name)
+        
+    Returns:
+        tuple: (bool, str) - (Success status, Message)
+    """
+    cursor = None
+    connection = None
+    try:
+        safe_column_names = sorted({trending_column_name(name) for name in column_names})
+        if not safe_column_names:
+            return True, "No columns to drop"
+        
+        connection = getconnection()
+        if not connection:
+            return False, "Failed to connect to database"
+            
+        cursor = connection.cursor()
+        cursor.execute(f"""
+            SELECT COLUMN_NAME
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = 'defaultdb'
+            AND TABLE_NAME = 'cat_is_trending'
+            AND COLUMN_NAME IN ({', '.join(['%s'] * len(safe_column_names))})
+        """, tuple(safe_column_names))
+        existing = [row['COLUMN_NAME'] for row in cursor.fetchall()]
+        if not existing:
+            return True, "No columns to drop"
+        
+        cursor.execute("ALTER TABLE cat_is_trending " + ", ".join(f"DROP COLUMN {name}" for name in existing))
+        connection.commit()
+        return True, f"Successfully dropped {len(existing)} columns"
+        
+    except pymysql.MySQLError as e:
+        return False, f"Database error occurred: {str(e)}"
         
+    except Exception as e:
+        return False, f"An unexpected error occurred: {str(e)}"
+    
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
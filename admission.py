@@ -0,0 +1,252 @@
+"""
+Per-API-key admission control.
+
+Each request passes three checks before its handler runs:
+
+1. Rate limit: a token bucket per API key (ADMISSION_RATE_PER_SECOND tokens
+   per second, up to ADMISSION_BURST). Chat costs 1 token, ingestion
+   ADMISSION_INGEST_COST, since a document upload is far more expensive
+   upstream. An empty bucket is rejected immediately.
+2. Concurrency: at most ADMISSION_KEY_CONCURRENCY requests per key and
+   ADMISSION_MAX_CONCURRENT in total run at once in this worker.
+3. Fair queue: requests that cannot run yet wait in a bounded queue
+   (ADMISSION_QUEUE_SIZE in total, ADMISSION_QUEUE_PER_KEY per key) that
+   hands freed slots to keys round-robin, so one busy client cannot starve
+   the others. A full queue, or a wait longer than
+   ADMISSION_QUEUE_TIMEOUT_SECONDS, is rejected.
+
+Rejections raise Rejected with a Retry-After hint; rag.py turns them into 429
+responses. Per-key limits can be overridden with ADMISSION_KEY_LIMITS, a JSON
+object keyed by services.key_id(api_key), e.g.
+{"3f2a9c1e": {"rate_per_second": 20, "burst": 40, "concurrency": 8}}. It is
+read once at import; invalid entries are logged and ignored.
+
+Limits apply per worker process; with N workers a key's effective limits are
+N times these. In async mode the concurrency limits default to
+WORKER_CONNECTIONS (see serving_mode.py).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+import serving_mode
+from metrics import counter, gauge, histogram
+from services import key_id, load_key_limits
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_RATE_PER_SECOND = float(os.environ.get("ADMISSION_RATE_PER_SECOND", "5"))
+ADMISSION_BURST = float(os.environ.get("ADMISSION_BURST", "20"))
+ADMISSION_INGEST_COST = float(os.environ.get("ADMISSION_INGEST_COST", "5"))
+# In async mode both default to WORKER_CONNECTIONS (see serving_mode.py)
+ADMISSION_KEY_CONCURRENCY = int(os.environ.get("ADMISSION_KEY_CONCURRENCY", str(serving_mode.concurrent_requests(4))))
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", str(serving_mode.concurrent_requests(16))))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_QUEUE_PER_KEY = int(os.environ.get("ADMISSION_QUEUE_PER_KEY", "16"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+
+# Token cost of one request, by workload
+COSTS = {"chat": 1.0, "ingest": ADMISSION_INGEST_COST}
+
+KEY_REQUESTS = counter(
+    "caseon_api_key_requests_total",
+    "Requests per API key and workload, by admission outcome "
+    "(admitted, rate_limited, queue_full, queue_timeout).",
+    ("key", "workload", "outcome"),
+)
+KEY_IN_FLIGHT = gauge("caseon_api_key_in_flight", "Requests currently running per API key.", ("key",))
+QUEUE_DEPTH = gauge("caseon_admission_queue_depth", "Requests waiting for a slot in this worker.")
+QUEUE_WAIT_SECONDS = histogram(
+    "caseon_admission_queue_wait_seconds",
+    "Time admitted requests spent in the fair queue.",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+class Rejected(Exception):
+    """A request was not admitted; retry_after is a hint in seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass
+class KeyLimits:
+    rate_per_second: float = ADMISSION_RATE_PER_SECOND
+    burst: float = ADMISSION_BURST
+    concurrency: int = ADMISSION_KEY_CONCURRENCY
+
+
+DEFAULT_KEY_LIMITS = KeyLimits()
+ADMISSION_KEY_LIMITS: Dict[str, KeyLimits] = load_key_limits("ADMISSION_KEY_LIMITS", KeyLimits)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, burst: float):
+        self.rate = rate_per_second
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def take(self, cost: float) -> float:
+        """Take cost tokens; return 0 on success, else seconds until they are available."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        cost = min(cost, self.burst)
+        if self._tokens >= cost:
+            self._tokens -= cost
+            return 0.0
+        return (cost - self._tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class _Waiter:
+    __slots__ = ("key", "granted", "event")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.granted = False
+        self.event = threading.Event()
+
+
+@dataclass
+class Ticket:
+    key: str
+    workload: str
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int, queue_size: int, queue_per_key: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.queue_per_key = queue_per_key
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._total_in_flight = 0
+        # key -> waiters; the order of keys is the round-robin order
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._queued = 0
+
+    def limits(self, key: str) -> KeyLimits:
+        return ADMISSION_KEY_LIMITS.get(key, DEFAULT_KEY_LIMITS)
+
+    def _can_run(self, key: str) -> bool:
+        return (self._total_in_flight < self.max_concurrent
+                and self._in_flight.get(key, 0) < self.limits(key).concurrency)
+
+    def _start(self, key: str) -> None:
+        self._total_in_flight += 1
+        self._in_flight[key] = self._in_flight.get(key, 0) + 1
+        KEY_IN_FLIGHT.set(self._in_flight[key], key=key)
+
+    def _dispatch(self) -> None:
+        """Hand free slots to queued requests, one key at a time in round-robin order."""
+        progressed = True
+        while progressed and self._queued and self._total_in_flight < self.max_concurrent:
+            progressed = False
+            for key in list(self._queues):
+                if not self._can_run(key):
+                    continue
+                waiters = self._queues.pop(key)
+                waiter = waiters.popleft()
+                if waiters:
+                    # Back of the line for this key's next request
+                    self._queues[key] = waiters
+                self._queued -= 1
+                self._start(key)
+                waiter.granted = True
+                waiter.event.set()
+                progressed = True
+                break
+        QUEUE_DEPTH.set(self._queued)
+
+    def acquire(self, api_key: str, workload: str) -> Ticket:
+        key = key_id(api_key)
+        limits = self.limits(key)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None or (bucket.rate, bucket.burst) != (limits.rate_per_second, limits.burst):
+                bucket = self._buckets[key] = TokenBucket(limits.rate_per_second, limits.burst)
+            wait = bucket.take(COSTS.get(workload, 1.0))
+            if wait:
+                KEY_REQUESTS.inc(key=key, workload=workload, outcome="rate_limited")
+                raise Rejected("Rate limit exceeded", wait)
+
+            if not self._queued and self._can_run(key):
+                self._start(key)
+                KEY_REQUESTS.inc(key=key, workload=workload, outcome="admitted")
+                QUEUE_WAIT_SECONDS.observe(0.0)
+                return Ticket(key, workload)
+
+            waiters = self._queues.get(key)
+            if self._queued >= self.queue_size or (waiters and len(waiters) >= self.queue_per_key):
+                KEY_REQUESTS.inc(key=key, workload=workload, outcome="queue_full")
+                raise Rejected("Server busy", 1.0)
+            waiter = _Waiter(key)
+            self._queues.setdefault(key, deque()).append(waiter)
+            self._queued += 1
+            QUEUE_DEPTH.set(self._queued)
+            # A slot may already be free for this key even though other keys are waiting
+            self._dispatch()
+
+        start = time.perf_counter()
+        waiter.event.wait(self.queue_timeout)
+        with self._lock:
+            if not waiter.granted:
+                waiters = self._queues.get(key)
+                if waiters is not None and waiter in waiters:
+                    waiters.remove(waiter)
+                    if not waiters:
+                        del self._queues[key]
+                    self._queued -= 1
+                    QUEUE_DEPTH.set(self._queued)
+                KEY_REQUESTS.inc(key=key, workload=workload, outcome="queue_timeout")
+                raise Rejected("Server busy", 1.0)
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - start)
+        KEY_REQUESTS.inc(key=key, workload=workload, outcome="admitted")
+        return Ticket(key, workload)
+
+    def release(self, ticket: Ticket) -> None:
+        with self._lock:
+            self._total_in_flight -= 1
+            self._in_flight[ticket.key] -= 1
+            KEY_IN_FLIGHT.set(self._in_flight[ticket.key], key=ticket.key)
+            if not self._in_flight[ticket.key]:
+                del self._in_flight[ticket.key]
+            self._dispatch()
+
+    def usage(self) -> Dict[str, Dict[str, int]]:
+        """In-flight and queued requests per key id."""
+        with self._lock:
+            keys = set(self._in_flight) | set(self._queues)
+            return {
+                key: {"in_flight": self._in_flight.get(key, 0), "queued": len(self._queues.get(key, ()))}
+                for key in sorted(keys)
+            }
+
+
+_controller = AdmissionController(
+    ADMISSION_MAX_CONCURRENT, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_PER_KEY, ADMISSION_QUEUE_TIMEOUT_SECONDS
+)
+
+
+def acquire(api_key: str, workload: str) -> Optional[Ticket]:
+    """Admit a request or raise Rejected. Pass the ticket to release() when the request ends."""
+    if not ADMISSION_ENABLED:
+        return None
+    return _controller.acquire(api_key, workload)
+
+
+def release(ticket: Optional[Ticket]) -> None:
+    if ticket is not None:
+        _controller.release(ticket)
+
+
+def usage() -> Dict[str, Dict[str, int]]:
+    return _controller.usage()
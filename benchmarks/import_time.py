@@ -0,0 +1,76 @@
+"""
+Import-time benchmark for worker startup.
+
+Measures how long a fresh interpreter takes to import the app module (what a
+gunicorn worker pays before it can serve) and lists the slowest imports from
+``python -X importtime``, so startup regressions show up before deploy.
+
+Usage:
+    python benchmarks/import_time.py [--module rag] [--runs 5] [--top 15] [--max-ms 1500]
+
+Exits with status 1 when the median import time exceeds --max-ms.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(.*)$")
+
+
+def measure_once(module: str):
+    """Import module in a fresh interpreter. Returns (wall_ms, [(cumulative_us, name), ...])."""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"Importing {module} failed:\n" + "\n".join(errors[-20:]))
+
+    imports = []
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            imports.append((int(match.group(2)), match.group(3).strip()))
+    return wall_ms, imports
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="rag", help="module to import (default: rag)")
+    parser.add_argument("--runs", type=int, default=5, help="number of fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if the median exceeds this")
+    args = parser.parse_args(argv)
+
+    wall_times = []
+    imports = []
+    for _ in range(args.runs):
+        wall_ms, imports = measure_once(args.module)
+        wall_times.append(wall_ms)
+
+    median = statistics.median(wall_times)
+    print(f"import {args.module}: median {median:.1f} ms, min {min(wall_times):.1f} ms, "
+          f"max {max(wall_times):.1f} ms over {args.runs} runs")
+    print("\nSlowest imports (cumulative, last run):")
+    for cumulative_us, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:9.1f} ms  {name}")
+
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"\nFAIL: median {median:.1f} ms exceeds budget of {args.max_ms:.1f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
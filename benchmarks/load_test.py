@@ -0,0 +1,249 @@
+"""
+Offline end-to-end benchmark for /api/v1/chat and /api/v1/document/process.
+
+Runs the real Flask app on a local threaded server with Gemini, Pinecone and
+MySQL replaced by the stand-ins in benchmarks/standins.py, drives it with
+concurrent clients and reports p50/p95/p99 latency, requests/second and the
+per-stage breakdown returned via include_timings.
+
+Usage:
+    python benchmarks/load_test.py [--scenario all|ingest|chat] [--concurrency 8]
+        [--chat-requests 200] [--documents 8] [--pages 20]
+        [--output bench_output.json] [--compare previous.json]
+
+--database mysql keeps the MySQL helpers and connects to the server in MYSQL_HOST /
+MYSQL_PORT / MYSQL_USER / MYSQL_PASSWORD (a local MySQL with a defaultdb schema)
+instead of the SQLite stand-in.
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import standins  # noqa: E402  (also puts the repo root on sys.path)
+
+API_KEY = "offline-benchmark-key"
+
+QUESTIONS = (
+    "What is the main issue",
+    "Summarize this case",
+    "What did the court hold",
+    "What were the arguments of the appellant",
+    "Which statute was interpreted",
+)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class _Client:
+    """Keep-alive HTTP connection to the app; one per load-generating thread."""
+
+    def __init__(self, port: int):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+
+    def post(self, path: str, body: Dict):
+        payload = json.dumps(body)
+        headers = {"Content-Type": "application/json", "x-api-key": API_KEY}
+        try:
+            self.conn.request("POST", path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn.request("POST", path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+        return response.status, json.loads(response.read() or b"{}")
+
+
+def run_load(port: int, path: str, bodies: List[Dict], concurrency: int) -> Dict:
+    """Send every body to path using concurrency client threads and summarize the results."""
+    local = threading.local()
+    latencies, stages, errors = [], {}, []
+    lock = threading.Lock()
+
+    def one(body):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = _Client(port)
+        start = time.perf_counter()
+        status, payload = client.post(path, dict(body, include_timings=True))
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            if status == 200 and payload.get("success"):
+                latencies.append(elapsed)
+                for stage, ms in (payload.get("timings") or {}).items():
+                    stages.setdefault(stage, []).append(ms)
+            else:
+                errors.append(f"{status}: {payload.get('error')}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, bodies))
+    wall = time.perf_counter() - start
+
+    return {
+        "requests": len(bodies),
+        "succeeded": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(len(latencies) / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 1),
+            "p95": round(percentile(latencies, 95), 1),
+            "p99": round(percentile(latencies, 99), 1),
+            "mean": round(statistics.fmean(latencies), 1) if latencies else 0.0,
+        },
+        "stages_ms": {
+            stage: {
+                "p50": round(percentile(values, 50), 2),
+                "p95": round(percentile(values, 95), 2),
+                "mean": round(statistics.fmean(values), 2),
+            }
+            for stage, values in sorted(stages.items())
+        },
+    }
+
+
+def print_report(name: str, report: Dict, baseline: Dict = None, out=None) -> None:
+    out = out or sys.stdout
+
+    def delta(path):
+        if not baseline:
+            return ""
+        old = baseline
+        for key in path:
+            old = (old or {}).get(key)
+        new = report
+        for key in path:
+            new = new.get(key)
+        if not old:
+            return ""
+        return f" ({(new - old) / old * 100:+.1f}%)"
+
+    lat = report["latency_ms"]
+    print(f"\n== {name}: {report['succeeded']}/{report['requests']} ok, {report['errors']} errors, "
+          f"concurrency {report['concurrency']}", file=out)
+    print(f"   throughput  {report['requests_per_second']:8.2f} req/s{delta(['requests_per_second'])}", file=out)
+    for pct in ("p50", "p95", "p99"):
+        print(f"   latency {pct} {lat[pct]:9.1f} ms{delta(['latency_ms', pct])}", file=out)
+    if "llm_calls" in report:
+        print(f"   llm calls   {report['llm_calls']:8d}   billed input tokens {report['llm_billed_input_tokens']}"
+              f"{delta(['llm_billed_input_tokens'])}, cached {report.get('llm_cached_input_tokens', 0)}", file=out)
+    if report["stages_ms"]:
+        print("   per-stage               p50 ms     p95 ms    mean ms", file=out)
+        for stage, values in report["stages_ms"].items():
+            print(f"   {stage:<22}{values['p50']:9.2f}  {values['p95']:9.2f}  {values['mean']:9.2f}", file=out)
+    for sample in report["error_samples"]:
+        print(f"   error: {sample}", file=out)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=("all", "ingest", "chat"), default="all")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--chat-requests", type=int, default=200)
+    parser.add_argument("--documents", type=int, default=8, help="documents ingested (and chatted against)")
+    parser.add_argument("--pages", type=int, default=20, help="pages per generated PDF")
+    parser.add_argument("--embed-latency-ms", type=float, default=25.0)
+    parser.add_argument("--vector-latency-ms", type=float, default=40.0)
+    parser.add_argument("--llm-first-token-ms", type=float, default=400.0)
+    parser.add_argument("--llm-ms-per-token", type=float, default=2.0)
+    parser.add_argument("--llm-output-tokens", type=int, default=300)
+    parser.add_argument("--context-cache", choices=("off", "system", "documents"), default="off",
+                        help="CONTEXT_CACHE_MODE for the run, against a stand-in context cache")
+    parser.add_argument("--context-cache-min-tokens", type=int, default=0,
+                        help="smallest content the stand-in cache accepts")
+    parser.add_argument("--db-latency-ms", type=float, default=2.0)
+    parser.add_argument("--database", choices=("sqlite", "mysql"), default="sqlite")
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="JSON report from a previous run to diff against")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own console output")
+    args = parser.parse_args(argv)
+
+    # Keep the report readable unless asked not to: silence stray prints and per-request logs
+    out = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        # werkzeug sets its own logger to INFO for the access log
+        os.environ.setdefault("LOG_LEVELS", "werkzeug=WARNING")
+
+    os.environ["API_KEYS"] = API_KEY
+    # All load comes from one API key, which per-key rate limits would throttle;
+    # export ADMISSION_ENABLED=true to measure with admission control in place
+    os.environ.setdefault("ADMISSION_ENABLED", "false")
+    os.environ["CONTEXT_CACHE_MODE"] = args.context_cache
+    import rag
+    from werkzeug.serving import make_server
+
+    database = standins.SqliteDatabase(latency_ms=args.db_latency_ms) if args.database == "sqlite" else None
+    context_cache = standins.FakeContextCache(min_tokens=args.context_cache_min_tokens)
+    llm = standins.FakeLLM(output_tokens=args.llm_output_tokens, first_token_ms=args.llm_first_token_ms,
+                           ms_per_token=args.llm_ms_per_token, context_cache=context_cache)
+    standins.install(
+        embeddings=standins.FakeEmbeddings(latency_ms=args.embed_latency_ms),
+        llm=llm,
+        pinecone_options={"query_latency_ms": args.vector_latency_ms},
+        database=database,
+        context_cache=context_cache,
+    )
+
+    server = make_server("127.0.0.1", 0, rag.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    pdfs = standins.PdfServer().start()
+    port = server.server_port
+
+    results = {"config": vars(args)}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    namespaces = [standins.new_namespace() for _ in range(args.documents)]
+    ingest_bodies = [{"link": pdfs.url(i, args.pages), "unique_id": ns} for i, ns in enumerate(namespaces)]
+    # The chat scenario needs documents to talk to, so ingestion always runs; it is
+    # only reported when selected.
+    results["ingest"] = run_load(port, "/api/v1/document/process", ingest_bodies, args.concurrency)
+    if args.scenario in ("all", "ingest"):
+        print_report("document/process", results["ingest"], (baseline or {}).get("ingest"), out)
+
+    if args.scenario in ("all", "chat"):
+        chat_bodies = [
+            {"index_name": namespaces[i % len(namespaces)], "user_input": QUESTIONS[i % len(QUESTIONS)]}
+            for i in range(args.chat_requests)
+        ]
+        results["chat"] = run_load(port, "/api/v1/chat", chat_bodies, args.concurrency)
+        results["chat"]["llm_billed_input_tokens"] = llm.billed_input_tokens
+        results["chat"]["llm_cached_input_tokens"] = llm.cached_input_tokens
+        results["chat"]["llm_calls"] = llm.calls
+        print_report("chat", results["chat"], (baseline or {}).get("chat"), out)
+
+    server.shutdown()
+    pdfs.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nReport written to {args.output}", file=out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
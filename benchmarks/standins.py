@@ -0,0 +1,645 @@
+"""
+Local stand-ins for the upstreams the service talks to, for offline benchmarking.
+
+- FakeEmbeddings: deterministic 768-dim unit vectors derived from the text hash.
+- FakeLLM: returns canned answers with configurable token counts and delays, and
+  counts the input tokens it bills, separately from those read from the context cache.
+- FakeContextCache: stand-in for Gemini's context cache, with a minimum size and TTLs.
+- FakePinecone / FakeIndex: in-memory vector index with log-normal query latency.
+- SqliteDatabase: SQLite replacements for the MySQL-backed helpers that read and
+  write volume_handling_table, cat_is_trending and token_usage.
+- PdfServer: serves generated multi-page PDFs over local HTTP for ingestion.
+
+install() wires them into a running process through services.py and by
+replacing the database helpers in every repo module that imported them.
+"""
+import hashlib
+import math
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+DIMENSION = 768
+
+
+def _sleep_lognormal(median_ms: float, sigma: float, rng: random.Random) -> None:
+    """Sleep for a log-normally distributed time, the usual shape of network call latency."""
+    if median_ms <= 0:
+        return
+    time.sleep(rng.lognormvariate(math.log(median_ms / 1000.0), sigma))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count used by the stand-ins (about four characters per token)."""
+    return max(1, len(text) // 4)
+
+
+class FakeEmbeddings:
+    """Deterministic embedder: the same text always maps to the same unit vector."""
+
+    def __init__(self, latency_ms: float = 25.0, sigma: float = 0.3, dimension: int = DIMENSION, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.dimension = dimension
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _vector(self, text: str) -> List[float]:
+        rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+        values = [rng.gauss(0.0, 1.0) for _ in range(self.dimension)]
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def _delay(self):
+        with self._lock:
+            self.calls += 1
+            rng = random.Random(self._rng.random())
+        _sleep_lognormal(self.latency_ms, self.sigma, rng)
+
+    def embed_query(self, text: str) -> List[float]:
+        self._delay()
+        return self._vector(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._delay()
+        return [self._vector(text) for text in texts]
+
+
+class FakeMessage:
+    def __init__(self, content: str, usage_metadata: Dict):
+        self.content = content
+        self.usage_metadata = usage_metadata
+
+
+class FakeLLM:
+    """
+    Chat model stand-in.
+
+    Latency is a fixed time-to-first-token plus a per-output-token cost, and usage
+    metadata reports the estimated input tokens it was billed for. With a
+    context_cache, requests may reference cached content: its tokens are counted
+    in cached_input_tokens instead of billed_input_tokens and reported as
+    cache_read, like Gemini does.
+    """
+
+    def __init__(self, output_tokens: int = 300, first_token_ms: float = 400.0, ms_per_token: float = 2.0, sigma: float = 0.25, seed: int = 0,
+                 context_cache: Optional["FakeContextCache"] = None):
+        self.output_tokens = output_tokens
+        self.first_token_ms = first_token_ms
+        self.ms_per_token = ms_per_token
+        self.sigma = sigma
+        self.context_cache = context_cache
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.billed_input_tokens = 0
+        self.cached_input_tokens = 0
+
+    def invoke(self, messages, cached_content: Optional[str] = None):
+        prompt = "\n".join(content for _, content in messages)
+        input_tokens = estimate_tokens(prompt)
+        cached_tokens = 0
+        if cached_content:
+            if self.context_cache is None:
+                raise ValueError("cached_content is not supported by this model")
+            cached_tokens = self.context_cache.tokens(cached_content)
+        with self._lock:
+            self.calls += 1
+            self.billed_input_tokens += input_tokens
+            self.cached_input_tokens += cached_tokens
+            rng = random.Random(self._rng.random())
+        _sleep_lognormal(self.first_token_ms, self.sigma, rng)
+        time.sleep(self.output_tokens * self.ms_per_token / 1000.0)
+        answer = " ".join(["answer"] * self.output_tokens)
+        return FakeMessage(answer, {
+            "input_tokens": input_tokens + cached_tokens,
+            "output_tokens": self.output_tokens,
+            "total_tokens": input_tokens + cached_tokens + self.output_tokens,
+            "input_token_details": {"cache_read": cached_tokens},
+        })
+
+
+class FakeContextCache:
+    """
+    Context cache stand-in with the provider's main constraints: content below
+    min_tokens is rejected, and entries stop working once their TTL runs out.
+    """
+
+    def __init__(self, min_tokens: int = 0, supported: bool = True):
+        self.min_tokens = min_tokens
+        self.supported = supported
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[float]] = {}  # name -> [tokens, expire_at]
+        self.created = 0
+        self.renewed = 0
+
+    def create(self, system_instruction: str, document_text: Optional[str], ttl_seconds: int, display_name: str):
+        from context_cache import CacheHandle
+        if not self.supported:
+            raise ValueError("Cached content is not supported for this model")
+        tokens = estimate_tokens(system_instruction + (document_text or ""))
+        if tokens < self.min_tokens:
+            raise ValueError(f"Cached content is too small. total_token_count={tokens}, min_total_token_count={self.min_tokens}")
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        expire_at = time.time() + ttl_seconds
+        with self._lock:
+            self._entries[name] = [tokens, expire_at]
+            self.created += 1
+        return CacheHandle(name, expire_at)
+
+    def renew(self, name: str, ttl_seconds: int) -> float:
+        with self._lock:
+            entry = self._entry(name)
+            entry[1] = time.time() + ttl_seconds
+            self.renewed += 1
+            return entry[1]
+
+    def delete(self, name: str) -> None:
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def tokens(self, name: str) -> int:
+        with self._lock:
+            return int(self._entry(name)[0])
+
+    def _entry(self, name: str) -> List[float]:
+        entry = self._entries.get(name)
+        if entry is None or entry[1] <= time.time():
+            raise ValueError(f"CachedContent not found (or permission denied): {name}")
+        return entry
+
+
+class FakeTraceExporter:
+    """Trace exporter stand-in that keeps exported spans in memory, with optional per-batch latency."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self._lock = threading.Lock()
+        self.spans = []
+        self.batches = 0
+
+    def export(self, spans) -> None:
+        time.sleep(self.latency_ms / 1000.0)
+        with self._lock:
+            self.spans.extend(spans)
+            self.batches += 1
+
+
+class _AsyncResult:
+    def __init__(self, value):
+        self._value = value
+
+    def get(self):
+        return self._value
+
+
+class FakeIndex:
+    """In-memory stand-in for a Pinecone index: brute-force cosine search per namespace."""
+
+    def __init__(self, name: str, query_latency_ms: float = 40.0, write_latency_ms: float = 20.0, sigma: float = 0.5, seed: int = 0):
+        self.name = name
+        self.query_latency_ms = query_latency_ms
+        self.write_latency_ms = write_latency_ms
+        self.sigma = sigma
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._namespaces: Dict[str, Dict[str, tuple]] = {}
+
+    def _delay(self, median_ms: float):
+        with self._lock:
+            rng = random.Random(self._rng.random())
+        _sleep_lognormal(median_ms, self.sigma, rng)
+
+    @staticmethod
+    def _normalize(vector):
+        if isinstance(vector, dict):
+            return vector["id"], list(vector["values"]), dict(vector.get("metadata") or {})
+        if isinstance(vector, (tuple, list)):
+            vector_id, values = vector[0], vector[1]
+            metadata = vector[2] if len(vector) > 2 else {}
+            return vector_id, list(values), dict(metadata or {})
+        return vector.id, list(vector.values), dict(getattr(vector, "metadata", None) or {})
+
+    def upsert(self, vectors, namespace: str = "", async_req: bool = False, **kwargs):
+        self._delay(self.write_latency_ms)
+        rows = [self._normalize(v) for v in vectors]
+        with self._lock:
+            store = self._namespaces.setdefault(namespace, {})
+            for vector_id, values, metadata in rows:
+                store[vector_id] = (values, metadata)
+        result = {"upserted_count": len(rows)}
+        return _AsyncResult(result) if async_req else result
+
+    def query(self, vector=None, top_k: int = 10, include_metadata: bool = False, include_values: bool = False, namespace: str = "", **kwargs):
+        self._delay(self.query_latency_ms)
+        with self._lock:
+            items = list(self._namespaces.get(namespace, {}).items())
+        scored = []
+        for vector_id, (values, metadata) in items:
+            score = sum(a * b for a, b in zip(vector, values))
+            scored.append((score, vector_id, values, metadata))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        matches = []
+        for score, vector_id, values, metadata in scored[:top_k]:
+            match = {"id": vector_id, "score": score}
+            if include_metadata:
+                match["metadata"] = dict(metadata)
+            if include_values:
+                match["values"] = list(values)
+            matches.append(match)
+        return {"matches": matches, "namespace": namespace}
+
+    def fetch(self, ids, namespace: str = "", **kwargs):
+        self._delay(self.query_latency_ms)
+        with self._lock:
+            store = self._namespaces.get(namespace, {})
+            vectors = {
+                vector_id: {"id": vector_id, "values": list(store[vector_id][0]), "metadata": dict(store[vector_id][1])}
+                for vector_id in ids if vector_id in store
+            }
+        return {"vectors": vectors, "namespace": namespace}
+
+    def list(self, prefix: Optional[str] = None, namespace: str = "", limit: int = 100, **kwargs):
+        """Yield pages of vector IDs, like Pinecone's list() generator."""
+        with self._lock:
+            ids = sorted(i for i in self._namespaces.get(namespace, {}) if not prefix or i.startswith(prefix))
+        for start in range(0, len(ids), limit):
+            yield ids[start:start + limit]
+
+    def delete(self, ids=None, delete_all: bool = False, namespace: str = "", **kwargs):
+        self._delay(self.write_latency_ms)
+        with self._lock:
+            if delete_all:
+                self._namespaces.pop(namespace, None)
+            else:
+                store = self._namespaces.get(namespace, {})
+                for vector_id in ids or []:
+                    store.pop(vector_id, None)
+                if namespace in self._namespaces and not store:
+                    del self._namespaces[namespace]
+        return {}
+
+    def describe_index_stats(self, **kwargs):
+        with self._lock:
+            namespaces = {ns: {"vector_count": len(store)} for ns, store in self._namespaces.items()}
+        return {
+            "dimension": DIMENSION,
+            "namespaces": namespaces,
+            "total_vector_count": sum(ns["vector_count"] for ns in namespaces.values()),
+        }
+
+
+class _IndexDescription:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __eq__(self, other):
+        return self.name == getattr(other, "name", other)
+
+    def __hash__(self):
+        return hash(self.name)
+
+
+class _IndexList(list):
+    def names(self):
+        return [index.name for index in self]
+
+    def __contains__(self, name):
+        return any(index.name == name for index in self)
+
+
+class FakePinecone:
+    """Stand-in for a Pinecone project: a set of FakeIndex instances keyed by name."""
+
+    def __init__(self, **index_options):
+        self._index_options = index_options
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, FakeIndex] = {}
+
+    def list_indexes(self):
+        with self._lock:
+            return _IndexList(_IndexDescription(name) for name in self._indexes)
+
+    def create_index(self, name: str, **kwargs):
+        with self._lock:
+            self._indexes.setdefault(name, FakeIndex(name, **self._index_options))
+
+    def delete_index(self, name: str, **kwargs):
+        with self._lock:
+            self._indexes.pop(name, None)
+
+    def Index(self, name: str, **kwargs):
+        with self._lock:
+            if name not in self._indexes:
+                self._indexes[name] = FakeIndex(name, **self._index_options)
+            return self._indexes[name]
+
+
+class SqliteDatabase:
+    """
+    SQLite stand-in for the MySQL tables in connection.py's database.
+
+    cat_is_trending is stored in long form (date, column, count) since SQLite
+    cannot cheaply grow one column per document the way the MySQL table does.
+    Every call sleeps for latency_ms to mimic a network round trip.
+    """
+
+    def __init__(self, path: str = ":memory:", latency_ms: float = 2.0):
+        self.latency_ms = latency_ms
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS volume_handling_table (
+                namespace TEXT PRIMARY KEY, index_name TEXT NOT NULL, project TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS cat_is_trending (
+                date TEXT NOT NULL, column_name TEXT NOT NULL, count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (date, column_name));
+            CREATE TABLE IF NOT EXISTS token_usage (
+                Date TEXT PRIMARY KEY, Input_token INTEGER NOT NULL, Output_token INTEGER NOT NULL);
+        """)
+
+    def _execute(self, sql: str, params=()):
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            rows = cursor.fetchall()
+            self._conn.commit()
+            return rows
+
+    def _execute_count(self, sql: str, params=()) -> int:
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+        with self._lock:
+            count = self._conn.execute(sql, params).rowcount
+            self._conn.commit()
+            return count
+
+    # pinecone_index_manager
+    def insert_case(self, namespace: str, index_name: str, project: str):
+        try:
+            self._execute("INSERT INTO volume_handling_table (namespace, index_name, project) VALUES (?, ?, ?)",
+                          (namespace, index_name, project))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def get_index_project_by_namespace(self, namespace: str):
+        rows = self._execute("SELECT index_name, project FROM volume_handling_table WHERE namespace = ?", (namespace,))
+        return rows[0] if rows else (None, None)
+
+    def get_routes_by_namespaces(self, namespaces):
+        if not namespaces:
+            return {}
+        rows = self._execute(
+            f"SELECT namespace, index_name, project FROM volume_handling_table WHERE namespace IN ({','.join('?' * len(namespaces))})",
+            tuple(namespaces),
+        )
+        return {namespace: (index_name, project) for namespace, index_name, project in rows}
+
+    def get_index_namespace_and_project(self, index_name: str):
+        rows = self._execute("SELECT namespace, project FROM volume_handling_table WHERE index_name = ? LIMIT 1", (index_name,))
+        return rows[0] if rows else (None, None)
+
+    def get_routes_by_index(self, index_name: str):
+        rows = self._execute("SELECT namespace, project FROM volume_handling_table WHERE index_name = ?", (index_name,))
+        return dict(rows)
+
+    def get_routed_namespaces(self):
+        return [row[0] for row in self._execute("SELECT namespace FROM volume_handling_table")]
+
+    def get_routed_indexes(self):
+        return self._execute("SELECT DISTINCT index_name, project FROM volume_handling_table")
+
+    def delete_cases(self, namespaces):
+        deleted = 0
+        for namespace in namespaces:
+            deleted += self._execute_count("DELETE FROM volume_handling_table WHERE namespace = ?", (namespace,))
+        return deleted
+
+    # add_one_column / one_adder
+    def add_one_to_column(self, column_name: str):
+        return True, f"Successfully added column '{column_name}'"
+
+    def drop_columns(self, column_names):
+        from add_one_column import trending_column_name
+        for name in {trending_column_name(name) for name in column_names}:
+            self._execute("DELETE FROM cat_is_trending WHERE column_name = ?", (name,))
+        return True, f"Successfully dropped {len(column_names)} columns"
+
+    def trending_columns(self):
+        return [row[0] for row in self._execute("SELECT DISTINCT column_name FROM cat_is_trending")]
+
+    def increment_column_for_today(self, column_name: str):
+        from add_one_column import trending_column_name
+        self._execute(
+            "INSERT INTO cat_is_trending (date, column_name, count) VALUES (?, ?, 1) "
+            "ON CONFLICT(date, column_name) DO UPDATE SET count = count + 1",
+            (date.today().isoformat(), trending_column_name(column_name)),
+        )
+
+    # token_usage_database_update
+    def update_token_usage(self, input_tokens: int, output_tokens: int):
+        if input_tokens < 0 or output_tokens < 0:
+            raise ValueError("Input and output tokens must be non-negative.")
+        self._execute(
+            "INSERT INTO token_usage (Date, Input_token, Output_token) VALUES (?, ?, ?) "
+            "ON CONFLICT(Date) DO UPDATE SET Input_token = Input_token + excluded.Input_token, "
+            "Output_token = Output_token + excluded.Output_token",
+            (date.today().isoformat(), input_tokens, output_tokens),
+        )
+
+    def token_totals(self):
+        rows = self._execute("SELECT COALESCE(SUM(Input_token), 0), COALESCE(SUM(Output_token), 0) FROM token_usage")
+        return rows[0]
+
+    # Which repo functions each method stands in for, as (module, function name)
+    REPLACES = {
+        "insert_case": ("pinecone_index_manager", "insert_case"),
+        "get_index_project_by_namespace": ("pinecone_index_manager", "get_index_project_by_namespace"),
+        "get_index_namespace_and_project": ("pinecone_index_manager", "get_index_namespace_and_project"),
+        "get_routes_by_namespaces": ("pinecone_index_manager", "get_routes_by_namespaces"),
+        "get_routes_by_index": ("pinecone_index_manager", "get_routes_by_index"),
+        "get_routed_indexes": ("pinecone_index_manager", "get_routed_indexes"),
+        "get_routed_namespaces": ("pinecone_index_manager", "get_routed_namespaces"),
+        "delete_cases": ("pinecone_index_manager", "delete_cases"),
+        "add_one_to_column": ("add_one_column", "add_one_to_column"),
+        "drop_columns": ("add_one_column", "drop_columns"),
+        "increment_column_for_today": ("one_adder", "increment_column_for_today"),
+        "update_token_usage": ("token_usage_database_update", "update_token_usage"),
+    }
+
+
+def replace_everywhere(original, replacement) -> int:
+    """Rebind every repo-module attribute that refers to original. Returns how many were replaced."""
+    replaced = 0
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None) or ""
+        if not path.startswith(REPO_ROOT) or os.sep + "benchmarks" + os.sep in path:
+            continue
+        for attr, value in list(vars(module).items()):
+            if value is original:
+                setattr(module, attr, replacement)
+                replaced += 1
+    return replaced
+
+
+def install(embeddings=None, llm=None, pinecone_options: Optional[Dict] = None, database: Optional[SqliteDatabase] = None,
+            context_cache: Optional[FakeContextCache] = None, trace_exporter: Optional[FakeTraceExporter] = None):
+    """
+    Route the service's upstream calls to local stand-ins. Import rag (or the
+    modules under test) first so every reference to the database helpers exists.
+    """
+    import importlib
+    import services
+
+    os.environ.setdefault("GOOGLE_API_KEY", "offline")
+    os.environ.setdefault("PINECONE_API_KEY", "offline-project-1")
+    os.environ.setdefault("PINECONE_API_KEY_SECOND_PROJECT", "offline-project-2")
+    os.environ.setdefault("LANGSMITH_API_KEY", "offline")
+
+    projects: Dict[str, FakePinecone] = {}
+    projects_lock = threading.Lock()
+
+    def pinecone_factory(api_key: str):
+        with projects_lock:
+            if api_key not in projects:
+                projects[api_key] = FakePinecone(**(pinecone_options or {}))
+            return projects[api_key]
+
+    services.set_pinecone_factory(pinecone_factory)
+    services.override("embeddings", embeddings or FakeEmbeddings())
+    services.override("llm", llm or FakeLLM())
+    services.override("langsmith_client", object())
+    services.override("trace_exporter", trace_exporter or FakeTraceExporter())
+    services.override("context_cache", context_cache or FakeContextCache(supported=False))
+
+    if database is not None:
+        for method, (module_name, function_name) in SqliteDatabase.REPLACES.items():
+            module = importlib.import_module(module_name)
+            replace_everywhere(getattr(module, function_name), getattr(database, method))
+    return projects
+
+
+# --- PDF generation and serving ---------------------------------------------
+
+_WORDS = (
+    "appellant respondent court held judgment petition section act evidence trial "
+    "counsel contended argued order appeal dismissed allowed statute provision held "
+    "jurisdiction bench learned judge finding fact law precedent reasoning relief"
+).split()
+
+
+def make_document_text(doc_id: int, pages: int, words_per_page: int = 450) -> List[str]:
+    """Deterministic pseudo-legal text, one string per page."""
+    rng = random.Random(doc_id)
+    return [" ".join(rng.choice(_WORDS) for _ in range(words_per_page)) for _ in range(pages)]
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: List[str], chars_per_line: int = 90) -> bytes:
+    """Build a minimal multi-page PDF with Helvetica text that pypdf can extract."""
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(b"")  # filled in once the page objects exist
+    page_ids = []
+    for text in pages:
+        lines, line = [], ""
+        for word in text.split():
+            if len(line) + len(word) + 1 > chars_per_line:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        if line:
+            lines.append(line)
+        ops = ["BT", "/F1 9 Tf", "11 TL", "40 800 Td"]
+        ops += [f"({_pdf_escape(l)}) '" for l in lines]
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (pages_id, content_id, font_id)
+        ))
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids).encode()
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+    catalog_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog_id, xref)
+    return bytes(out)
+
+
+class PdfServer:
+    """Serves generated PDFs at http://127.0.0.1:<port>/<doc_id>-<pages>.pdf"""
+
+    def __init__(self):
+        cache: Dict[str, bytes] = {}
+        cache_lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                name = self.path.strip("/").removesuffix(".pdf")
+                try:
+                    doc_id, pages = (int(part) for part in name.split("-"))
+                except ValueError:
+                    self.send_error(404)
+                    return
+                with cache_lock:
+                    if name not in cache:
+                        cache[name] = make_pdf(make_document_text(doc_id, pages))
+                    body = cache[name]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/pdf")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self) -> "PdfServer":
+        self._thread.start()
+        return self
+
+    def url(self, doc_id: int, pages: int) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/{doc_id}-{pages}.pdf"
+
+    def stop(self):
+        self._server.shutdown()
+
+
+def new_namespace(prefix: str = "bench") -> str:
+    return f"{prefix}_{uuid.uuid4().hex[:12]}"
@@ -0,0 +1,104 @@
+"""
+Deterministic vector IDs and a per-namespace manifest of the chunks uploaded.
+
+A chunk's ID is derived from (namespace, content hash, position), where the
+content hash covers the chunk text and its page number and the position is the
+occurrence of that hash within the document. Using the occurrence rather than
+the absolute chunk index keeps every unchanged chunk's ID stable when a
+corrected version inserts or removes text earlier in the document, so a
+re-ingest only has to embed what actually changed.
+"""
+import hashlib
+from typing import Dict, List, Tuple
+
+from local_store import ensure_schema, local_db
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk_manifest (
+    namespace TEXT NOT NULL,
+    vector_id TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (namespace, vector_id)
+);
+"""
+
+# (vector_id, content_hash, position)
+ManifestEntry = Tuple[str, str, int]
+
+
+def chunk_hash(text: str, page) -> str:
+    return hashlib.sha256(f"{page}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def vector_id(namespace: str, content_hash: str, position: int) -> str:
+    return hashlib.sha256(f"{namespace}\x00{content_hash}\x00{position}".encode("utf-8")).hexdigest()[:32]
+
+
+def assign_ids(namespace: str, docs) -> List[ManifestEntry]:
+    """Compute the manifest entry for each split document, in order."""
+    occurrences: Dict[str, int] = {}
+    entries = []
+    for doc in docs:
+        content_hash = chunk_hash(doc.page_content, doc.metadata.get("page"))
+        position = occurrences.get(content_hash, 0)
+        occurrences[content_hash] = position + 1
+        entries.append((vector_id(namespace, content_hash, position), content_hash, position))
+    return entries
+
+
+def has_manifest(namespace: str) -> bool:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        row = conn.execute("SELECT 1 FROM chunk_manifest WHERE namespace = ? LIMIT 1", (namespace,)).fetchone()
+    return row is not None
+
+
+def load_manifest(namespace: str) -> Dict[str, str]:
+    """Return {vector_id: content_hash} for the chunks currently stored in a namespace."""
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        rows = conn.execute("SELECT vector_id, content_hash FROM chunk_manifest WHERE namespace = ?", (namespace,)).fetchall()
+    return {row["vector_id"]: row["content_hash"] for row in rows}
+
+
+def save_manifest(namespace: str, entries: List[ManifestEntry]) -> None:
+    """Replace the manifest of a namespace with entries."""
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.execute("DELETE FROM chunk_manifest WHERE namespace = ?", (namespace,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunk_manifest (namespace, vector_id, content_hash, position) VALUES (?, ?, ?, ?)",
+            [(namespace, vid, content_hash, position) for vid, content_hash, position in entries],
+        )
+
+
+def delete_manifest(namespace: str) -> None:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.execute("DELETE FROM chunk_manifest WHERE namespace = ?", (namespace,))
+
+
+def diff(namespace: str, entries: List[ManifestEntry]) -> Tuple[List[int], List[str]]:
+    """
+    Compare a new version of a document against the stored manifest.
+
+    Returns:
+        tuple: (indexes into entries that must be embedded and upserted,
+                vector IDs that are no longer part of the document)
+    """
+    current = load_manifest(namespace)
+    new_ids = {vid for vid, _, _ in entries}
+    to_upsert = [i for i, (vid, _, _) in enumerate(entries) if vid not in current]
+    to_delete = [vid for vid in current if vid not in new_ids]
+    return to_upsert, to_delete
+
+
+def load_entries(namespace: str) -> List[ManifestEntry]:
+    """Return the manifest entries of a namespace, in no particular order."""
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        rows = conn.execute(
+            "SELECT vector_id, content_hash, position FROM chunk_manifest WHERE namespace = ?", (namespace,)
+        ).fetchall()
+    return [(row["vector_id"], row["content_hash"], row["position"]) for row in rows]
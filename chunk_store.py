@@ -0,0 +1,126 @@
+"""
+Local chunk-text store keyed by vector ID.
+
+Ingestion writes every chunk's text and metadata here. With
+CHUNK_HYDRATION=store, query.py asks Pinecone for IDs and scores only and
+hydrates the texts with one bulk read from this store, fronted by an in-process
+LRU. Setting CHUNK_TEXT_IN_METADATA=false also leaves the text out of Pinecone
+metadata for new uploads; only do that when LOCAL_DATA_DIR is on a persistent
+volume, since the store then holds the only copy of the text.
+"""
+import json
+import os
+from typing import Dict, Iterable, List, Tuple
+
+from cache import LRUCache
+from local_store import ensure_schema, local_db
+
+CHUNK_TEXT_IN_METADATA = os.environ.get("CHUNK_TEXT_IN_METADATA", "true").lower() == "true"
+CHUNK_HYDRATION = os.environ.get("CHUNK_HYDRATION", "metadata").lower()
+CHUNK_CACHE_SIZE = int(os.environ.get("CHUNK_CACHE_SIZE", "20000"))
+
+# SQLite's default limit on host parameters per statement is 999
+_SQL_BATCH = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunk_text (
+    vector_id TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunk_text_namespace ON chunk_text (namespace);
+"""
+
+# vector_id -> (text, metadata)
+_cache = LRUCache(CHUNK_CACHE_SIZE)
+
+
+def hydrate_from_store() -> bool:
+    return CHUNK_HYDRATION == "store"
+
+
+def put_chunks(namespace: str, chunks: Iterable[Tuple[str, str, Dict]]) -> None:
+    """Store (vector_id, text, metadata) rows for a namespace."""
+    rows = [(vid, namespace, text, json.dumps(metadata)) for vid, text, metadata in chunks]
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO chunk_text (vector_id, namespace, text, metadata) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+    _cache.put_many({vid: (text, json.loads(metadata)) for vid, _, text, metadata in rows})
+
+
+def get_chunks(vector_ids: List[str]) -> Dict[str, Tuple[str, Dict]]:
+    """Return {vector_id: (text, metadata)} for the IDs found, reading the store once for all cache misses."""
+    found = _cache.get_many(vector_ids)
+    missing = [vid for vid in vector_ids if vid not in found]
+    if missing:
+        ensure_schema(_SCHEMA)
+        loaded = {}
+        with local_db() as conn:
+            for start in range(0, len(missing), _SQL_BATCH):
+                batch = missing[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                for row in conn.execute(
+                    f"SELECT vector_id, text, metadata FROM chunk_text WHERE vector_id IN ({placeholders})", batch
+                ):
+                    loaded[row["vector_id"]] = (row["text"], json.loads(row["metadata"]))
+        _cache.put_many(loaded)
+        found.update(loaded)
+    return found
+
+
+def delete_chunks(vector_ids: List[str]) -> None:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        for start in range(0, len(vector_ids), _SQL_BATCH):
+            batch = vector_ids[start:start + _SQL_BATCH]
+            conn.execute(f"DELETE FROM chunk_text WHERE vector_id IN ({','.join('?' * len(batch))})", batch)
+    for vid in vector_ids:
+        _cache.delete(vid)
+
+
+def delete_namespace(namespace: str) -> None:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        ids = [row["vector_id"] for row in conn.execute("SELECT vector_id FROM chunk_text WHERE namespace = ?", (namespace,))]
+        conn.execute("DELETE FROM chunk_text WHERE namespace = ?", (namespace,))
+    for vid in ids:
+        _cache.delete(vid)
+
+
+def get_document_text(namespace: str) -> str:
+    """
+    Reassemble a document's full text from its stored chunks.
+
+    Chunks are ordered by page and start offset; the overlap between
+    neighbouring chunks of a page is dropped using their start_index.
+    """
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        rows = [(row["text"], json.loads(row["metadata"]))
+                for row in conn.execute("SELECT text, metadata FROM chunk_text WHERE namespace = ?", (namespace,))]
+    rows.sort(key=lambda row: (row[1].get("page") or 0, row[1].get("start_index") or 0, row[1].get("chunk_index") or 0))
+    pages = []
+    current_page, page_parts, page_end = None, [], 0
+    for text, metadata in rows:
+        page, start = metadata.get("page"), metadata.get("start_index")
+        if page != current_page:
+            if page_parts:
+                pages.append("".join(page_parts))
+            current_page, page_parts, page_end = page, [], 0
+        if start is None:
+            page_parts.append(("\n" if page_parts else "") + text)
+            continue
+        if start + len(text) <= page_end:
+            continue
+        if page_parts and start > page_end:
+            # The splitter drops the whitespace between non-overlapping chunks
+            page_parts.append(" ")
+        page_parts.append(text[max(0, page_end - start):])
+        page_end = start + len(text)
+    if page_parts:
+        pages.append("".join(page_parts))
+    return "\n\n".join(pages)
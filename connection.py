@@ -1,22 +1,37 @@
+import logging
 import pymysql
 from datetime import datetime
 import os
+import threading
 from dotenv import load_dotenv
 from pymysql.cursors import DictCursor
 
 load_dotenv()
 
-# Create a connection pool
+logger = logging.getLogger(__name__)
+
+# Create a connection pool. Threads check connections in and out concurrently
+# (and in async serving mode so do greenlets), so it is only touched under _pool_lock.
 _connection_pool = []
-MAX_POOL_SIZE = 5
+_pool_lock = threading.Lock()
+MAX_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "5"))
+# Upper bound on connections checked out at once. In async serving mode hundreds
+# of requests can be in flight per worker; past this they wait for a free connection.
+MAX_CONNECTIONS = int(os.getenv("MYSQL_MAX_CONNECTIONS", "20"))
+_connection_slots = threading.Semaphore(MAX_CONNECTIONS)
 
 def getconnection():
     """Get a database connection from the pool or create a new one if needed"""
-    if _connection_pool:
-        return _connection_pool.pop()
+    timeout = 10
+    if not _connection_slots.acquire(timeout=timeout):
+        logger.warning("Timed out waiting for a free database connection")
+        return None
+    with _pool_lock:
+        pooled = _connection_pool.pop() if _connection_pool else None
+    if pooled is not None:
+        return pooled
     else:
         try:
-            timeout = 10
             connection = pymysql.connect(
                 charset="utf8mb4",
                 connect_timeout=timeout,
@@ -25,33 +40,43 @@ def getconnection():
                 host=os.getenv("MYSQL_HOST"),
                 password=os.getenv("MYSQL_PASSWORD"),
                 read_timeout=timeout,
-                port=10849,
+                port=int(os.getenv("MYSQL_PORT", "10849")),
                 user=os.getenv("MYSQL_USER"),
                 write_timeout=timeout,
             )
             return connection
         except Exception as e:
-            print(f"An error occurred in database connection: {str(e)}")
+            _connection_slots.release()
+            logger.error(f"An error occurred in database connection: {str(e)}")
             return None
 
 def release_connection(connection):
     """Return a connection to the pool"""
+    if connection is None:
+        return
     try:
-        if connection and connection.open:
+        if connection.open:
             # Only add back to pool if it's a valid connection
-            if len(_connection_pool) < MAX_POOL_SIZE:
+            with _pool_lock:
+                pool_full = len(_connection_pool) >= MAX_POOL_SIZE
+            if not pool_full:
                 # Reset the connection state
                 connection.ping(reconnect=True)
-                _connection_pool.append(connection)
-            else:
+                with _pool_lock:
+                    pool_full = len(_connection_pool) >= MAX_POOL_SIZE
+                    if not pool_full:
+                        _connection_pool.append(connection)
+            if pool_full:
                 # If pool is full, close the connection
                 connection.close()
     except Exception as e:
-        print(f"Error returning connection to pool: {e}")
+        logger.error(f"Error returning connection to pool: {e}")
         try:
             connection.close()
         except:
             pass
+    finally:
+        _connection_slots.release()
 
 
 
@@ -0,0 +1,283 @@
+"""
+Provider-side context caching for the system prompt and hot documents.
+
+Every chat re-sends the long system prompt, and popular cases are asked about
+over and over. With CONTEXT_CACHE_MODE set, that static context is registered
+once with Gemini's context cache and later completions only send the question
+plus a reference to the cached content, which is billed at the cached-token
+rate:
+
+- off (default): no caching.
+- system: cache the system prompt.
+- documents: additionally, once a document has been chatted about
+  CONTEXT_CACHE_HOT_THRESHOLD times within the TTL, cache the system prompt
+  together with the document's full text. Chats on it then skip retrieval.
+
+Handles are shared by all workers on the host through the local store. A handle
+is reused until less than CONTEXT_CACHE_RENEW_SECONDS of its TTL is left and
+then extended by CONTEXT_CACHE_TTL_SECONDS. If the provider rejects a cache
+(unsupported model, content below the minimum cacheable size, quota), that
+content is not retried for CONTEXT_CACHE_RETRY_SECONDS and callers fall back to
+sending the full prompt.
+
+A document's cache key (a hash of its full text) is remembered per namespace
+in the local store, so its text is only read and hashed once per version of
+the document; forget_document() drops it when the document is re-ingested or
+deleted.
+
+The provider is the "context_cache" service (see services.py), so a local
+stand-in can replace it. GeminiContextCache uses the google-generativeai SDK,
+which is deprecated but still the one with a cachedContents client; it is
+pinned in requirements.txt.
+"""
+import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from cache import LRUCache
+from local_store import ensure_schema, local_db
+from metrics import counter
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_CACHE_MODE = os.environ.get("CONTEXT_CACHE_MODE", "off").lower()
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+CONTEXT_CACHE_RENEW_SECONDS = int(os.environ.get("CONTEXT_CACHE_RENEW_SECONDS", "300"))
+CONTEXT_CACHE_RETRY_SECONDS = int(os.environ.get("CONTEXT_CACHE_RETRY_SECONDS", "600"))
+CONTEXT_CACHE_HOT_THRESHOLD = int(os.environ.get("CONTEXT_CACHE_HOT_THRESHOLD", "5"))
+# Larger documents stay on retrieval: every chat on a cached document is billed
+# for all of its tokens (at the cached rate), against a few retrieved chunks
+CONTEXT_CACHE_MAX_DOCUMENT_TOKENS = int(os.environ.get("CONTEXT_CACHE_MAX_DOCUMENT_TOKENS", "32000"))
+
+if CONTEXT_CACHE_MODE not in ("off", "system", "documents"):
+    logger.warning(f"Unknown CONTEXT_CACHE_MODE {CONTEXT_CACHE_MODE!r}, context caching disabled")
+    CONTEXT_CACHE_MODE = "off"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS context_cache (
+    cache_key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    expire_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS context_cache_document (
+    namespace TEXT NOT NULL,
+    basis TEXT NOT NULL,
+    cache_key TEXT NOT NULL,
+    PRIMARY KEY (namespace, basis)
+);
+CREATE TABLE IF NOT EXISTS context_cache_document_version (
+    namespace TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+CACHE_EVENTS = counter(
+    "caseon_context_cache_events_total",
+    "Context cache handle lifecycle: created, renewed, reused, failed (fell back to the full prompt), discarded.",
+    ("kind", "event"),
+)
+
+
+@dataclass
+class CacheHandle:
+    name: str
+    expire_at: float  # unix time
+
+
+class GeminiContextCache:
+    """Gemini cachedContents API."""
+
+    def __init__(self, model: str):
+        self.model = model if model.startswith("models/") else f"models/{model}"
+        import google.generativeai as genai
+        genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+
+    def create(self, system_instruction: str, document_text: Optional[str], ttl_seconds: int,
+               display_name: str) -> CacheHandle:
+        from google.generativeai import caching
+        cached = caching.CachedContent.create(
+            model=self.model,
+            display_name=display_name,
+            system_instruction=system_instruction,
+            contents=[document_text] if document_text else None,
+            ttl=datetime.timedelta(seconds=ttl_seconds),
+        )
+        return CacheHandle(cached.name, cached.expire_time.timestamp())
+
+    def renew(self, name: str, ttl_seconds: int) -> float:
+        from google.generativeai import caching
+        cached = caching.CachedContent.get(name)
+        cached.update(ttl=datetime.timedelta(seconds=ttl_seconds))
+        return cached.expire_time.timestamp()
+
+    def delete(self, name: str) -> None:
+        from google.generativeai import caching
+        caching.CachedContent.get(name).delete()
+
+
+_lock = threading.Lock()
+_handles: Dict[str, CacheHandle] = {}
+_failed_until: Dict[str, float] = {}
+_flights = SingleFlight("context_cache")
+# namespace -> recent chat timestamps, for deciding which documents are hot
+_document_uses = LRUCache(10000)
+
+
+def enabled() -> bool:
+    return CONTEXT_CACHE_MODE != "off"
+
+
+def documents_enabled() -> bool:
+    return CONTEXT_CACHE_MODE == "documents"
+
+
+def cache_key(model: str, *parts: str) -> str:
+    digest = hashlib.sha256(model.encode())
+    for part in parts:
+        digest.update(b"\0" + part.encode())
+    return digest.hexdigest()[:32]
+
+
+def document_key(namespace: str, model: str, system_instruction: str, load_text: Callable[[], str]) -> Optional[str]:
+    """
+    Cache key for the system instruction plus namespace's full text, or None if
+    the text is empty or over CONTEXT_CACHE_MAX_DOCUMENT_TOKENS. load_text is
+    only called the first time for each version of the document.
+    """
+    # The key is remembered per model and system instruction, which change with deployments
+    basis = cache_key(model, system_instruction)
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        row = conn.execute(
+            "SELECT cache_key FROM context_cache_document WHERE namespace = ? AND basis = ?", (namespace, basis)
+        ).fetchone()
+        if row is not None:
+            return row["cache_key"] or None
+        version = conn.execute(
+            "SELECT version FROM context_cache_document_version WHERE namespace = ?", (namespace,)
+        ).fetchone()
+    text = load_text()
+    # Roughly four characters per token
+    cacheable = text and len(text) // 4 <= CONTEXT_CACHE_MAX_DOCUMENT_TOKENS
+    key = cache_key(model, system_instruction, text) if cacheable else ""
+    with local_db() as conn:
+        # Not if the document changed while its text was read
+        conn.execute(
+            "INSERT OR REPLACE INTO context_cache_document (namespace, basis, cache_key) "
+            "SELECT ?, ?, ? WHERE (SELECT version FROM context_cache_document_version WHERE namespace = ?) IS ?",
+            (namespace, basis, key, namespace, version["version"] if version else None),
+        )
+    return key or None
+
+
+def forget_document(namespace: str) -> None:
+    """Drop the remembered cache keys of namespace's document, which has changed or been deleted."""
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.execute(
+            "INSERT INTO context_cache_document_version (namespace, version) VALUES (?, 1) "
+            "ON CONFLICT (namespace) DO UPDATE SET version = version + 1",
+            (namespace,),
+        )
+        conn.execute("DELETE FROM context_cache_document WHERE namespace = ?", (namespace,))
+
+
+def note_document_use(namespace: str) -> bool:
+    """Record a chat on namespace and return whether it is now hot enough to cache."""
+    now = time.time()
+    with _lock:
+        uses = _document_uses.get(namespace)
+        if uses is None:
+            uses = deque(maxlen=CONTEXT_CACHE_HOT_THRESHOLD)
+            _document_uses.put(namespace, uses)
+        uses.append(now)
+        return len(uses) >= CONTEXT_CACHE_HOT_THRESHOLD and now - uses[0] <= CONTEXT_CACHE_TTL_SECONDS
+
+
+def _load_persisted(key: str) -> Optional[CacheHandle]:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        row = conn.execute("SELECT name, expire_at FROM context_cache WHERE cache_key = ?", (key,)).fetchone()
+    return CacheHandle(row["name"], row["expire_at"]) if row else None
+
+
+def _persist(key: str, handle: Optional[CacheHandle]) -> None:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        if handle is None:
+            conn.execute("DELETE FROM context_cache WHERE cache_key = ?", (key,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO context_cache (cache_key, name, expire_at) VALUES (?, ?, ?)",
+                (key, handle.name, handle.expire_at),
+            )
+
+
+def _refresh(key: str, kind: str, system_instruction: str,
+             document_text: Optional[Callable[[], str]]) -> Optional[str]:
+    import services
+    now = time.time()
+    # Another worker may have created or renewed it in the meantime
+    handle = _load_persisted(key) or _handles.get(key)
+    if handle is not None and handle.expire_at - now > CONTEXT_CACHE_RENEW_SECONDS:
+        _handles[key] = handle
+        return handle.name
+    backend = services.get_context_cache()
+    try:
+        if handle is not None and handle.expire_at - now > 5:
+            handle = CacheHandle(handle.name, backend.renew(handle.name, CONTEXT_CACHE_TTL_SECONDS))
+            event = "renewed"
+        else:
+            text = document_text() if document_text else None
+            handle = backend.create(system_instruction, text, CONTEXT_CACHE_TTL_SECONDS, f"caseon-{kind}-{key[:8]}")
+            event = "created"
+    except Exception as e:
+        logger.warning(f"Context cache ({kind}) unavailable, sending full prompts: {e}")
+        CACHE_EVENTS.inc(kind=kind, event="failed")
+        _failed_until[key] = now + CONTEXT_CACHE_RETRY_SECONDS
+        _handles.pop(key, None)
+        _persist(key, None)
+        return None
+    CACHE_EVENTS.inc(kind=kind, event=event)
+    _handles[key] = handle
+    _persist(key, handle)
+    return handle.name
+
+
+def get_handle(key: str, kind: str, system_instruction: str,
+               document_text: Optional[Callable[[], str]] = None) -> Optional[str]:
+    """
+    Name of a live cached-content handle for this content, creating or renewing
+    it as needed, or None when caching is unavailable for it. document_text
+    loads the document to cache, and is only called to create a new handle.
+    """
+    now = time.time()
+    if _failed_until.get(key, 0) > now:
+        return None
+    handle = _handles.get(key)
+    if handle is not None and handle.expire_at - now > CONTEXT_CACHE_RENEW_SECONDS:
+        CACHE_EVENTS.inc(kind=kind, event="reused")
+        return handle.name
+    return _flights.do(key, lambda: _refresh(key, kind, system_instruction, document_text))
+
+
+def discard(name: str) -> None:
+    """Forget a handle the provider no longer accepts (e.g. deleted or expired early)."""
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        keys = {row["cache_key"] for row in conn.execute("SELECT cache_key FROM context_cache WHERE name = ?", (name,))}
+        conn.execute("DELETE FROM context_cache WHERE name = ?", (name,))
+    with _lock:
+        keys.update(key for key, handle in _handles.items() if handle.name == name)
+    retry_at = time.time() + CONTEXT_CACHE_RETRY_SECONDS
+    for key in keys:
+        _handles.pop(key, None)
+        _failed_until[key] = retry_at
+    CACHE_EVENTS.inc(kind="any", event="discarded")
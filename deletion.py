@@ -0,0 +1,326 @@
+"""
+Deleting documents, and reconciling Pinecone namespaces with their routes.
+
+delete_document() removes everything stored for a namespace:
+
+- its vectors. The allocator counts a Pinecone index's live namespaces, so
+  this frees the slot for the next upload.
+- its row in volume_handling_table.
+- its column in cat_is_trending, unless another namespace maps to the same one.
+- its local state: chunk texts, manifest, upsert checkpoint, whole-document
+  text, precomputed answers, fingerprint, hot tier matrix, shared cache
+  entries, remembered context cache keys and chat sessions.
+
+Namespaces aliasing the document get their own copy first (see
+fingerprints.py), so deleting a document never breaks its duplicates.
+Deleting an alias only removes the alias. Local state is removed on the host
+that handles the request, as with every other local-store table.
+
+reconcile() finds orphans, in the indexes of every project configured in this
+environment:
+
+- vectors: a namespace in Pinecone that no route points to. Typically an
+  upload whose route was deleted while deleting its vectors failed.
+- route: a route to an index that does not hold the namespace, or no longer
+  exists. Typically an upload that failed after its index was allocated.
+
+An ingestion that is still running briefly looks like an orphan too. So
+orphans are recorded in the local store, and only cleaned up once they have
+been seen for RECONCILE_GRACE_SECONDS. Run it periodically, e.g.
+`python shard_admin.py reconcile --apply` from cron.
+"""
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Set
+
+from local_store import ensure_schema, local_db
+from metrics import counter, stage
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_GRACE_SECONDS = float(os.environ.get("RECONCILE_GRACE_SECONDS", "3600"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reconcile_orphan (
+    kind TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    index_name TEXT NOT NULL,
+    project TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    PRIMARY KEY (kind, namespace, index_name, project)
+);
+"""
+
+DELETIONS = counter(
+    "caseon_namespace_deletions_total",
+    "Namespaces deleted, by trigger (api, reconcile) and what was removed (document, alias, vectors, route).",
+    ("trigger", "kind"),
+)
+
+
+TRENDING_DROP_FAILURES = counter(
+    "caseon_trending_column_drop_failures_total",
+    "Deletions whose cat_is_trending columns could not be dropped.",
+)
+
+
+class NamespaceNotFound(Exception):
+    """Nothing is stored for this namespace."""
+
+
+def exists(namespace: str) -> bool:
+    """Whether anything is stored for namespace: a route, an alias, a whole document or a fingerprint."""
+    import fingerprints
+    import shared_cache
+    import whole_document
+
+    index_name, project = shared_cache.get_route(namespace)
+    return (bool(index_name and project) or fingerprints.resolve(namespace) != namespace
+            or whole_document.has(namespace) or fingerprints.fingerprint_of(namespace) is not None)
+
+
+def forget_locally(namespace: str) -> None:
+    """Drop everything this host stores for namespace, besides alias records."""
+    import chunk_manifest
+    import chunk_store
+    import context_cache
+    import fingerprints
+    import hot_tier
+    import precomputed_answers
+    import sessions
+    import shared_cache
+    import upsert_engine
+    import whole_document
+
+    shared_cache.invalidate_namespace(namespace)
+    context_cache.forget_document(namespace)
+    hot_tier.evict(namespace)
+    precomputed_answers.delete_namespace(namespace)
+    whole_document.delete(namespace)
+    chunk_store.delete_namespace(namespace)
+    chunk_manifest.delete_manifest(namespace)
+    upsert_engine.clear(namespace)
+    fingerprints.forget(namespace)
+    sessions.delete_namespace(namespace)
+
+
+def _trending_columns_in_use(excluding: Set[str]) -> Optional[Set[str]]:
+    """
+    The cat_is_trending columns of routed, aliased and whole-document namespaces
+    besides those excluded. None if the routes could not be read.
+    """
+    import fingerprints
+    import whole_document
+    from add_one_column import trending_column_name
+    from pinecone_index_manager import get_routed_namespaces
+
+    routed = get_routed_namespaces()
+    if routed is None:
+        return None
+    live = set(routed) | set(fingerprints.aliased_namespaces()) | set(whole_document.namespaces())
+    return {trending_column_name(ns) for ns in live - excluding}
+
+
+def drop_trending(namespaces: List[str]) -> bool:
+    """
+    Drop the namespaces' cat_is_trending columns in one statement. Failures are logged and counted.
+
+    Sanitizing can map several namespaces to one column ("a-b" and "ab"), so a
+    column that another live namespace still counts into is kept.
+    """
+    from add_one_column import drop_columns, trending_column_name
+
+    in_use = _trending_columns_in_use(set(namespaces))
+    if in_use is None:
+        ok, message = False, "could not read the routes"
+    else:
+        shared = {ns for ns in namespaces if trending_column_name(ns) in in_use}
+        if shared:
+            logger.info(f"Keeping the trending columns of {sorted(shared)}, shared with other namespaces")
+        ok, message = drop_columns([ns for ns in namespaces if ns not in shared])
+    if not ok:
+        TRENDING_DROP_FAILURES.inc()
+        logger.warning(f"Could not drop the trending columns of {len(namespaces)} namespaces: {message}")
+    return ok
+
+
+def _delete_vectors(index_name: str, project: str, namespace: str) -> None:
+    import shard_map
+    index = shard_map.get_index(index_name, project)
+    try:
+        index.delete(delete_all=True, namespace=namespace)
+    except Exception as e:
+        # Serverless indexes answer 404 for a namespace with no vectors left
+        if getattr(e, "status", None) != 404:
+            raise
+
+
+def delete_document(namespace: str, trigger: str = "api") -> Dict:
+    """Delete everything stored for namespace. Raises NamespaceNotFound if there is nothing."""
+    import fingerprints
+    import whole_document
+    from pinecone_index_manager import delete_cases, get_index_project_by_namespace
+
+    with stage("deletion", "routing_lookup"):
+        index_name, project = get_index_project_by_namespace(namespace)
+    routed = bool(index_name and project)
+
+    if fingerprints.unalias(namespace):
+        # An alias has no vectors or route of its own
+        with stage("deletion", "local_state"):
+            forget_locally(namespace)
+        with stage("deletion", "trending_column"):
+            trending_dropped = drop_trending([namespace])
+        DELETIONS.inc(trigger=trigger, kind="alias")
+        logger.info(f"Deleted alias {namespace}")
+        return {"namespace": namespace, "alias": True, "vectors_deleted": False, "aliases_detached": 0,
+                "trending_dropped": trending_dropped}
+
+    if not routed and not whole_document.has(namespace) and fingerprints.fingerprint_of(namespace) is None:
+        raise NamespaceNotFound(namespace)
+
+    aliases = fingerprints.aliases_of(namespace)
+    if aliases:
+        with stage("deletion", "detach_aliases"):
+            fingerprints.detach_aliases(namespace)
+
+    # Vectors go first: if that fails nothing else has changed and the delete can simply be retried
+    if routed:
+        with stage("deletion", "delete_vectors"):
+            _delete_vectors(index_name, project, namespace)
+        with stage("deletion", "delete_route"):
+            if delete_cases([namespace]) is None:
+                raise RuntimeError(f"Could not delete the route of {namespace}; its vectors are already deleted")
+    with stage("deletion", "trending_column"):
+        trending_dropped = drop_trending([namespace])
+    with stage("deletion", "local_state"):
+        forget_locally(namespace)
+
+    DELETIONS.inc(trigger=trigger, kind="document")
+    logger.info(f"Deleted {namespace}" + (f" from {index_name} in {project}" if routed else ""))
+    return {"namespace": namespace, "alias": False, "vectors_deleted": routed, "aliases_detached": len(aliases),
+            "trending_dropped": trending_dropped}
+
+
+def find_orphans() -> List[Dict]:
+    """Orphaned namespaces, as dicts of kind (vectors, route), namespace, index_name and project."""
+    import shard_map
+    from pinecone_index_manager import get_routed_indexes, get_routes_by_index
+    from query import response_field
+
+    orphans = []
+    listed = set()
+    configured = set()
+    for project in shard_map.get_shard_map().projects:
+        if not project.is_configured:
+            logger.warning(f"Skipping project {project.name}: its API key is not set in this environment")
+            continue
+        configured.add(project.name)
+        for description in shard_map.get_pinecone_client(project.name).list_indexes():
+            index_name = description.name
+            listed.add((index_name, project.name))
+            stats = shard_map.get_index(index_name, project.name).describe_index_stats()
+            live = {ns for ns in (response_field(stats, "namespaces") or {}) if ns}
+            routes = get_routes_by_index(index_name)
+            if routes is None:
+                raise RuntimeError("Could not read volume_handling_table")
+            routed = {ns for ns, routed_project in routes.items() if routed_project == project.name}
+            orphans += [{"kind": "vectors", "namespace": ns, "index_name": index_name, "project": project.name}
+                        for ns in sorted(live - routed)]
+            orphans += [{"kind": "route", "namespace": ns, "index_name": index_name, "project": project.name}
+                        for ns in sorted(routed - live)]
+
+    routed_indexes = get_routed_indexes()
+    if routed_indexes is None:
+        raise RuntimeError("Could not read volume_handling_table")
+    for index_name, project in routed_indexes:
+        # Routes to an index that was deleted from a project we can see
+        if project in configured and (index_name, project) not in listed:
+            orphans += [{"kind": "route", "namespace": ns, "index_name": index_name, "project": project}
+                        for ns, routed_project in sorted((get_routes_by_index(index_name) or {}).items())
+                        if routed_project == project]
+    return orphans
+
+
+def _track(orphans: List[Dict]) -> Dict[tuple, float]:
+    """Record when each orphan was first seen and forget those that are gone; returns first_seen by key."""
+    ensure_schema(_SCHEMA)
+    now = time.time()
+    keys = [(o["kind"], o["namespace"], o["index_name"], o["project"]) for o in orphans]
+    with local_db() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO reconcile_orphan (kind, namespace, index_name, project, first_seen) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [key + (now,) for key in keys],
+        )
+        seen = {(row["kind"], row["namespace"], row["index_name"], row["project"]): row["first_seen"]
+                for row in conn.execute("SELECT * FROM reconcile_orphan")}
+        current = set(keys)
+        gone = [key for key in seen if key not in current]
+        conn.executemany(
+            "DELETE FROM reconcile_orphan WHERE kind = ? AND namespace = ? AND index_name = ? AND project = ?", gone
+        )
+    return {key: seen[key] for key in keys}
+
+
+def _clean(due: List[Dict]) -> int:
+    from pinecone_index_manager import delete_cases, get_routes_by_namespaces
+
+    cleaned = []
+    forgotten = []
+    vectors = [o for o in due if o["kind"] == "vectors"]
+    # Some may be stale copies of a namespace that now lives in another index
+    routed_elsewhere = get_routes_by_namespaces([o["namespace"] for o in vectors])
+    for orphan in vectors:
+        try:
+            _delete_vectors(orphan["index_name"], orphan["project"], orphan["namespace"])
+        except Exception as e:
+            logger.warning(f"Deleting orphaned vectors of {orphan['namespace']} failed: {e}")
+            continue
+        if orphan["namespace"] not in routed_elsewhere:
+            forget_locally(orphan["namespace"])
+            forgotten.append(orphan["namespace"])
+        cleaned.append(orphan)
+        DELETIONS.inc(trigger="reconcile", kind="vectors")
+
+    routes = [o for o in due if o["kind"] == "route"]
+    if routes:
+        namespaces = [o["namespace"] for o in routes]
+        if delete_cases(namespaces) is None:
+            logger.warning(f"Deleting {len(routes)} orphaned routes failed")
+        else:
+            for namespace in namespaces:
+                forget_locally(namespace)
+            forgotten += namespaces
+            cleaned += routes
+            DELETIONS.inc(len(routes), trigger="reconcile", kind="route")
+
+    if forgotten:
+        drop_trending(forgotten)
+
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.executemany(
+            "DELETE FROM reconcile_orphan WHERE kind = ? AND namespace = ? AND index_name = ? AND project = ?",
+            [(o["kind"], o["namespace"], o["index_name"], o["project"]) for o in cleaned],
+        )
+    return len(cleaned)
+
+
+def reconcile(apply: bool = False, grace_seconds: Optional[float] = None) -> Dict:
+    """
+    Find orphans and, with apply, clean up those seen for at least grace_seconds
+    (RECONCILE_GRACE_SECONDS by default). Returns a report.
+    """
+    grace = RECONCILE_GRACE_SECONDS if grace_seconds is None else grace_seconds
+    orphans = find_orphans()
+    first_seen = _track(orphans)
+    now = time.time()
+    for orphan in orphans:
+        key = (orphan["kind"], orphan["namespace"], orphan["index_name"], orphan["project"])
+        orphan["age_seconds"] = round(now - first_seen[key], 1)
+    due = [o for o in orphans if o["age_seconds"] >= grace]
+    cleaned = _clean(due) if apply and due else 0
+    logger.info(f"Reconciliation found {len(orphans)} orphans, {len(due)} past the grace period, cleaned {cleaned}")
+    return {"orphans": orphans, "due": len(due), "cleaned": cleaned}
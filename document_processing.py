@@ -1,26 +1,34 @@
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_pinecone import PineconeVectorStore
-from pinecone import Pinecone
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import logging
 import os
-from langchain_community.document_loaders import PyPDFLoader
 from add_one_column import add_one_to_column
 import requests
-import os
 from contextlib import contextmanager
 import tempfile
-from volume_handler import main_function
-from pinecone_index_manager import get_index_namespace_and_project
-import gc
+from volume_handler import allocate_namespace
+from pinecone_index_manager import get_index_project_by_namespace
+from metrics import stage
+import chunk_manifest
+import chunk_store
+import context_cache
+import fingerprints
+import hot_tier
+import precomputed_answers
+import preflight
+import services
+import shard_map
+import shared_cache
+import upsert_engine
+import whole_document
 
-PROJECT_1 = "QA1"
-PROJECT_2 = "QA2"
+logger = logging.getLogger(__name__)
 
 
 @contextmanager
-def safe_pdf_download(url):
+def safe_pdf_download(url, max_bytes=0):
     """
     Context manager for safely downloading and cleaning up PDF files.
+
+    Downloads larger than max_bytes (0: no limit) are aborted with PreflightRejected.
     """
     temp_file = None
     response = None
@@ -35,14 +43,24 @@ def safe_pdf_download(url):
             'Connection': 'keep-alive'
         }
         
-        response = requests.get(url, headers=headers, stream=True, timeout=30)
-        response.raise_for_status()
-        
-        # Write to temporary file
-        with open(temp_file.name, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+        with stage("ingestion", "pdf_download"):
+            response = requests.get(url, headers=headers, stream=True, timeout=30)
+            response.raise_for_status()
+            declared = int(response.headers.get("Content-Length") or 0)
+            if max_bytes and declared > max_bytes:
+                raise preflight.reject("too_large", f"too large: {declared} > {max_bytes} bytes", {"bytes": declared})
+            
+            # Write to temporary file
+            received = 0
+            with open(temp_file.name, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    if chunk:
+                        received += len(chunk)
+                        # Content-Length may be missing or wrong
+                        if max_bytes and received > max_bytes:
+                            raise preflight.reject("too_large", f"too large: over {max_bytes} bytes",
+                                                   {"bytes": received})
+                        f.write(chunk)
         
         yield temp_file.name
         
@@ -56,7 +74,7 @@ def safe_pdf_download(url):
                 if os.path.exists(temp_file.name):
                     os.unlink(temp_file.name)
             except Exception as e:
-                print(f"Warning: Failed to delete temporary file: {e}")
+                logger.warning(f"Failed to delete temporary file: {e}")
 
 def process_pdf_safely(loader):
     """
@@ -69,7 +87,7 @@ def process_pdf_safely(loader):
             page.metadata['page'] = page.metadata['page'] + 1
         return pages
     except Exception as e:
-        print(f"Error loading PDF: {e}")
+        logger.error(f"Error loading PDF: {e}")
         raise
     finally:
         # Ensure the loader's resources are cleaned up
@@ -79,76 +97,252 @@ def process_pdf_safely(loader):
             except:
                 pass
 
-def document_chunking_and_uploading_to_vectorstore(link, name_space):
+# Pinecone accepts at most 1000 IDs per delete request
+DELETE_BATCH_SIZE = 1000
+
+
+def load_and_split_pdf(pdf_path):
+    """Load a downloaded PDF and split it into the chunks that get embedded."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from langchain_community.document_loaders import PyPDFLoader
+
+    # Load and process PDF
+    with stage("ingestion", "pdf_load"):
+        loader = PyPDFLoader(file_path=pdf_path)
+        docs = process_pdf_safely(loader)
+
+    # Configure text splitter
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=512,
+        chunk_overlap=50,
+        add_start_index=True,
+    )
+
+    # Split documents
+    with stage("ingestion", "split"):
+        all_splits = text_splitter.split_documents(docs)
+    return docs, all_splits
+
+
+def vector_metadata(doc):
+    """Pinecone metadata for a chunk: loader metadata plus text, or nothing when texts live in the chunk store"""
+    if not chunk_store.CHUNK_TEXT_IN_METADATA:
+        return {}
+    metadata = dict(doc.metadata)
+    metadata["text"] = doc.page_content
+    return metadata
+
+
+def upsert_chunks(index, embeddings, name_space, docs, vector_ids):
+    """Embed docs and upsert them under the given IDs (see upsert_engine.py). Returns the number upserted now."""
+    return upsert_engine.upsert(index, embeddings, name_space, [
+        (vid, doc.page_content, vector_metadata(doc)) for doc, vid in zip(docs, vector_ids)
+    ])
+
+
+def store_chunk_texts(name_space, docs, entries):
+    chunk_store.put_chunks(name_space, [
+        (vid, doc.page_content, {
+            "page": doc.metadata.get("page"),
+            "start_index": doc.metadata.get("start_index"),
+            "chunk_index": position,
+        })
+        for position, (doc, (vid, _, _)) in enumerate(zip(docs, entries))
+    ])
+
+
+def delete_vectors(index, name_space, vector_ids):
+    for start in range(0, len(vector_ids), DELETE_BATCH_SIZE):
+        index.delete(ids=vector_ids[start:start + DELETE_BATCH_SIZE], namespace=name_space)
+
+
+def serve_duplicate(link, name_space, content_hash=None):
+    """Reuse an ingested copy of the document for name_space (see fingerprints.py). Returns the reply, or None."""
+    with stage("ingestion", "duplicate_lookup"):
+        source = fingerprints.reuse(name_space, link, content_hash)
+    if source is None:
+        return None
+    with stage("ingestion", "trending_column"):
+        add_one_to_column(name_space)
+    logger.info(f"Duplicate of {source}, served without processing")
+    return f"This PDF ID is: {name_space}"
+
+
+def estimate_upload(link, pdf_path, name_space, content_hash, limits):
+    """The dry-run reply: the preflight estimate, and which ingested document it duplicates, if any."""
+    with stage("ingestion", "preflight"):
+        result = preflight.dry_run(pdf_path, limits)
+    duplicate = fingerprints.find_by_hash(content_hash, name_space or "") if fingerprints.enabled() else None
+    result["duplicate_of"] = fingerprints.resolve(duplicate) if duplicate else None
+    result["dry_run"] = True
+    logger.info(f"Dry run of {link}: {result['estimate']}")
+    return result
+
+
+def document_chunking_and_uploading_to_vectorstore(link, name_space, reingest=False, key_id=None, dry_run=False):
     """
     Process PDF document with proper resource management and error handling
+
+    Vectors get deterministic IDs (see chunk_manifest.py). With reingest=True the
+    document replaces an earlier upload under the same namespace: only chunks that
+    are new or changed are embedded and upserted, and chunks that disappeared are
+    deleted from the index.
+
+    Documents short enough for whole-document mode also have their full text
+    stored locally, and skip vectors entirely when WHOLE_DOCUMENT_VECTORIZE=false.
+
+    Chunks are upserted in parallel batches, and an ingestion that failed part
+    way resumes from its last committed batch when it is submitted again (see
+    upsert_engine.py).
+
+    New uploads whose content was ingested before are copied or aliased from the
+    earlier namespace instead of being processed again (see fingerprints.py).
+
+    Every download passes the preflight checks for key_id's limits before it is
+    parsed (see preflight.py). With dry_run=True nothing is stored: the reply is
+    the preflight estimate instead.
     """
-    vector_store = None
-    pc = None
     index = None
     embeddings = None
+    docs = None
+    all_splits = None
+    
+    limits = preflight.limits_for(key_id)
     
     try:
-        index_name = main_function(name_space)
-        
+        if not reingest and not dry_run and fingerprints.FINGERPRINT_TRUST_URL:
+            reply = serve_duplicate(link, name_space)
+            if reply:
+                return reply
+
         # Use context manager for safe PDF download
-        with safe_pdf_download(link) as pdf_path:
-            add_one_to_column(name_space)
-
-            embeddings = GoogleGenerativeAIEmbeddings(
-                model="models/embedding-001",
-                google_api_key=os.environ["GOOGLE_API_KEY"]
-            )
-            print(f"Using index: {index_name}")
-            namespace_text, project = get_index_namespace_and_project(index_name)
-            
-            if project == PROJECT_1:
-                pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
-            elif project == PROJECT_2:
-                pc = Pinecone(api_key=os.environ["PINECONE_API_KEY_SECOND_PROJECT"])
+        max_bytes = limits.max_bytes if preflight.PREFLIGHT_ENABLED else 0
+        with safe_pdf_download(link, max_bytes) as pdf_path:
+            content_hash = fingerprints.file_hash(pdf_path)
+            if dry_run:
+                return estimate_upload(link, pdf_path, name_space, content_hash, limits)
+            if not reingest:
+                reply = serve_duplicate(link, name_space, content_hash)
+                if reply:
+                    return reply
+
+            # Duplicates are served above without parsing, so only new content is checked
+            if preflight.PREFLIGHT_ENABLED:
+                with stage("ingestion", "preflight"):
+                    preflight.check(pdf_path, limits)
+
+            docs, all_splits = load_and_split_pdf(pdf_path)
+            if not all_splits:
+                raise ValueError("No document splits were created")
+
+            # Short documents are answered from their full text (see whole_document.py)
+            pages = whole_document.page_texts(docs)
+            whole = whole_document.fits(pages)
+
+            index_name = project = None
+            if reingest:
+                with stage("ingestion", "routing_lookup"):
+                    index_name, project = get_index_project_by_namespace(name_space)
+                # An alias becomes an ordinary namespace; aliases of this one keep the old content
+                was_alias = fingerprints.unalias(name_space)
+                if not was_alias:
+                    if not (index_name and project) and not whole_document.has(name_space):
+                        raise ValueError(f"Cannot re-ingest unknown namespace: {name_space}")
+                    with stage("ingestion", "detach_aliases"):
+                        fingerprints.detach_aliases(name_space)
+                # Answers about the old version of the document must not be served
+                precomputed_answers.delete_namespace(name_space)
+                shared_cache.invalidate_namespace(name_space)
+                context_cache.forget_document(name_space)
+                hot_tier.evict(name_space)
             else:
-                raise ValueError(f"Invalid project: {project}")
-                
-            index = pc.Index(index_name)
-            
-            vector_store = PineconeVectorStore(
-                embedding=embeddings,
-                index=index,
-                namespace=name_space
-            )
-
-            # Load and process PDF
-            loader = PyPDFLoader(file_path=pdf_path)
-            docs = process_pdf_safely(loader)
-
-            # Configure text splitter
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=512,
-                chunk_overlap=50,
-                add_start_index=True,
-            )
-
-            # Split documents
-            all_splits = text_splitter.split_documents(docs)
-            
-            # Add to vector store
-            if all_splits:
-                vector_store.add_documents(documents=all_splits)
-                print(f"Processed {len(docs)} pages into {len(all_splits)} chunks")
+                with stage("ingestion", "trending_column"):
+                    add_one_to_column(name_space)
+
+            with stage("ingestion", "store_document"):
+                if whole:
+                    whole_document.save(name_space, pages)
+                elif reingest:
+                    whole_document.delete(name_space)
+
+            # A namespace that already has vectors keeps them up to date, so any instance can fall back to retrieval
+            if whole and not whole_document.WHOLE_DOCUMENT_VECTORIZE and not index_name:
+                logger.info(f"Stored {len(docs)} pages as a whole document, no vectors uploaded")
+                fingerprints.register(name_space, content_hash, link)
+                # Chats during the upload may have cached answers about the old version
+                shared_cache.invalidate_namespace(name_space)
+                context_cache.forget_document(name_space)
+                precomputed_answers.schedule(name_space)
+                if reingest:
+                    return f"This PDF ID is: {name_space} (re-ingested as a whole document)"
                 return f"This PDF ID is: {name_space}"
+
+            if not index_name:
+                with stage("ingestion", "index_allocation"):
+                    index_name, project = allocate_namespace(name_space)
+            logger.info(f"Using index: {index_name} in project {project}")
+
+            with stage("ingestion", "client_setup"):
+                embeddings = services.get_embeddings()
+                index = shard_map.get_index(index_name, project)
+
+            entries = chunk_manifest.assign_ids(name_space, all_splits)
+            if reingest and chunk_manifest.has_manifest(name_space):
+                to_upsert, to_delete = chunk_manifest.diff(name_space, entries)
             else:
-                raise ValueError("No document splits were created")
+                to_upsert, to_delete = list(range(len(entries))), []
+                if reingest:
+                    # Uploaded before IDs were deterministic: nothing to diff against
+                    with stage("ingestion", "delete_stale"):
+                        index.delete(delete_all=True, namespace=name_space)
+                        chunk_store.delete_namespace(name_space)
+                        upsert_engine.clear(name_space)
+            # Chunks an interrupted run upserted that this version no longer has
+            current_ids = {vid for vid, _, _ in entries}
+            to_delete += sorted(upsert_engine.committed(name_space) - current_ids - set(to_delete))
+            
+            # Texts go to the local chunk store first so they can be hydrated as soon as vectors exist
+            with stage("ingestion", "store_chunks"):
+                store_chunk_texts(name_space, all_splits, entries)
+
+            # Add to vector store
+            upserted = 0
+            if to_upsert:
+                with stage("ingestion", "embed_and_upsert"):
+                    upserted = upsert_chunks(
+                        index,
+                        embeddings,
+                        name_space,
+                        [all_splits[i] for i in to_upsert],
+                        [entries[i][0] for i in to_upsert],
+                    )
+            if to_delete:
+                with stage("ingestion", "delete_stale"):
+                    delete_vectors(index, name_space, to_delete)
+                    chunk_store.delete_chunks(to_delete)
+            chunk_manifest.save_manifest(name_space, entries)
+            upsert_engine.clear(name_space)
+            fingerprints.register(name_space, content_hash, link)
+            # Again: chats during the upload read a mix of old and new chunks, and may have cached
+            # answers or the document's cache key from it
+            shared_cache.invalidate_namespace(name_space)
+            context_cache.forget_document(name_space)
+
+            logger.info(f"Processed {len(docs)} pages into {len(all_splits)} chunks "
+                  f"({upserted} upserted, {len(to_upsert) - upserted} resumed, {len(to_delete)} deleted)")
+            precomputed_answers.schedule(name_space)
+            if reingest:
+                return (f"This PDF ID is: {name_space} (re-ingested: {len(to_upsert)} chunks updated, "
+                        f"{len(to_delete)} removed, {len(entries) - len(to_upsert)} unchanged)")
+            return f"This PDF ID is: {name_space}"
 
     except Exception as e:
-        print(f"Error processing PDF: {e}")
+        logger.error(f"Error processing PDF: {e}")
         raise
 
     finally:
-        # Explicitly clear variables to help garbage collection
+        # Release page and chunk lists; collection is left to the memory policy
         if docs:
             docs.clear()
         if all_splits:
             all_splits.clear()
-            
-        # Force garbage collection
-        gc.collect()
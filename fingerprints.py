@@ -0,0 +1,279 @@
+"""
+Registry of ingested documents by content fingerprint, for reusing duplicates.
+
+Every successful ingestion records the sha256 of the downloaded PDF and its
+source URL against the namespace it was stored under. When a later upload has
+the same fingerprint, FINGERPRINT_DEDUPE decides what happens instead of
+parsing, embedding and upserting the document again:
+
+- off: no reuse, every upload is processed in full.
+- copy (default): the new namespace gets its own copy of the vectors, fetched
+  from the original and upserted under the new namespace's IDs, together with
+  the chunk texts, manifest, whole-document text and precomputed answers. No
+  embedding calls; the copies are independent from then on.
+- alias: the new namespace is recorded as an alias of the original and chats
+  on it are served from the original's data. Nothing is copied and no index
+  slot is used. Aliases live in the local store, so only use this when
+  LOCAL_DATA_DIR is shared by every instance.
+
+Re-ingesting a namespace that others alias first gives each alias its own copy,
+so they keep answering about the content they were uploaded with; re-ingesting
+an alias turns it into an ordinary namespace.
+
+With FINGERPRINT_TRUST_URL=true an upload from a URL seen before is treated as
+a duplicate without downloading it; only enable it for sources whose URLs never
+change content.
+"""
+import hashlib
+import logging
+import os
+import time
+from typing import List, Optional
+
+from local_store import ensure_schema, local_db
+from metrics import counter, stage
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_DEDUPE = os.environ.get("FINGERPRINT_DEDUPE", "copy").lower()
+FINGERPRINT_TRUST_URL = os.environ.get("FINGERPRINT_TRUST_URL", "false").lower() == "true"
+
+if FINGERPRINT_DEDUPE not in ("off", "copy", "alias"):
+    logger.warning(f"Unknown FINGERPRINT_DEDUPE {FINGERPRINT_DEDUPE!r}, duplicate reuse disabled")
+    FINGERPRINT_DEDUPE = "off"
+
+# Pinecone fetch requests carry the IDs in the URL; keep them short
+_FETCH_BATCH = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS document_fingerprint (
+    namespace TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    source_url TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS document_fingerprint_hash ON document_fingerprint (content_hash);
+CREATE INDEX IF NOT EXISTS document_fingerprint_url ON document_fingerprint (source_url);
+CREATE TABLE IF NOT EXISTS namespace_alias (
+    namespace TEXT PRIMARY KEY,
+    canonical TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS namespace_alias_canonical ON namespace_alias (canonical);
+"""
+
+DUPLICATES = counter(
+    "caseon_duplicate_uploads_total",
+    "Uploads recognised as duplicates of an ingested document, by how they were served (copied, aliased, failed).",
+    ("action", "matched_by"),
+)
+
+
+def enabled() -> bool:
+    return FINGERPRINT_DEDUPE != "off"
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def register(namespace: str, content_hash: str, source_url: str) -> None:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO document_fingerprint (namespace, content_hash, source_url, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (namespace, content_hash, source_url, time.time()),
+        )
+
+
+def forget(namespace: str) -> None:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.execute("DELETE FROM document_fingerprint WHERE namespace = ?", (namespace,))
+
+
+def _find(column: str, value: str, exclude: str) -> Optional[str]:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        row = conn.execute(
+            f"SELECT namespace, content_hash FROM document_fingerprint WHERE {column} = ? AND namespace != ? "
+            "ORDER BY created_at LIMIT 1",
+            (value, exclude),
+        ).fetchone()
+    return row["namespace"] if row else None
+
+
+def find_by_hash(content_hash: str, exclude: str) -> Optional[str]:
+    """The earliest namespace other than exclude holding this content."""
+    return _find("content_hash", content_hash, exclude)
+
+
+def find_by_url(source_url: str, exclude: str) -> Optional[str]:
+    return _find("source_url", source_url, exclude)
+
+
+def fingerprint_of(namespace: str) -> Optional[str]:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        row = conn.execute("SELECT content_hash FROM document_fingerprint WHERE namespace = ?", (namespace,)).fetchone()
+    return row["content_hash"] if row else None
+
+
+def resolve(namespace: str) -> str:
+    """The namespace whose data serves chats on namespace: its canonical one for an alias, else itself."""
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        row = conn.execute("SELECT canonical FROM namespace_alias WHERE namespace = ?", (namespace,)).fetchone()
+    return row["canonical"] if row else namespace
+
+
+def aliases_of(namespace: str) -> List[str]:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        return [row["namespace"] for row in
+                conn.execute("SELECT namespace FROM namespace_alias WHERE canonical = ?", (namespace,))]
+
+
+def aliased_namespaces() -> List[str]:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        return [row["namespace"] for row in conn.execute("SELECT namespace FROM namespace_alias")]
+
+
+def unalias(namespace: str) -> bool:
+    """Drop namespace's alias record. Returns whether it was an alias."""
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        return conn.execute("DELETE FROM namespace_alias WHERE namespace = ?", (namespace,)).rowcount > 0
+
+
+def _stored(namespace: str) -> bool:
+    import whole_document
+    from pinecone_index_manager import get_index_project_by_namespace
+    index_name, project = get_index_project_by_namespace(namespace)
+    return bool(index_name and project) or whole_document.has(namespace)
+
+
+def _alias(canonical: str, namespace: str) -> None:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO namespace_alias (namespace, canonical, created_at) VALUES (?, ?, ?)",
+            (namespace, canonical, time.time()),
+        )
+
+
+def copy_namespace(source: str, target: str) -> int:
+    """
+    Give target its own copy of source's vectors, chunk texts, manifest,
+    whole-document text and precomputed answers. Returns the number of vectors
+    copied. Needs source's chunk manifest for vectors.
+    """
+    import chunk_manifest
+    import chunk_store
+    import context_cache
+    import precomputed_answers
+    import resilience
+    import shard_map
+    import whole_document
+    import workloads
+    from pinecone_index_manager import get_index_project_by_namespace
+    from query import response_field
+    from volume_handler import allocate_namespace
+
+    source_index_name, source_project = get_index_project_by_namespace(source)
+    entries = chunk_manifest.load_entries(source) if source_index_name and source_project else []
+    if source_index_name and source_project and not entries:
+        raise ValueError(f"No chunk manifest for {source}, its vectors cannot be copied")
+
+    if entries:
+        with stage("ingestion", "index_allocation"):
+            index_name, project = allocate_namespace(target)
+        source_index = shard_map.get_index(source_index_name, source_project)
+        target_index = shard_map.get_index(index_name, project)
+        # source vector ID -> target vector ID
+        new_ids = {vid: chunk_manifest.vector_id(target, content_hash, position) for vid, content_hash, position in entries}
+        source_ids = list(new_ids)
+        with stage("ingestion", "copy_vectors"):
+            for start in range(0, len(source_ids), _FETCH_BATCH):
+                workloads.yield_to_interactive()
+                batch = source_ids[start:start + _FETCH_BATCH]
+                response = resilience.call("vector_fetch", source_index.fetch, ids=batch, namespace=source)
+                vectors = []
+                for vid, vector in (response_field(response, "vectors") or {}).items():
+                    item = {"id": new_ids[vid], "values": list(response_field(vector, "values"))}
+                    metadata = response_field(vector, "metadata")
+                    if metadata:
+                        item["metadata"] = dict(metadata)
+                    vectors.append(item)
+                if len(vectors) != len(batch):
+                    raise ValueError(f"{len(batch) - len(vectors)} vectors of {source} are missing from its index")
+                resilience.call("vector_upsert", target_index.upsert, vectors=vectors, namespace=target)
+        with stage("ingestion", "store_chunks"):
+            chunks = chunk_store.get_chunks(source_ids)
+            chunk_store.put_chunks(target, [(new_ids[vid], text, metadata) for vid, (text, metadata) in chunks.items()])
+            chunk_manifest.save_manifest(target, [
+                (new_ids[vid], content_hash, position) for vid, content_hash, position in entries
+            ])
+
+    with stage("ingestion", "store_document"):
+        pages = whole_document.load(source)
+        if pages:
+            whole_document.save(target, pages)
+        precomputed_answers.copy_namespace(source, target)
+    # Remembered while target was an alias, without a text of its own
+    context_cache.forget_document(target)
+    return len(entries)
+
+
+def reuse(namespace: str, source_url: str, content_hash: Optional[str] = None) -> Optional[str]:
+    """
+    Serve a new upload from an already ingested duplicate, if there is one.
+
+    Matches on content_hash, or on source_url alone when called before the
+    download with FINGERPRINT_TRUST_URL. Returns the namespace it was served
+    from, or None when the document has to be processed normally (no
+    duplicate, reuse off, or the copy failed).
+    """
+    if not enabled():
+        return None
+    matched_by = "content"
+    canonical = find_by_hash(content_hash, namespace) if content_hash else None
+    if content_hash is None and FINGERPRINT_TRUST_URL:
+        canonical, matched_by = find_by_url(source_url, namespace), "url"
+    if canonical is None:
+        return None
+    # Chats on an alias are served by the original's data, so never alias an alias
+    canonical = resolve(canonical)
+    if not _stored(canonical):
+        # Deleted since; the registry entry is stale
+        forget(canonical)
+        return None
+
+    if FINGERPRINT_DEDUPE == "alias":
+        _alias(canonical, namespace)
+        action = "aliased"
+    else:
+        try:
+            copied = copy_namespace(canonical, namespace)
+        except Exception as e:
+            logger.warning(f"Could not copy {canonical} to {namespace}, processing the upload in full: {e}")
+            DUPLICATES.inc(action="failed", matched_by=matched_by)
+            return None
+        action = "copied"
+        logger.info(f"Copied {copied} vectors of {canonical} to {namespace}")
+    register(namespace, content_hash or fingerprint_of(canonical) or "", source_url)
+    DUPLICATES.inc(action=action, matched_by=matched_by)
+    return canonical
+
+
+def detach_aliases(namespace: str) -> None:
+    """Give every alias of namespace its own copy, before namespace's content changes."""
+    for alias in aliases_of(namespace):
+        copy_namespace(namespace, alias)
+        unalias(alias)
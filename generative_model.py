@@ -1,15 +1,15 @@
-from langchain_core.caches import BaseCache  # Already present for previous fixesfrom langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.callbacks import Callbacks  # Add this to define Callbacks
-# Rebuild the model after imports
-from langchain_google_genai import ChatGoogleGenerativeAI
-ChatGoogleGenerativeAI.model_rebuild()
-
-import os
-from langsmith import Client, traceable
+import logging
+import hashlib
 from dotenv import load_dotenv
+from metrics import counter, stage
+import chunk_store
+import context_cache
+import resilience
+import services
+import tracing
 load_dotenv()
 
-os.environ["LANGSMITH_TRACING"] = "true"
+logger = logging.getLogger(__name__)
 
 instructions = """"
 You are an authoritative legal research assistant integrated into our case study platform. Your purpose is to help users understand legal cases and proceedings through clear, accurate explanations.
@@ -69,33 +69,128 @@ b) Meta Questions:
 Remember: You represent the case study platform itself. Each response should feel like an integrated part of the legal documentation system, combining authority with accessibility.
 """
 
-custom_client = Client(api_key=os.environ["LANGSMITH_API_KEY"])
+# Identifies the system prompt answers were generated with, so stored answers
+# (see precomputed_answers.py) are not served after it changes
+PROMPT_VERSION = hashlib.sha256(instructions.encode()).hexdigest()[:12]
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    temperature=0.2,
+LLM_INPUT_TOKENS = counter(
+    "caseon_llm_input_tokens_total",
+    "Prompt tokens sent to the chat model, split into those served from the context cache and the rest.",
+    ("kind",),
 )
 
-custom_client = Client(api_key=os.environ["LANGSMITH_API_KEY"])
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    temperature=0.2,
-)
-
-@traceable(client=custom_client,
-    run_type="llm",
-    name="AI-CASE",
-    project_name="Fiverr"
-)
-def get_completion(prompt):
-    try:
+class CachedContentRejected(Exception):
+    """The model rejected a cached-content handle; the caller should resend the full context."""
+
+
+def _cache_rejected(error: BaseException) -> bool:
+    """
+    True if the model refused the request rather than failing transiently.
+    The chat client wraps the Google API error, so its causes are checked too.
+    """
+    while error is not None:
+        if not resilience.is_retryable(error):
+            return True
+        error = error.__cause__
+    return False
+
+
+def system_prompt_cache():
+    """Cached-content handle for the system prompt, or None when caching is off or unavailable."""
+    if not context_cache.enabled():
+        return None
+    key = context_cache.cache_key(services.CHAT_MODEL, instructions)
+    return context_cache.get_handle(key, "system", instructions)
+
+
+def document_cache(namespace):
+    """
+    Cached-content handle holding the system prompt and the full text of a
+    frequently queried document, or None if it is not hot, too large, or caching
+    is unavailable.
+    """
+    if not context_cache.documents_enabled() or not context_cache.note_document_use(namespace):
+        return None
+    def load_text():
+        return chunk_store.get_document_text(namespace)
+
+    key = context_cache.document_key(namespace, services.CHAT_MODEL, instructions, load_text)
+    if key is None:
+        return None
+    return context_cache.get_handle(key, "document", instructions, load_text)
+
+
+def _complete(prompt, cached_content=None, system_instruction=None):
+    if cached_content:
+        # The system prompt (and document text, if any) are in the cached content
+        messages = [("human", prompt)]
+        kwargs = {"cached_content": cached_content}
+    else:
         messages = [
-            ("system", instructions),
+            ("system", system_instruction or instructions),
             ("human", prompt),
         ]
-        ai_msg = llm.invoke(messages)
-        return ai_msg.content, ai_msg.usage_metadata
+        kwargs = {}
+    with stage("chat", "llm_invoke"):
+        ai_msg = services.get_llm().invoke(messages, **kwargs)
+    usage = ai_msg.usage_metadata or {}
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read") or 0
+    LLM_INPUT_TOKENS.inc(cached_tokens, kind="cached")
+    LLM_INPUT_TOKENS.inc(max(0, usage.get("input_tokens", 0) - cached_tokens), kind="uncached")
+    return ai_msg.content, ai_msg.usage_metadata
+
+
+def _traced_complete(prompt, cached_content=None, system_instruction=None):
+    """_complete, recorded as a span for sampled export (see tracing.py)."""
+    with tracing.span("AI-CASE", run_type="llm", inputs={"prompt": prompt, "cached_content": cached_content},
+                      metadata={"model": services.CHAT_MODEL, "prompt_version": PROMPT_VERSION}) as span:
+        content, usage_metadata = _complete(prompt, cached_content, system_instruction)
+        span.outputs = {"content": content, "usage_metadata": usage_metadata}
+    return content, usage_metadata
+
+
+def get_completion(prompt, cached_content=None):
+    """
+    Return (content, usage_metadata) for prompt.
+
+    With cached_content (see document_cache) the prompt is answered against that
+    cached context, and CachedContentRejected is raised if the model no longer
+    accepts it. Otherwise the system prompt is taken from the context cache when
+    enabled, falling back to sending it in full. A handle is only given up when
+    the model refuses the request; transient failures are raised as they are.
+
+    Raises instead of returning None on failure: resilience.UpstreamError when
+    the model timed out or its circuit is open, otherwise the client's error.
+    """
+    explicit_cache = cached_content is not None
+    if not explicit_cache:
+        cached_content = system_prompt_cache()
+    try:
+        return resilience.call("llm", _traced_complete, prompt, cached_content)
+    except resilience.UpstreamError as e:
+        logger.warning(f"Completion failed: {e}")
+        raise
+    except Exception as e:
+        logger.warning(f"Completion failed: {e}")
+        if not cached_content or not _cache_rejected(e):
+            # A timeout or 5xx says nothing about the cached content; keep the handle
+            raise
+        context_cache.discard(cached_content)
+        if explicit_cache:
+            raise CachedContentRejected(str(e)) from e
+
+    # The cached system prompt was rejected; send it in full this time
+    try:
+        return resilience.call("llm", _traced_complete, prompt, None)
     except Exception as e:
-        print(f"An error occurred in generative_model.py : {str(e)}")
+        logger.warning(f"Completion failed: {e}")
+        raise
+
 
+def complete_task(system_instruction, prompt):
+    """
+    Return (content, usage_metadata) for an auxiliary prompt with its own system
+    instruction instead of the legal assistant's, e.g. rewriting or summarizing.
+    """
+    return resilience.call("llm", _traced_complete, prompt, None, system_instruction)
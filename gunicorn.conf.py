@@ -1,4 +1,39 @@
+import os
+
 bind = "0.0.0.0:10000"
 workers = 4
 timeout = 120
-worker_class = "sync"
+
+# SERVING_MODE=async switches to gevent workers, each holding up to
+# WORKER_CONNECTIONS concurrent requests (see serving_mode.py)
+async_mode = os.environ.get("SERVING_MODE", "sync").lower() == "async"
+if async_mode:
+    worker_class = "gevent"
+    worker_connections = int(os.environ.get("WORKER_CONNECTIONS", "500"))
+else:
+    worker_class = "sync"
+
+
+def post_fork(server, worker):
+    # Create the Gemini, Pinecone and DB clients in the worker, never in the
+    # master, so forked processes don't share sockets or gRPC channels.
+    # /api/v1/ready reports 503 until this finishes.
+    if async_mode:
+        # gevent workers patch the standard library after this hook runs;
+        # warm up in post_worker_init instead so clients use patched sockets
+        return
+    if server.cfg.threads <= 1:
+        # One request at a time: handing work to a bulkhead pool only adds latency
+        import workloads
+        workloads.run_inline()
+    import services
+    services.start_warm_up()
+
+
+def post_worker_init(worker):
+    if not async_mode:
+        return
+    import serving_mode
+    import services
+    serving_mode.init_grpc_for_async()
+    services.start_warm_up()
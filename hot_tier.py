@@ -0,0 +1,309 @@
+"""
+Local in-memory vector tier for hot namespaces.
+
+A few cases get most of the chat traffic. Once a namespace has been queried
+HOT_TIER_PROMOTE_AFTER times within HOT_TIER_WINDOW_SECONDS, its vectors are
+copied from Pinecone into a float32 matrix file under LOCAL_DATA_DIR/hot_tier,
+and later queries are answered locally with one NumPy matrix-vector product
+instead of a Pinecone round-trip. Chunk texts come from the local chunk store
+as usual.
+
+The matrix files are memory-mapped read-only, so every gunicorn worker on the
+host shares one copy through the page cache. Which namespaces are promoted is
+recorded in the local store: any worker may build a namespace, and the others
+pick it up within HOT_TIER_REFRESH_SECONDS. The total size of promoted
+namespaces is kept under HOT_TIER_MEMORY_MB by evicting the least recently
+queried ones. Anything not in the tier is queried in Pinecone as before.
+
+Vectors are stored L2-normalised, so the dot product is the cosine similarity
+the Pinecone indexes (metric="cosine") return. Re-ingesting a namespace evicts
+it; it is promoted again once it is hot.
+
+HOT_TIER_ENABLED=true turns the tier on.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from cache import LRUCache
+from local_store import LOCAL_DATA_DIR, ensure_schema, local_db
+from metrics import counter, gauge
+
+logger = logging.getLogger(__name__)
+
+HOT_TIER_ENABLED = os.environ.get("HOT_TIER_ENABLED", "false").lower() == "true"
+HOT_TIER_MEMORY_MB = float(os.environ.get("HOT_TIER_MEMORY_MB", "256"))
+HOT_TIER_PROMOTE_AFTER = int(os.environ.get("HOT_TIER_PROMOTE_AFTER", "10"))
+HOT_TIER_WINDOW_SECONDS = float(os.environ.get("HOT_TIER_WINDOW_SECONDS", "600"))
+HOT_TIER_REFRESH_SECONDS = float(os.environ.get("HOT_TIER_REFRESH_SECONDS", "5"))
+HOT_TIER_DIR = os.path.join(LOCAL_DATA_DIR, "hot_tier")
+
+DIMENSION = 768
+_FETCH_BATCH = 100
+# A build that has not finished after this long is assumed to have died with its worker
+_BUILD_TIMEOUT_SECONDS = 600
+# How often a worker records that a promoted namespace is still being queried
+_TOUCH_INTERVAL_SECONDS = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hot_namespace (
+    namespace TEXT PRIMARY KEY,
+    build_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+"""
+
+QUERIES = counter("caseon_hot_tier_queries_total", "Vector queries by where they were answered (hot or miss).", ("result",))
+PROMOTIONS = counter("caseon_hot_tier_promotions_total", "Namespace promotions by outcome (built, failed, evicted).", ("event",))
+RESIDENT_BYTES = gauge("caseon_hot_tier_resident_bytes", "Size of the matrices this worker has mapped.")
+
+
+class _Mapped:
+    __slots__ = ("build_id", "ids", "matrix")
+
+    def __init__(self, build_id: str, ids: List[str], matrix):
+        self.build_id = build_id
+        self.ids = ids
+        self.matrix = matrix
+
+
+_lock = threading.Lock()
+_mapped: Dict[str, _Mapped] = {}
+_last_refresh = 0.0
+_last_touch: Dict[str, float] = {}
+_building = set()
+_uses = LRUCache(10000)
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _paths(build_id: str):
+    return os.path.join(HOT_TIER_DIR, f"{build_id}.f32"), os.path.join(HOT_TIER_DIR, f"{build_id}.ids.json")
+
+
+def _remove_files(build_id: str) -> None:
+    for path in _paths(build_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _refresh(force: bool = False) -> None:
+    """Map newly promoted namespaces and drop evicted ones."""
+    global _last_refresh
+    import numpy as np
+
+    now = time.monotonic()
+    if not force and now - _last_refresh < HOT_TIER_REFRESH_SECONDS:
+        return
+    _last_refresh = now
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        rows = conn.execute("SELECT namespace, build_id, rows FROM hot_namespace WHERE state = 'ready'").fetchall()
+    ready = {row["namespace"]: (row["build_id"], row["rows"]) for row in rows}
+    with _lock:
+        for namespace in [ns for ns, mapped in _mapped.items() if ready.get(ns, (None,))[0] != mapped.build_id]:
+            del _mapped[namespace]
+        for namespace, (build_id, row_count) in ready.items():
+            if namespace in _mapped:
+                continue
+            matrix_path, ids_path = _paths(build_id)
+            try:
+                with open(ids_path) as f:
+                    ids = json.load(f)
+                matrix = np.memmap(matrix_path, dtype=np.float32, mode="r", shape=(row_count, DIMENSION))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Hot tier files for {namespace} unavailable: {e}")
+                continue
+            _mapped[namespace] = _Mapped(build_id, ids, matrix)
+        RESIDENT_BYTES.set(sum(mapped.matrix.nbytes for mapped in _mapped.values()))
+
+
+def _note_use(namespace: str) -> None:
+    """Track recent queries and promote the namespace once it is hot."""
+    global _executor
+    now = time.time()
+    with _lock:
+        uses = _uses.get(namespace)
+        if uses is None:
+            uses = deque(maxlen=HOT_TIER_PROMOTE_AFTER)
+            _uses.put(namespace, uses)
+        uses.append(now)
+        hot = len(uses) >= HOT_TIER_PROMOTE_AFTER and now - uses[0] <= HOT_TIER_WINDOW_SECONDS
+        if not hot or namespace in _mapped or namespace in _building:
+            return
+        _building.add(namespace)
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hot-tier")
+    _executor.submit(_build_in_background, namespace)
+
+
+def _touch(namespace: str) -> None:
+    now = time.time()
+    if now - _last_touch.get(namespace, 0) < _TOUCH_INTERVAL_SECONDS:
+        return
+    _last_touch[namespace] = now
+    with local_db() as conn:
+        conn.execute("UPDATE hot_namespace SET last_used = ? WHERE namespace = ?", (now, namespace))
+
+
+def query(namespace: str, vector: List[float], top_k: int) -> Optional[List[Dict]]:
+    """
+    Top-k matches as [{"id", "score"}] from the hot tier, or None when the
+    namespace is not promoted and Pinecone has to answer.
+    """
+    if not HOT_TIER_ENABLED:
+        return None
+    import numpy as np
+
+    _note_use(namespace)
+    _refresh()
+    mapped = _mapped.get(namespace)
+    if mapped is None or not mapped.ids:
+        QUERIES.inc(result="miss")
+        return None
+    _touch(namespace)
+
+    q = np.asarray(vector, dtype=np.float32)
+    q /= np.linalg.norm(q) or 1.0
+    scores = mapped.matrix @ q
+    k = min(top_k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    QUERIES.inc(result="hot")
+    return [{"id": mapped.ids[i], "score": float(scores[i])} for i in top]
+
+
+def _claim(namespace: str, build_id: str) -> bool:
+    """Atomically take the build of namespace unless it is ready or another worker is building it."""
+    now = time.time()
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        claimed = conn.execute(
+            "INSERT INTO hot_namespace (namespace, build_id, state, rows, bytes, started_at, last_used) "
+            "VALUES (?, ?, 'building', 0, 0, ?, ?) "
+            "ON CONFLICT (namespace) DO UPDATE SET build_id = excluded.build_id, started_at = excluded.started_at "
+            "WHERE hot_namespace.state != 'ready' AND hot_namespace.started_at < ?",
+            (namespace, build_id, now, now, now - _BUILD_TIMEOUT_SECONDS),
+        ).rowcount
+    return claimed == 1
+
+
+def _evict_for(needed_bytes: int, keep: str) -> None:
+    budget = int(HOT_TIER_MEMORY_MB * 1024 * 1024)
+    with local_db() as conn:
+        rows = conn.execute(
+            "SELECT namespace, build_id, bytes FROM hot_namespace WHERE state = 'ready' AND namespace != ? "
+            "ORDER BY last_used ASC",
+            (keep,),
+        ).fetchall()
+        used = sum(row["bytes"] for row in rows)
+        for row in rows:
+            if used + needed_bytes <= budget:
+                break
+            conn.execute("DELETE FROM hot_namespace WHERE namespace = ?", (row["namespace"],))
+            _remove_files(row["build_id"])
+            used -= row["bytes"]
+            PROMOTIONS.inc(event="evicted")
+
+
+def _fetch_vectors(namespace: str):
+    """All (ids, values) of a namespace, from the chunk manifest's IDs or by listing the index."""
+    import chunk_manifest
+    import shard_map
+    from pinecone_index_manager import get_index_project_by_namespace
+    from query import response_field
+
+    index_name, project = get_index_project_by_namespace(namespace)
+    if not index_name or not project:
+        raise ValueError(f"No index or project found for namespace: {namespace}")
+    index = shard_map.get_index(index_name, project)
+    vector_ids = list(chunk_manifest.load_manifest(namespace))
+    if not vector_ids:
+        vector_ids = [vid for page in index.list(namespace=namespace) for vid in page]
+    ids, values = [], []
+    for start in range(0, len(vector_ids), _FETCH_BATCH):
+        response = index.fetch(ids=vector_ids[start:start + _FETCH_BATCH], namespace=namespace)
+        for vid, vector in (response_field(response, "vectors") or {}).items():
+            ids.append(vid)
+            values.append(response_field(vector, "values"))
+    return ids, values
+
+
+def build(namespace: str) -> bool:
+    """Copy a namespace's vectors into the hot tier. Returns False if another worker has it."""
+    import numpy as np
+
+    build_id = uuid.uuid4().hex
+    if not _claim(namespace, build_id):
+        return False
+    try:
+        ids, values = _fetch_vectors(namespace)
+        matrix = np.asarray(values, dtype=np.float32).reshape(len(ids), DIMENSION)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        if matrix.nbytes > HOT_TIER_MEMORY_MB * 1024 * 1024:
+            raise ValueError(f"{matrix.nbytes} bytes exceeds the hot tier budget")
+
+        os.makedirs(HOT_TIER_DIR, exist_ok=True)
+        matrix_path, ids_path = _paths(build_id)
+        matrix.tofile(f"{matrix_path}.tmp")
+        os.replace(f"{matrix_path}.tmp", matrix_path)
+        with open(f"{ids_path}.tmp", "w") as f:
+            json.dump(ids, f)
+        os.replace(f"{ids_path}.tmp", ids_path)
+
+        _evict_for(matrix.nbytes, keep=namespace)
+        with local_db() as conn:
+            updated = conn.execute(
+                "UPDATE hot_namespace SET state = 'ready', rows = ?, bytes = ?, last_used = ? "
+                "WHERE namespace = ? AND build_id = ?",
+                (len(ids), matrix.nbytes, time.time(), namespace, build_id),
+            ).rowcount
+        if not updated:
+            # Evicted (e.g. re-ingested) while building
+            _remove_files(build_id)
+            return False
+    except Exception:
+        PROMOTIONS.inc(event="failed")
+        with local_db() as conn:
+            conn.execute("DELETE FROM hot_namespace WHERE namespace = ? AND build_id = ?", (namespace, build_id))
+        _remove_files(build_id)
+        raise
+    PROMOTIONS.inc(event="built")
+    _refresh(force=True)
+    return True
+
+
+def _build_in_background(namespace: str) -> None:
+    try:
+        build(namespace)
+    except Exception as e:
+        logger.warning(f"Promoting {namespace} to the hot tier failed: {e}")
+    finally:
+        with _lock:
+            _building.discard(namespace)
+
+
+def evict(namespace: str) -> None:
+    """Drop a namespace from the hot tier, e.g. because its vectors changed."""
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        row = conn.execute("SELECT build_id FROM hot_namespace WHERE namespace = ?", (namespace,)).fetchone()
+        conn.execute("DELETE FROM hot_namespace WHERE namespace = ?", (namespace,))
+    if row is not None:
+        _remove_files(row["build_id"])
+        PROMOTIONS.inc(event="evicted")
+    with _lock:
+        _mapped.pop(namespace, None)
@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Directory for node-local state (chunk manifests and other per-namespace records).
+# Shared by every worker process on the host; SQLite in WAL mode handles the locking.
+LOCAL_DATA_DIR = os.environ.get("LOCAL_DATA_DIR", "data")
+LOCAL_DB_FILE = os.environ.get("LOCAL_DB_FILE", "caseon.sqlite3")
+
+_lock = threading.RLock()
+_connection = None
+_connection_pid = None
+_applied_schemas = set()
+
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(LOCAL_DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(LOCAL_DATA_DIR, LOCAL_DB_FILE), timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+@contextmanager
+def local_db():
+    """
+    Yield this process's connection to the local SQLite store, committing on success.
+
+    One connection is shared per process and serialized with a lock; it is reopened
+    after a fork so gunicorn workers never share a handle with the master.
+    """
+    global _connection, _connection_pid
+    with _lock:
+        if _connection is None or _connection_pid != os.getpid():
+            _connection = _connect()
+            _connection_pid = os.getpid()
+            _applied_schemas.clear()
+        try:
+            yield _connection
+            _connection.commit()
+        except Exception:
+            _connection.rollback()
+            raise
+
+
+def ensure_schema(ddl: str) -> None:
+    """Apply CREATE TABLE IF NOT EXISTS statements once per process."""
+    with local_db() as conn:
+        if ddl not in _applied_schemas:
+            conn.executescript(ddl)
+            _applied_schemas.add(ddl)
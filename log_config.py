@@ -0,0 +1,209 @@
+import atexit
+import contextvars
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from metrics import counter
+
+# Logging configuration, from the environment:
+#   LOG_LEVEL              root level (default INFO).
+#   LOG_LEVELS             per-module overrides, e.g. "query=DEBUG,hot_tier=WARNING".
+#   LOG_FORMAT             "json" (default): one JSON object per line; "text": human-readable.
+#   LOG_FILE               also write to this file (default: stderr only).
+#   LOG_QUEUE_SIZE         records buffered for the writer thread; when full, records are
+#                          dropped and counted instead of blocking the request.
+#   LOG_DEBUG_SAMPLE_RATE  fraction of requests whose DEBUG records are kept (default 0.01);
+#                          a request is either sampled in full or not at all.
+#
+# Request handlers only format the record and put it on a queue; a listener
+# thread does the writing. Every record carries the request ID of the request
+# that produced it (X-Request-ID, or a generated one) and has API keys,
+# passwords and tokens redacted before it is queued.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_FILE = os.environ.get("LOG_FILE", "")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+
+# Environment variables whose values must never appear in logs
+_SECRET_ENV = re.compile(r"(KEY|KEYS|SECRET|TOKEN|PASSWORD|PASSWD)$")
+# Secrets in free text, e.g. "api_key=...", "x-api-key: ...", "Bearer ..."
+_SECRET_PATTERNS = [
+    re.compile(r"(?i)((?:x-)?api[_-]?key|password|passwd|secret|token)(\s*[=:]\s*['\"]?)[^\s'\",;&]+"),
+    re.compile(r"(?i)(bearer)(\s+)[A-Za-z0-9._~+/=-]+"),
+]
+REDACTED = "[REDACTED]"
+
+LOG_RECORDS_DROPPED = counter(
+    "caseon_log_records_dropped_total",
+    "Log records dropped because the log queue was full.",
+)
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_listener: Optional[logging.handlers.QueueListener] = None
+_configure_lock = threading.Lock()
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def set_request_id(request_id: Optional[str]) -> contextvars.Token:
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token: contextvars.Token) -> None:
+    _request_id.reset(token)
+
+
+@contextmanager
+def request_context(request_id: Optional[str] = None):
+    """Tag every record logged inside the block (and in work it hands to executors) with request_id."""
+    token = set_request_id(request_id or new_request_id())
+    try:
+        yield _request_id.get()
+    finally:
+        reset_request_id(token)
+
+
+def _secret_values():
+    values = set()
+    for name, value in os.environ.items():
+        if _SECRET_ENV.search(name.upper()):
+            values.update(part.strip() for part in value.split(","))
+    # Short values would redact ordinary words
+    return sorted((v for v in values if len(v) >= 8), key=len, reverse=True)
+
+
+def redact(text: str, secrets=None) -> str:
+    for secret in secrets if secrets is not None else _secret_values():
+        if secret in text:
+            text = text.replace(secret, REDACTED)
+    for pattern in _SECRET_PATTERNS:
+        text = pattern.sub(lambda m: f"{m.group(1)}{m.group(2)}{REDACTED}", text)
+    return text
+
+
+class ContextFilter(logging.Filter):
+    """Stamps the request ID and drops DEBUG records of requests outside the sample."""
+
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def _sampled(self, request_id: Optional[str]) -> bool:
+        if self.sample_rate >= 1:
+            return True
+        if request_id is None:
+            return random.random() < self.sample_rate
+        # Same decision for every record of a request, in every process
+        bucket = int(hashlib.blake2b(request_id.encode(), digest_size=4).hexdigest(), 16) / 2**32
+        return bucket < self.sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = _request_id.get()
+        record.request_id = request_id or "-"
+        return record.levelno > logging.DEBUG or self._sampled(request_id)
+
+
+class RedactingQueueHandler(logging.handlers.QueueHandler):
+    """Queues records with their message merged and secrets redacted, without ever blocking."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.secrets = _secret_values()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.msg = redact(record.msg, self.secrets)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", "-") != "-":
+            entry["request_id"] = record.request_id
+        # QueueHandler.prepare has already folded exc_info into the message
+        return json.dumps(entry, default=str)
+
+
+def _module_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.partition("=")
+        if not level:
+            logging.getLogger(__name__).warning(f"Ignoring LOG_LEVELS entry {item!r}, expected module=LEVEL")
+            continue
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure() -> None:
+    """Route all logging through the queue to the configured outputs. Safe to call more than once."""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+        if LOG_FORMAT == "text":
+            formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s")
+        else:
+            formatter = JsonFormatter()
+        outputs = [logging.StreamHandler(sys.stderr)]
+        if LOG_FILE:
+            outputs.append(logging.FileHandler(LOG_FILE))
+        for output in outputs:
+            output.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        handler = RedactingQueueHandler(log_queue)
+        handler.addFilter(ContextFilter(LOG_DEBUG_SAMPLE_RATE))
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        for name, level in _module_levels(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, *outputs, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
@@ -1,21 +1,40 @@
-from generative_model import get_completion
+from generative_model import CachedContentRejected, document_cache, get_completion
 from token_usage_database_update import update_token_usage
-from query import pincone_vector_database_query  
+from query import multi_namespace_query, pincone_vector_database_query
 from one_adder import increment_column_for_today
+from metrics import stage
+import fingerprints
+import precomputed_answers
+import shared_cache
+import whole_document
+from singleflight import SingleFlight
 import os
 import logging
 
-# Set up at the start of your application
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename='app.log'
-)
+# Logging is configured by the app (see log_config.py)
+logger = logging.getLogger(__name__)
 
+# Identical questions on the same case that arrive while one is already being
+# answered wait for that answer instead of running retrieval and the LLM again.
+CHAT_COALESCING = os.environ.get("CHAT_COALESCING", "true").lower() == "true"
+CHAT_COALESCING_WAIT_SECONDS = float(os.environ.get("CHAT_COALESCING_WAIT_SECONDS", "120"))
 
+# Documents one multi-document chat may span; each is searched concurrently
+MULTI_CHAT_MAX_NAMESPACES = int(os.environ.get("MULTI_CHAT_MAX_NAMESPACES", "5"))
+MULTI_CHAT_TOP_K = int(os.environ.get("MULTI_CHAT_TOP_K", "30"))
 
-def start_chatting(index_name, user_input):
-    increment_column_for_today(index_name)
+_chat_flights = SingleFlight("chat", wait_timeout=CHAT_COALESCING_WAIT_SECONDS)
+
+
+def normalize_question(user_input):
+    """Case- and whitespace-insensitive form of a question, used as the coalescing key."""
+    return " ".join(user_input.split()).casefold()
+
+
+
+def start_chatting(index_name, user_input, history=None):
+    with stage("chat", "trending_update"):
+        increment_column_for_today(index_name)
 
     """
     Process the user input and return the response generated by the AI model.
@@ -26,26 +45,149 @@ def start_chatting(index_name, user_input):
         The name of the index to use for querying the vector database.
     user_input : str
         The user's input to process.
+    history : str, optional
+        Earlier turns of a conversation (see sessions.py), added to the prompt.
 
     Returns
     -------
     str
         The response generated by the AI model.
     """
-    # Add debugging logs
-    logging.debug(f"Attempting to query Pinecone with index: {index_name}")
-    try:
-        context = pincone_vector_database_query(user_input, index_name)
-    except Exception as e:
-        logging.error(f"Error querying Pinecone: {str(e)}")
-        raise
-    input_query = (f"""Case: {context}\n\n Question: {user_input+"in this case"}""")
-    response, response_metadata = get_completion(input_query)
+    # Duplicate uploads may be aliases of the namespace holding the document
+    namespace = fingerprints.resolve(index_name)
+
+    # Standard questions may have been answered right after ingestion
+    with stage("chat", "precomputed_lookup"):
+        precomputed = precomputed_answers.lookup(namespace, user_input)
+    if precomputed is not None:
+        return precomputed
+
+    # Answers that depend on a conversation's history are not shared
+    if history:
+        return answer_question(namespace, user_input, history)
+
+    # Another worker may have answered the same question recently
+    question = normalize_question(user_input)
+    with stage("chat", "answer_cache_lookup"):
+        cached = shared_cache.get_answer(namespace, question)
+    if cached is not None:
+        return cached
+
+    def answer_and_cache():
+        answer, grounded = _answer(namespace, user_input)
+        # An answer from failed or empty retrieval (e.g. a chat before ingestion finished) is not shared
+        if grounded:
+            shared_cache.set_answer(namespace, question, answer)
+        return answer
+
+    if not CHAT_COALESCING:
+        return answer_and_cache()
+    return _chat_flights.do((namespace, question), answer_and_cache)
+
+
+def answer_question(index_name, user_input, history=None):
+    """Gather context (whole document, cached document or retrieval), call the model and record token usage once."""
+    return _answer(index_name, user_input, history)[0]
+
+
+def _answer(index_name, user_input, history=None):
+    """answer_question, also returning whether the answer had any document context."""
+    response = None
+    grounded = True
+    conversation = f"Conversation so far:\n{history}\n\n " if history else ""
+    # Short documents are sent whole; no embedding or vector search needed
+    with stage("chat", "whole_document_load"):
+        pages = whole_document.load(index_name)
+    if pages:
+        input_query = (f"""Case: {whole_document.format_document(pages)}\n\n {conversation}Question: {user_input+"in this case"}""")
+        response, response_metadata = get_completion(input_query)
+
+    # A frequently queried document may be in the model's context cache in full
+    cached_document = document_cache(index_name) if response is None else None
+    if cached_document:
+        try:
+            response, response_metadata = get_completion(
+                f"""{conversation}Question: {user_input+"in this case"}""", cached_content=cached_document
+            )
+        except CachedContentRejected:
+            logger.warning(f"Cached document for {index_name} rejected, falling back to retrieval")
+
+    if response is None:
+        # Add debugging logs
+        logger.debug(f"Attempting to query Pinecone with index: {index_name}")
+        try:
+            context = pincone_vector_database_query(user_input, index_name)
+        except Exception as e:
+            logger.error(f"Error querying Pinecone: {str(e)}")
+            raise
+        texts, _ = context
+        grounded = bool(texts)
+        input_query = (f"""Case: {context}\n\n {conversation}Question: {user_input+"in this case"}""")
+        response, response_metadata = get_completion(input_query)
 
     
     input_token = response_metadata["input_tokens"]  # Input token
     output_token = response_metadata["output_tokens"] # Output token
-    update_token_usage(input_token, output_token)  # Update token usage
-    return response
+    with stage("chat", "token_usage_update"):
+        update_token_usage(input_token, output_token)  # Update token usage
+    return response, grounded
+
 
+def start_multi_chat(index_names, user_input):
+    """
+    Answer a question across several documents (at most MULTI_CHAT_MAX_NAMESPACES).
+
+    Returns (response, sources): sources lists each requested index_name with the
+    number of its chunks in the context, or the reason it was left out.
+    """
+    with stage("chat", "trending_update"):
+        for index_name in index_names:
+            increment_column_for_today(index_name)
 
+    # Aliases of the same document are searched once
+    namespaces = {index_name: fingerprints.resolve(index_name) for index_name in index_names}
+    unique = list(dict.fromkeys(namespaces.values()))
+    key = (tuple(sorted(unique)), normalize_question(user_input))
+    if not CHAT_COALESCING:
+        response, used, failed = answer_across(unique, user_input)
+    else:
+        response, used, failed = _chat_flights.do(key, lambda: answer_across(unique, user_input))
+
+    sources = []
+    for index_name, namespace in namespaces.items():
+        source = {"index_name": index_name, "chunks": used.get(namespace, 0)}
+        if namespace in failed:
+            source["error"] = failed[namespace]
+        sources.append(source)
+    return response, sources
+
+
+def answer_across(namespaces, user_input):
+    """Gather context from every namespace, call the model once and record token usage. Returns (response, used, failed)."""
+    sections, used = [], {}
+    retrieval = []
+    for namespace in namespaces:
+        # Short documents go in whole, as in single-document chats
+        with stage("chat", "whole_document_load"):
+            pages = whole_document.load(namespace)
+        if pages:
+            sections.append(f"[Source: {namespace}]\n{whole_document.format_document(pages)}")
+            used[namespace] = len(pages)
+        else:
+            retrieval.append(namespace)
+
+    failed = {}
+    if retrieval:
+        results, failed = multi_namespace_query(user_input, retrieval, top_k=MULTI_CHAT_TOP_K)
+        for result in results:
+            source = result.metadata["source"]
+            used[source] = used.get(source, 0) + 1
+            sections.append(f"[Source: {source}, page {result.metadata['page']}]\n{result.text}")
+
+    context = "\n\n".join(sections)
+    input_query = (f"""Cases: {context}\n\n Question: {user_input} across these cases. """
+                   f"""Say which source each point comes from.""")
+    response, response_metadata = get_completion(input_query)
+    with stage("chat", "token_usage_update"):
+        update_token_usage(response_metadata["input_tokens"], response_metadata["output_tokens"])
+    return response, used, failed
@@ -0,0 +1,222 @@
+import gc
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from typing import Dict, Optional
+
+from metrics import counter, gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+# Memory management policy, configured from the environment:
+#   GC_POLICY           "rss" (default): collect only after RSS has grown by GC_RSS_GROWTH_MB,
+#                       once the response has been sent.
+#                       "interval": collect every GC_INTERVAL_SECONDS on a background thread.
+#                       "off": leave collection entirely to the generational thresholds.
+#   GC_THRESHOLDS       optional "gen0,gen1,gen2" passed to gc.set_threshold().
+#   GC_RSS_GROWTH_MB    RSS growth since the last collection that triggers one (rss policy).
+#   GC_INTERVAL_SECONDS collection period for the interval policy.
+#   TRACEMALLOC_FRAMES  start tracemalloc at startup with this many frames (0 disables).
+VALID_POLICIES = ("rss", "interval", "off")
+
+GC_POLICY = os.environ.get("GC_POLICY", "rss").lower()
+GC_THRESHOLDS = os.environ.get("GC_THRESHOLDS", "")
+GC_RSS_GROWTH_MB = float(os.environ.get("GC_RSS_GROWTH_MB", "128"))
+GC_INTERVAL_SECONDS = float(os.environ.get("GC_INTERVAL_SECONDS", "60"))
+TRACEMALLOC_FRAMES = int(os.environ.get("TRACEMALLOC_FRAMES", "0"))
+
+if GC_POLICY not in VALID_POLICIES:
+    logger.warning(f"Unknown GC_POLICY {GC_POLICY!r}, expected one of {VALID_POLICIES}; using 'rss'")
+    GC_POLICY = "rss"
+
+GC_COLLECTIONS = counter(
+    "caseon_gc_forced_collections_total",
+    "Full collections forced by the memory policy.",
+    ("reason",),
+)
+GC_PAUSE_SECONDS = histogram(
+    "caseon_gc_pause_seconds",
+    "Garbage collector pause time by generation, including automatic collections.",
+    ("generation",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+RSS_BYTES = gauge("caseon_process_rss_bytes", "Resident set size of this worker.")
+
+_state_lock = threading.Lock()
+_baseline_rss: Optional[int] = None
+_last_collection: Optional[float] = None
+_pending_collection = False
+_gc_started: Dict[int, float] = {}
+_previous_snapshot = None
+_interval_thread: Optional[threading.Thread] = None
+_configured = False
+
+
+def get_rss_bytes() -> int:
+    """Current resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Not on Linux: fall back to peak RSS, which is the best getrusage offers
+        import resource
+        import sys
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def _gc_callback(phase, info):
+    generation = info.get("generation", -1)
+    if phase == "start":
+        _gc_started[generation] = time.perf_counter()
+    elif phase == "stop":
+        started = _gc_started.pop(generation, None)
+        if started is not None:
+            GC_PAUSE_SECONDS.observe(time.perf_counter() - started, generation=str(generation))
+
+
+def collect(reason: str) -> int:
+    """Run a full collection and reset the RSS baseline the policy measures against."""
+    global _baseline_rss, _last_collection, _pending_collection
+    collected = gc.collect()
+    rss = get_rss_bytes()
+    with _state_lock:
+        _baseline_rss = rss
+        _last_collection = time.time()
+        _pending_collection = False
+    RSS_BYTES.set(rss)
+    GC_COLLECTIONS.inc(reason=reason)
+    logger.info(f"Garbage collection ({reason}) freed {collected} objects, RSS now {rss / 2**20:.1f} MiB")
+    return collected
+
+
+def _interval_loop():
+    while True:
+        time.sleep(GC_INTERVAL_SECONDS)
+        try:
+            collect("interval")
+        except Exception:
+            logger.exception("Scheduled garbage collection failed")
+
+
+def configure() -> None:
+    """Apply the configured policy. Safe to call more than once; only the first call has effect."""
+    global _configured, _baseline_rss, _interval_thread
+    if _configured:
+        return
+    _configured = True
+
+    if GC_THRESHOLDS:
+        try:
+            thresholds = [int(value) for value in GC_THRESHOLDS.split(",")]
+            gc.set_threshold(*thresholds)
+        except (TypeError, ValueError):
+            logger.warning(f"Ignoring invalid GC_THRESHOLDS {GC_THRESHOLDS!r}")
+
+    if TRACEMALLOC_FRAMES > 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    if _gc_callback not in gc.callbacks:
+        gc.callbacks.append(_gc_callback)
+
+    _baseline_rss = get_rss_bytes()
+    RSS_BYTES.set(_baseline_rss)
+
+    if GC_POLICY == "interval":
+        _interval_thread = threading.Thread(target=_interval_loop, name="gc-interval", daemon=True)
+        _interval_thread.start()
+
+
+def schedule_collection(response):
+    """
+    After-request hook for the rss policy.
+
+    Samples RSS and, if it has grown past the configured limit since the last
+    collection, defers a full collection until the response has been sent so the
+    pause is not charged to the client.
+    """
+    global _pending_collection
+    if GC_POLICY != "rss":
+        return response
+
+    rss = get_rss_bytes()
+    RSS_BYTES.set(rss)
+    with _state_lock:
+        baseline = _baseline_rss if _baseline_rss is not None else rss
+        if _pending_collection or rss - baseline < GC_RSS_GROWTH_MB * 2**20:
+            return response
+        _pending_collection = True
+
+    response.call_on_close(lambda: collect("rss_growth"))
+    return response
+
+
+def set_tracemalloc(enabled: bool, frames: int = 10) -> bool:
+    """Start or stop allocation tracing at runtime. Returns whether tracing is now active."""
+    global _previous_snapshot
+    if enabled and not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+    elif not enabled and tracemalloc.is_tracing():
+        tracemalloc.stop()
+        _previous_snapshot = None
+    return tracemalloc.is_tracing()
+
+
+def _allocation_sites(top: int) -> Dict:
+    global _previous_snapshot
+    if not tracemalloc.is_tracing():
+        return {"tracing": False}
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    report = {
+        "tracing": True,
+        "traced_current_bytes": current,
+        "traced_peak_bytes": peak,
+        "top_sites": [
+            {"site": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:top]
+        ],
+    }
+    # Growth since the previous diagnostics call is what points at a leak
+    if _previous_snapshot is not None:
+        report["top_growth_since_last_call"] = [
+            {"site": str(stat.traceback), "size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+            for stat in snapshot.compare_to(_previous_snapshot, "lineno")[:top]
+            if stat.size_diff > 0
+        ]
+    _previous_snapshot = snapshot
+    return report
+
+
+def diagnostics(top: int = 10) -> Dict:
+    """Collect RSS, garbage collector and allocation-site statistics for this worker."""
+    rss = get_rss_bytes()
+    RSS_BYTES.set(rss)
+    with _state_lock:
+        baseline = _baseline_rss
+        last_collection = _last_collection
+    return {
+        "pid": os.getpid(),
+        "policy": GC_POLICY,
+        "rss_bytes": rss,
+        "rss_baseline_bytes": baseline,
+        "rss_growth_limit_bytes": int(GC_RSS_GROWTH_MB * 2**20),
+        "last_forced_collection": last_collection,
+        "gc": {
+            "enabled": gc.isenabled(),
+            "thresholds": gc.get_threshold(),
+            "counts": gc.get_count(),
+            "generations": gc.get_stats(),
+            "uncollectable_garbage": len(gc.garbage),
+            "tracked_objects": len(gc.get_objects()),
+        },
+        "tracemalloc": _allocation_sites(top),
+    }
@@ -1,24 +1,24 @@
+import logging
 from datetime import datetime
+from add_one_column import trending_column_name
 from connection import getconnection, release_connection
 
+logger = logging.getLogger(__name__)
+
 # Function to increment a column for today's date
 def increment_column_for_today(column_name: str):
     """
-    Ensure column name is SQL-safe by:
-    1. Starting with a letter or underscore
-    2. Only containing letters, numbers, and underscores
+    Count a chat on a document in today's cat_is_trending row. The column name
+    is made SQL-safe with add_one_column.trending_column_name.
     """
-    # Remove any special characters and ensure it starts with a letter
-    safe_column_name = ''.join(c for c in column_name if c.isalnum() or c == '_')
-    if not safe_column_name[0].isalpha():
-        safe_column_name = 'idx_' + safe_column_name
+    safe_column_name = trending_column_name(column_name)
         
     connection = None
     cursor = None
     try:
         connection = getconnection()
         if connection is None:
-            print("Failed to connect to the database.")
+            logger.error("Failed to connect to the database.")
             return
 
         # First, check if the column exists
@@ -35,7 +35,7 @@ def increment_column_for_today(column_name: str):
         
         # If column doesn't exist, create it
         if result['count'] == 0:
-            print(f"Column {safe_column_name} doesn't exist. Creating it...")
+            logger.info(f"Column {safe_column_name} doesn't exist. Creating it...")
             alter_query = f"""
             ALTER TABLE cat_is_trending 
             ADD COLUMN {safe_column_name} INT NOT NULL DEFAULT 0
@@ -77,10 +77,10 @@ def increment_column_for_today(column_name: str):
             cursor.execute(insert_query, (today_date, *values))
 
         connection.commit()
-        print(f"Successfully updated column '{safe_column_name}' for date {today_date}")
+        logger.debug(f"Successfully updated column '{safe_column_name}' for date {today_date}")
         
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
+        logger.error(f"An error occurred: {str(e)}")
         if connection:
             connection.rollback()
     finally:
@@ -1,16 +1,18 @@
+import logging
 import os
 import pymysql
 from dotenv import load_dotenv
 from typing import List, Dict, Tuple, Optional
 import uuid
-from pinecone import Pinecone
-from pinecone import ServerlessSpec
 from connection import getconnection, release_connection
+import services
 
 
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 #! FOR INJECTION API
 
 
@@ -20,7 +22,7 @@ def insert_case(namespace: str, index_name: str, project: str):
     try:
         conn = getconnection()
         if not conn:
-            print("Failed to connect to database")
+            logger.error("Failed to connect to database")
             return False
             
         with conn.cursor() as cursor:
@@ -30,11 +32,12 @@ def insert_case(namespace: str, index_name: str, project: str):
         return True
     except pymysql.err.IntegrityError as e:
         if "Duplicate entry" in str(e) and "PRIMARY" in str(e):
-            print(f"Duplicate namespace detected: {namespace}")
-        print(e)
+            logger.warning(f"Duplicate namespace detected: {namespace}")
+        else:
+            logger.error(e)
         return False
     except Exception as e:
-        print(e)
+        logger.error(e)
         return False
     finally:
         if conn:
@@ -45,13 +48,15 @@ def insert_case(namespace: str, index_name: str, project: str):
 
 
 
-def create_unique_pinecone_index(dimension: int, metric: str = "cosine", pod_type: Optional[str] = None, api_key: str = os.environ["PINECONE_API_KEY"]) -> str:
+def create_unique_pinecone_index(dimension: int, metric: str = "cosine", pod_type: Optional[str] = None, api_key: Optional[str] = None) -> str:
     """
     Create a new Pinecone index with a unique auto-generated name to avoid naming collisions.
     """
+    from pinecone import ServerlessSpec
+
     pc = None
     try:
-        pc = Pinecone(api_key=api_key)
+        pc = services.get_pinecone(api_key or os.environ["PINECONE_API_KEY"])
         existing_indexes = pc.list_indexes()
         # Generate a unique index name
         while True:
@@ -81,11 +86,9 @@ def count_namespaces_in_index(index_name: str, api_key: str) -> int:
     """
     Count the number of namespaces in the given Pinecone index.
     """
-    pc = None
     index = None
     try:
-        pc = Pinecone(api_key=api_key)
-        index = pc.Index(index_name)
+        index = services.get_index(api_key, index_name)
         stats = index.describe_index_stats()
         return len(stats.get("namespaces", {}))
     finally:
@@ -113,7 +116,7 @@ def get_index_project_by_namespace(namespace: str) -> Tuple[str, str]:
     try:
         conn = getconnection()
         if not conn:
-            print("Failed to connect to database")
+            logger.error("Failed to connect to database")
             return None, None
             
         with conn.cursor() as cursor:
@@ -128,13 +131,152 @@ def get_index_project_by_namespace(namespace: str) -> Tuple[str, str]:
             return None, None
             
     except Exception as e:
-        print(f"Error querying database: {e}")
+        logger.error(f"Error querying database: {e}")
         return None, None
     finally:
         if conn:
             release_connection(conn)
 
 
+def get_routes_by_namespaces(namespaces: List[str]) -> Dict[str, Tuple[str, str]]:
+    """
+    Look up the (index_name, project) of several namespaces in one query.
+
+    Namespaces without a route are left out of the result.
+    """
+    if not namespaces:
+        return {}
+    conn = None
+    try:
+        conn = getconnection()
+        if not conn:
+            logger.error("Failed to connect to database")
+            return {}
+
+        with conn.cursor() as cursor:
+            placeholders = ", ".join(["%s"] * len(namespaces))
+            sql = f"SELECT namespace, index_name, project FROM volume_handling_table WHERE namespace IN ({placeholders})"
+            cursor.execute(sql, tuple(namespaces))
+            return {row['namespace']: (row['index_name'], row['project']) for row in cursor.fetchall()}
+
+    except Exception as e:
+        logger.error(f"Error querying database: {e}")
+        return {}
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def get_routes_by_index(index_name: str) -> Optional[Dict[str, str]]:
+    """
+    Get the namespaces routed to an index, as {namespace: project}.
+
+    Returns None if the database could not be queried.
+    """
+    conn = None
+    try:
+        conn = getconnection()
+        if not conn:
+            logger.error("Failed to connect to database")
+            return None
+
+        with conn.cursor() as cursor:
+            sql = "SELECT namespace, project FROM volume_handling_table WHERE index_name = %s"
+            cursor.execute(sql, (index_name,))
+            return {row['namespace']: row['project'] for row in cursor.fetchall()}
+
+    except Exception as e:
+        logger.error(f"Error querying database: {e}")
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def get_routed_namespaces() -> Optional[List[str]]:
+    """
+    Get every namespace that has a route.
+
+    Returns None if the database could not be queried.
+    """
+    conn = None
+    try:
+        conn = getconnection()
+        if not conn:
+            logger.error("Failed to connect to database")
+            return None
+
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT namespace FROM volume_handling_table")
+            return [row['namespace'] for row in cursor.fetchall()]
+
+    except Exception as e:
+        logger.error(f"Error querying database: {e}")
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def get_routed_indexes() -> Optional[List[Tuple[str, str]]]:
+    """
+    Get every (index_name, project) that has at least one namespace routed to it.
+
+    Returns None if the database could not be queried.
+    """
+    conn = None
+    try:
+        conn = getconnection()
+        if not conn:
+            logger.error("Failed to connect to database")
+            return None
+
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT index_name, project FROM volume_handling_table")
+            return [(row['index_name'], row['project']) for row in cursor.fetchall()]
+
+    except Exception as e:
+        logger.error(f"Error querying database: {e}")
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
+
+def delete_cases(namespaces: List[str]) -> Optional[int]:
+    """
+    Delete the routes of several namespaces from volume_handling_table.
+
+    Returns the number of rows deleted, or None if the database could not be updated.
+    """
+    if not namespaces:
+        return 0
+    conn = None
+    try:
+        conn = getconnection()
+        if not conn:
+            logger.error("Failed to connect to database")
+            return None
+
+        deleted = 0
+        with conn.cursor() as cursor:
+            # Keep each statement's IN list bounded
+            for start in range(0, len(namespaces), 1000):
+                batch = namespaces[start:start + 1000]
+                placeholders = ", ".join(["%s"] * len(batch))
+                deleted += cursor.execute(
+                    f"DELETE FROM volume_handling_table WHERE namespace IN ({placeholders})", tuple(batch)
+                )
+        conn.commit()
+        return deleted
+
+    except Exception as e:
+        logger.error(f"Error deleting routes: {e}")
+        return None
+    finally:
+        if conn:
+            release_connection(conn)
+
 
 def get_index_namespace_and_project(index_name: str) -> Tuple[str, str]:
     """
@@ -151,7 +293,7 @@ def get_index_namespace_and_project(index_name: str) -> Tuple[str, str]:
     try:
         conn = getconnection()
         if not conn:
-            print("Failed to connect to database")
+            logger.error("Failed to connect to database")
             return None, None
             
         with conn.cursor() as cursor:
@@ -166,7 +308,7 @@ def get_index_namespace_and_project(index_name: str) -> Tuple[str, str]:
             return None, None
             
     except Exception as e:
-        print(f"Error querying database: {e}")
+        logger.error(f"Error querying database: {e}")
         return None, None
     finally:
         if conn:
@@ -0,0 +1,208 @@
+"""
+Answers to standard questions, precomputed after ingestion.
+
+With PRECOMPUTE_ANSWERS=true, every successfully ingested (or re-ingested)
+document gets answers to the standard questions generated in the background,
+through the normal chat pipeline. /api/v1/chat serves a stored answer straight
+away when the user's question matches one of the questions or its aliases,
+ignoring case, punctuation and spacing.
+
+Each answer is stored with the system prompt version and model that produced
+it; after either changes, stored answers are no longer served and chats fall
+back to live generation. Re-ingesting a document drops its answers before new
+ones are computed.
+
+Each schedule() starts a new generation of the namespace's answers. A run only
+writes while its generation is current, so a run still working on the old
+version of a re-ingested (or deleted) document can never store answers about
+it; it stops at its next question, and queued runs are skipped.
+
+The questions come from PRECOMPUTE_QUESTIONS, a JSON list whose items are
+either a question or {"question": ..., "aliases": [...]}.
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from local_store import ensure_schema, local_db
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+PRECOMPUTE_ANSWERS = os.environ.get("PRECOMPUTE_ANSWERS", "false").lower() == "true"
+PRECOMPUTE_WORKERS = int(os.environ.get("PRECOMPUTE_WORKERS", "1"))
+
+DEFAULT_QUESTIONS = [
+    {
+        "question": "What is the main issue in this case?",
+        "aliases": ["What is the main issue?", "What is the main issue of this case?", "What are the main issues in this case?"],
+    },
+    {
+        "question": "Summarize this case.",
+        "aliases": ["Summarize the case", "Summarise this case", "Give me a summary of this case", "Case summary"],
+    },
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS precomputed_answer (
+    namespace TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    model TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (namespace, question)
+);
+CREATE TABLE IF NOT EXISTS precompute_generation (
+    namespace TEXT PRIMARY KEY,
+    generation TEXT NOT NULL
+);
+"""
+
+PRECOMPUTED = counter(
+    "caseon_precomputed_answers_total",
+    "Precomputed answers generated, failed, served, stale (stored with an older prompt or model), "
+    "and superseded (computed for a document version that has since changed).",
+    ("event",),
+)
+
+
+def normalize(question: str) -> str:
+    """Case-, punctuation- and whitespace-insensitive form of a question."""
+    return " ".join(re.sub(r"[^\w\s]", " ", question).split()).casefold()
+
+
+def _load_questions() -> List[Dict]:
+    raw = os.environ.get("PRECOMPUTE_QUESTIONS")
+    items = json.loads(raw) if raw else DEFAULT_QUESTIONS
+    return [{"question": item, "aliases": []} if isinstance(item, str) else item for item in items]
+
+
+QUESTIONS = _load_questions()
+# normalized question or alias -> canonical question
+_MATCHES = {
+    normalize(text): item["question"]
+    for item in QUESTIONS
+    for text in [item["question"], *item.get("aliases", [])]
+}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _current_version():
+    import services
+    from generative_model import PROMPT_VERSION
+    return PROMPT_VERSION, services.CHAT_MODEL
+
+
+def match(user_input: str) -> Optional[str]:
+    """The standard question user_input asks, if any."""
+    return _MATCHES.get(normalize(user_input))
+
+
+def lookup(namespace: str, user_input: str) -> Optional[str]:
+    """A stored answer for user_input on namespace, if it matches a standard question and is current."""
+    question = match(user_input)
+    if question is None:
+        return None
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        row = conn.execute(
+            "SELECT answer, prompt_version, model FROM precomputed_answer WHERE namespace = ? AND question = ?",
+            (namespace, question),
+        ).fetchone()
+    if row is None:
+        return None
+    if (row["prompt_version"], row["model"]) != _current_version():
+        PRECOMPUTED.inc(event="stale")
+        return None
+    PRECOMPUTED.inc(event="served")
+    return row["answer"]
+
+
+def delete_namespace(namespace: str) -> None:
+    """Drop namespace's answers and end its current generation, so runs in progress store nothing."""
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.execute("DELETE FROM precompute_generation WHERE namespace = ?", (namespace,))
+        conn.execute("DELETE FROM precomputed_answer WHERE namespace = ?", (namespace,))
+
+
+def copy_namespace(source: str, target: str) -> None:
+    """Give target the answers stored for source (same document, so the same answers)."""
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO precomputed_answer "
+            "(namespace, question, answer, prompt_version, model, created_at) "
+            "SELECT ?, question, answer, prompt_version, model, created_at FROM precomputed_answer WHERE namespace = ?",
+            (target, source),
+        )
+
+
+def _is_current(namespace: str, generation: str) -> bool:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        return conn.execute(
+            "SELECT 1 FROM precompute_generation WHERE namespace = ? AND generation = ?", (namespace, generation)
+        ).fetchone() is not None
+
+
+def precompute(namespace: str, generation: str) -> None:
+    """Generate and store answers to every standard question for namespace, while generation is current."""
+    import workloads
+    from main_chat import answer_question
+
+    prompt_version, model = _current_version()
+    for item in QUESTIONS:
+        # Interactive chats go first; this is background work
+        workloads.yield_to_interactive()
+        if not _is_current(namespace, generation):
+            logger.info(f"Precomputation for {namespace} superseded, stopping")
+            return
+        question = item["question"]
+        try:
+            answer = answer_question(namespace, question)
+        except Exception as e:
+            PRECOMPUTED.inc(event="failed")
+            logger.warning(f"Precomputing {question!r} for {namespace} failed: {e}")
+            continue
+        ensure_schema(_SCHEMA)
+        with local_db() as conn:
+            # The document may have been re-ingested or deleted while the answer was generated
+            stored = conn.execute(
+                "INSERT OR REPLACE INTO precomputed_answer "
+                "(namespace, question, answer, prompt_version, model, created_at) "
+                "SELECT ?, ?, ?, ?, ?, ? WHERE EXISTS "
+                "(SELECT 1 FROM precompute_generation WHERE namespace = ? AND generation = ?)",
+                (namespace, question, answer, prompt_version, model, time.time(), namespace, generation),
+            ).rowcount
+        PRECOMPUTED.inc(event="generated" if stored else "superseded")
+
+
+def schedule(namespace: str) -> None:
+    """Queue precomputation for namespace in the background, when enabled."""
+    global _executor
+    if not PRECOMPUTE_ANSWERS or not QUESTIONS:
+        return
+    generation = uuid.uuid4().hex
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        # Supersedes any earlier run for the namespace
+        conn.execute(
+            "INSERT OR REPLACE INTO precompute_generation (namespace, generation) VALUES (?, ?)", (namespace, generation)
+        )
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=PRECOMPUTE_WORKERS, thread_name_prefix="precompute")
+    # Keeps the ingestion request's ID on the records it logs
+    _executor.submit(contextvars.copy_context().run, precompute, namespace, generation)
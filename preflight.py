@@ -0,0 +1,172 @@
+"""
+Preflight checks for uploads, before anything is parsed or embedded.
+
+A downloaded PDF is inspected cheaply with pypdf: its page count, and the text
+of evenly spaced sample pages (a tenth of them, up to PREFLIGHT_SAMPLE_PAGES).
+From those come the share of pages with extractable text (scanned pages have
+none, and this pipeline does no OCR) and estimates of the characters, chunks
+and embedding tokens the full document would produce. Uploads over the limits are rejected
+with PreflightRejected before they can run into the worker timeout:
+
+- PREFLIGHT_MAX_BYTES: the download itself is aborted past this size.
+- PREFLIGHT_MAX_PAGES, PREFLIGHT_MAX_CHUNKS, PREFLIGHT_MAX_TOKENS.
+- PREFLIGHT_MIN_TEXT_RATIO: the share of sampled pages with at least
+  PREFLIGHT_MIN_CHARS_PER_PAGE characters of text.
+
+0 disables a limit. Per-key limits can be overridden with PREFLIGHT_KEY_LIMITS,
+a JSON object keyed by services.key_id(api_key) like ADMISSION_KEY_LIMITS, e.g.
+{"3f2a9c1e": {"max_pages": 5000, "max_tokens": 0}}, validated the same way.
+
+Estimates are extrapolated from the sample, so they are approximate for
+documents whose pages vary a lot. With PREFLIGHT_EMBEDDING_COST_PER_MILLION set
+they include the expected embedding cost.
+"""
+import logging
+import os
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+from metrics import counter
+from services import load_key_limits
+
+logger = logging.getLogger(__name__)
+
+PREFLIGHT_ENABLED = os.environ.get("PREFLIGHT_ENABLED", "true").lower() == "true"
+PREFLIGHT_MAX_BYTES = int(os.environ.get("PREFLIGHT_MAX_BYTES", str(100 * 1024 * 1024)))
+PREFLIGHT_MAX_PAGES = int(os.environ.get("PREFLIGHT_MAX_PAGES", "1000"))
+PREFLIGHT_MAX_CHUNKS = int(os.environ.get("PREFLIGHT_MAX_CHUNKS", "10000"))
+PREFLIGHT_MAX_TOKENS = int(os.environ.get("PREFLIGHT_MAX_TOKENS", "2000000"))
+PREFLIGHT_MIN_TEXT_RATIO = float(os.environ.get("PREFLIGHT_MIN_TEXT_RATIO", "0.5"))
+PREFLIGHT_MIN_CHARS_PER_PAGE = int(os.environ.get("PREFLIGHT_MIN_CHARS_PER_PAGE", "50"))
+PREFLIGHT_SAMPLE_PAGES = int(os.environ.get("PREFLIGHT_SAMPLE_PAGES", "20"))
+PREFLIGHT_EMBEDDING_COST_PER_MILLION = float(os.environ.get("PREFLIGHT_EMBEDDING_COST_PER_MILLION", "0"))
+
+# Matches the splitter in document_processing.load_and_split_pdf
+_CHUNK_SIZE = 512
+_CHUNK_OVERLAP = 50
+# Rough characters per embedding token for English text
+_CHARS_PER_TOKEN = 4
+# Pages sampled are a tenth of the document, at least this many and at most PREFLIGHT_SAMPLE_PAGES
+_MIN_SAMPLE_PAGES = 3
+
+PREFLIGHT_CHECKS = counter(
+    "caseon_ingest_preflight_total",
+    "Upload preflight checks by outcome (passed, rejected, estimated) and reason of rejection.",
+    ("outcome", "reason"),
+)
+
+
+@dataclass
+class PreflightLimits:
+    max_bytes: int = PREFLIGHT_MAX_BYTES
+    max_pages: int = PREFLIGHT_MAX_PAGES
+    max_chunks: int = PREFLIGHT_MAX_CHUNKS
+    max_tokens: int = PREFLIGHT_MAX_TOKENS
+    min_text_ratio: float = PREFLIGHT_MIN_TEXT_RATIO
+
+
+PREFLIGHT_KEY_LIMITS: Dict[str, PreflightLimits] = load_key_limits("PREFLIGHT_KEY_LIMITS", PreflightLimits)
+
+
+class PreflightRejected(ValueError):
+    """An upload is over a preflight limit; estimate holds what was measured."""
+
+    def __init__(self, reason: str, message: str, estimate: Optional[Dict] = None):
+        super().__init__(message)
+        self.reason = reason
+        self.estimate = estimate or {}
+
+
+def limits_for(key_id: Optional[str]) -> PreflightLimits:
+    return PREFLIGHT_KEY_LIMITS.get(key_id) or PreflightLimits()
+
+
+def reject(reason: str, message: str, estimate: Optional[Dict] = None) -> PreflightRejected:
+    PREFLIGHT_CHECKS.inc(outcome="rejected", reason=reason)
+    logger.warning(f"Upload rejected by preflight ({reason}): {message}")
+    return PreflightRejected(reason, message, estimate)
+
+
+def _sample(page_count: int) -> List[int]:
+    # Short documents are parsed in full right after, so only a few of their pages are read here
+    size = min(page_count, PREFLIGHT_SAMPLE_PAGES, max(_MIN_SAMPLE_PAGES, -(-page_count // 10)))
+    if size <= 0:
+        return []
+    step = page_count / size
+    return sorted({int(i * step) for i in range(size)})
+
+
+def inspect(pdf_path: str) -> Dict:
+    """Page count, text ratio and size estimates of a PDF, from a sample of its pages."""
+    from pypdf import PdfReader
+
+    size = os.path.getsize(pdf_path)
+    try:
+        reader = PdfReader(pdf_path)
+        if reader.is_encrypted and not reader.decrypt(""):
+            raise reject("encrypted", "The PDF is password protected", {"bytes": size})
+        page_count = len(reader.pages)
+        sampled = _sample(page_count)
+        lengths = [len((reader.pages[i].extract_text() or "").strip()) for i in sampled]
+    except PreflightRejected:
+        raise
+    except Exception as e:
+        raise reject("unreadable", f"The PDF could not be read: {e}", {"bytes": size})
+
+    text_pages = sum(1 for length in lengths if length >= PREFLIGHT_MIN_CHARS_PER_PAGE)
+    chars = int(sum(lengths) / len(lengths) * page_count) if lengths else 0
+    chunks = -(-chars // (_CHUNK_SIZE - _CHUNK_OVERLAP)) if chars else 0
+    # Overlapping characters are embedded twice
+    tokens = (chars + chunks * _CHUNK_OVERLAP) // _CHARS_PER_TOKEN
+    estimate = {
+        "bytes": size,
+        "pages": page_count,
+        "sampled_pages": len(sampled),
+        "text_ratio": round(text_pages / len(lengths), 3) if lengths else 0.0,
+        "estimated_chars": chars,
+        "estimated_chunks": chunks,
+        "estimated_tokens": tokens,
+    }
+    if PREFLIGHT_EMBEDDING_COST_PER_MILLION > 0:
+        estimate["estimated_embedding_cost"] = round(tokens / 1e6 * PREFLIGHT_EMBEDDING_COST_PER_MILLION, 6)
+    return estimate
+
+
+def violations(estimate: Dict, limits: PreflightLimits) -> List[Dict]:
+    """The limits estimate is over, as (reason, message) dicts; empty when it passes."""
+    found = []
+    for reason, measured, limit in (
+        ("too_large", estimate["bytes"], limits.max_bytes),
+        ("too_many_pages", estimate["pages"], limits.max_pages),
+        ("too_many_chunks", estimate["estimated_chunks"], limits.max_chunks),
+        ("too_many_tokens", estimate["estimated_tokens"], limits.max_tokens),
+    ):
+        if limit and measured > limit:
+            found.append({"reason": reason, "message": f"{reason.replace('_', ' ')}: {measured} > {limit}"})
+    if estimate["pages"] == 0:
+        found.append({"reason": "no_pages", "message": "The PDF has no pages"})
+    elif estimate["text_ratio"] < limits.min_text_ratio:
+        found.append({
+            "reason": "no_text",
+            "message": (f"Only {estimate['text_ratio']:.0%} of sampled pages have extractable text "
+                        f"(minimum {limits.min_text_ratio:.0%}); scanned documents need OCR first"),
+        })
+    return found
+
+
+def check(pdf_path: str, limits: PreflightLimits) -> Dict:
+    """Inspect pdf_path and raise PreflightRejected if it is over limits; returns the estimate."""
+    estimate = inspect(pdf_path)
+    found = violations(estimate, limits)
+    if found:
+        raise reject(found[0]["reason"], "; ".join(v["message"] for v in found), estimate)
+    PREFLIGHT_CHECKS.inc(outcome="passed", reason="")
+    return estimate
+
+
+def dry_run(pdf_path: str, limits: PreflightLimits) -> Dict:
+    """The estimate and any limits it is over, without rejecting."""
+    estimate = inspect(pdf_path)
+    found = violations(estimate, limits)
+    PREFLIGHT_CHECKS.inc(outcome="estimated", reason="")
+    return {"estimate": estimate, "within_limits": not found, "violations": found, "limits": asdict(limits)}
@@ -1,13 +1,32 @@
+import contextvars
+import logging
 import os
-from pinecone import Pinecone
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pydantic import BaseModel
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
-from pinecone_index_manager import get_index_project_by_namespace
-import gc
+from metrics import record_request_timing, stage
+import chunk_store
+import hot_tier
+import resilience
+import services
+import shared_cache
+import shard_map
 
 load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Multi-document chats search their namespaces on this many threads per process
+MULTI_NAMESPACE_WORKERS = int(os.environ.get("MULTI_NAMESPACE_WORKERS", "16"))
+# Matches each document keeps in a multi-document context however it scores
+MULTI_NAMESPACE_MIN_RESULTS = int(os.environ.get("MULTI_NAMESPACE_MIN_RESULTS", "3"))
+
+_fanout: Optional[ThreadPoolExecutor] = None
+_fanout_lock = threading.Lock()
+
 class PineconeVectorStore(BaseModel):
     index_name: str
     query: str
@@ -18,13 +37,98 @@ class QueryResult(BaseModel):
     score: float
 
 
-PROJECT_1 = "QA1"
-PROJECT_2 = "QA2"
+def response_field(obj, name):
+    # Pinecone responses are models that also support item access; stand-ins are plain dicts
+    return obj.get(name) if hasattr(obj, "get") else getattr(obj, name, None)
+
+
+def hydrate_chunks(index, namespace: str, vector_ids: List[str]) -> Dict[str, Tuple[str, Dict]]:
+    """
+    Look up chunk texts by vector ID in the local chunk store.
+
+    Chunks uploaded before the store existed are fetched from Pinecone metadata
+    once and written back to the store.
+    """
+    found = chunk_store.get_chunks(vector_ids)
+    missing = [vid for vid in vector_ids if vid not in found]
+    if missing:
+        response = index.fetch(ids=missing, namespace=namespace)
+        backfill = []
+        for vid, vector in (response_field(response, "vectors") or {}).items():
+            metadata = dict(response_field(vector, "metadata") or {})
+            text = metadata.pop("text", "")
+            found[vid] = (text, metadata)
+            if text:
+                backfill.append((vid, text, metadata))
+        if backfill:
+            chunk_store.put_chunks(namespace, backfill)
+    return found
+
+
+def embed_query(query: str) -> List[float]:
+    """Query embedding, from the shared cache when another request already embedded this text."""
+    with stage("chat", "embed_query"):
+        query_embedding = shared_cache.get_embedding(services.EMBEDDING_MODEL, query)
+        if query_embedding is None:
+            embeddings = services.get_embeddings()
+            query_embedding = resilience.call("embed_query", embeddings.embed_query, query)
+            shared_cache.set_embedding(services.EMBEDDING_MODEL, query, query_embedding)
+    return query_embedding
+
+
+def search_namespace(query_embedding: List[float], namespace: str, index_name: str, project: str,
+                     top_k: int = 30) -> List[QueryResult]:
+    """Top matches of one namespace, best first, with their texts."""
+    with stage("chat", "client_setup"):
+        index = shard_map.get_index(index_name, project)
+
+    # Query Pinecone; in store mode only IDs and scores come back over the network
+    hydrate = chunk_store.hydrate_from_store()
+    # Hot namespaces are answered from the local hot tier; Pinecone otherwise
+    with stage("chat", "hot_tier_query"):
+        matches = hot_tier.query(namespace, query_embedding, top_k=top_k)
+    if matches is None:
+        with stage("chat", "vector_query"):
+            results = resilience.call(
+                "vector_query",
+                index.query,
+                vector=query_embedding,
+                top_k=top_k,
+                include_metadata=not hydrate,
+                namespace=namespace,
+            )
+        matches = results["matches"]
+
+    # Chunks uploaded without text in their metadata are hydrated from the store too
+    to_hydrate = [
+        match["id"] for match in matches
+        if hydrate or not (response_field(match, "metadata") or {}).get("text")
+    ]
+    hydrated = {}
+    if to_hydrate:
+        with stage("chat", "hydrate_chunks"):
+            hydrated = hydrate_chunks(index, namespace, to_hydrate)
+
+    # Extract results and metadata
+    query_results = []
+    for match in matches:
+        if match["id"] in hydrated:
+            text, match_metadata = hydrated[match["id"]]
+        else:
+            match_metadata = response_field(match, "metadata") or {}
+            text = match_metadata.get("text", "")
+        metadata = {
+            "page": match_metadata.get("page", "Unknown"),
+            "score": match["score"],
+            # Add any other metadata fields you want to track
+            "chunk_index": match_metadata.get("chunk_index", "Unknown"),
+        }
+        query_results.append(QueryResult(text=text, metadata=metadata, score=match["score"]))
+    return query_results
 
 
 def pincone_vector_database_query(query: str, namespace: str):
-    pc = None
-    index = None
+    query_results = None
     try:
         """
         Query the Pinecone vector database and return results with full metadata
@@ -38,70 +142,104 @@ def pincone_vector_database_query(query: str, namespace: str):
         """
 
         # Initialize embeddings and Pinecone
-        print(f"Getting index and project for namespace: {namespace}")
-        index_name, project = get_index_project_by_namespace(namespace)
-        print(f"Retrieved index_name: {index_name}, project: {project}")
+        with stage("chat", "routing_lookup"):
+            index_name, project = shared_cache.get_route(namespace)
+        logger.debug(f"Namespace {namespace} is in index {index_name}, project {project}")
         
         if not index_name or not project:
             raise ValueError(f"No index or project found for namespace: {namespace}")
         
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=os.environ["GOOGLE_API_KEY"])
-        print(f"Using project: {project}")
-        if project == PROJECT_1:
-            pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
-            index = pc.Index(index_name)
-        elif project == PROJECT_2:
-            pc = Pinecone(api_key=os.environ["PINECONE_API_KEY_SECOND_PROJECT"])
-            index = pc.Index(index_name)
-        else:
-            raise ValueError(f"Invalid project: {project}")
-        
         # Get query embedding
-        query_embedding = embeddings.embed_query(query)
-        
-        # Query Pinecone
-        results = index.query(
-            vector=query_embedding,
-            top_k=30,
-            include_metadata=True,
-            namespace=namespace,
-        )
-        
-        # Extract results and metadata
-        query_results = []
-        for match in results["matches"]:
-            text = match["metadata"].get("text", "")
-            metadata = {
-                "page": match["metadata"].get("page", "Unknown"),
-                "score": match["score"],
-                # Add any other metadata fields you want to track
-                "chunk_index": match["metadata"].get("chunk_index", "Unknown"),
-            }
-            query_results.append(QueryResult(text=text, metadata=metadata, score=match["score"]))
+        query_embedding = embed_query(query)
+        query_results = search_namespace(query_embedding, namespace, index_name, project)
         
         # Return both texts and full metadata
         texts = [result.text for result in query_results]
         metadata_list = [result.metadata for result in query_results]
         return texts, metadata_list
         
+    except resilience.UpstreamError:
+        # Timeouts and open circuits are the caller's to handle, not an empty context
+        raise
     except Exception as e:
-        print(f"An error occurred in pinecone vector database query: {str(e)}")
-        import traceback
-        print("Full error details:")
-        print(traceback.format_exc())
+        logger.exception(f"An error occurred in pinecone vector database query: {e}")
         return None, None
     
     finally:
-        # Help garbage collection by clearing references and forcing collection
-        embeddings = None
+        # Drop references to the results; the clients are shared and owned by
+        # services.py, and collection is left to memory_management.py
         query_embedding = None
-        results = None
         query_results = None
-        
-        # No explicit cleanup needed for Pinecone clients
-        pc = None
-        index = None
-        
-        # Force garbage collection
-        gc.collect()
-    
+
+
+def _fanout_executor() -> ThreadPoolExecutor:
+    global _fanout
+    if _fanout is None:
+        with _fanout_lock:
+            if _fanout is None:
+                _fanout = ThreadPoolExecutor(max_workers=MULTI_NAMESPACE_WORKERS, thread_name_prefix="fanout")
+    return _fanout
+
+
+def _timed_search(query_embedding, namespace, index_name, project, top_k):
+    start = time.perf_counter()
+    try:
+        return search_namespace(query_embedding, namespace, index_name, project, top_k)
+    finally:
+        record_request_timing(f"namespace:{namespace}", time.perf_counter() - start)
+
+
+def merge_results(results: Dict[str, List[QueryResult]], top_k: int, min_per_namespace: int) -> List[QueryResult]:
+    """
+    Best top_k results across namespaces by score, keeping the best
+    min_per_namespace of each namespace so every document is represented.
+    """
+    kept = []
+    for namespace_results in results.values():
+        kept.extend(sorted(namespace_results, key=lambda r: r.score, reverse=True)[:min_per_namespace])
+    kept_ids = {id(result) for result in kept}
+    rest = sorted((r for rs in results.values() for r in rs if id(r) not in kept_ids), key=lambda r: r.score, reverse=True)
+    merged = kept + rest[:max(0, top_k - len(kept))]
+    return sorted(merged, key=lambda r: r.score, reverse=True)
+
+
+def multi_namespace_query(query: str, namespaces: List[str], top_k: int = 30) -> Tuple[List[QueryResult], Dict[str, str]]:
+    """
+    Search several namespaces, possibly in different indexes and projects, for one query.
+
+    Routes come from one lookup and the query is embedded once; the namespaces
+    are then searched concurrently and their matches merged by score (see
+    merge_results), each result's metadata naming its "source" namespace.
+    Returns (results, failed) where failed maps namespaces that could not be
+    searched to the reason; raises if none could be.
+    """
+    with stage("chat", "routing_lookup"):
+        routes = shared_cache.get_routes(namespaces)
+    failed = {namespace: "not found" for namespace in namespaces if namespace not in routes}
+    if not routes:
+        raise ValueError(f"No index or project found for namespaces: {', '.join(namespaces)}")
+
+    query_embedding = embed_query(query)
+    # Each search runs in the caller's context so stage timings land in this request
+    with stage("chat", "fanout_query"):
+        futures = {
+            namespace: _fanout_executor().submit(
+                contextvars.copy_context().run, _timed_search, query_embedding, namespace, index_name, project, top_k
+            )
+            for namespace, (index_name, project) in routes.items()
+        }
+        results, errors = {}, []
+        for namespace, future in futures.items():
+            try:
+                results[namespace] = future.result()
+            except Exception as e:
+                logger.warning(f"Searching {namespace} failed, answering from the other documents: {e}")
+                failed[namespace] = str(e)
+                errors.append(e)
+    if not results:
+        raise errors[0]
+
+    for namespace, namespace_results in results.items():
+        for result in namespace_results:
+            result.metadata["source"] = namespace
+    return merge_results(results, top_k, MULTI_NAMESPACE_MIN_RESULTS), failed
@@ -1,58 +1,127 @@
-from flask import Flask, request, jsonify
+import serving_mode
+
+# Async serving mode must patch the standard library before anything else imports it
+if __name__ == "__main__" and serving_mode.is_async():
+    serving_mode.patch_for_async()
+
+from flask import Flask, request, jsonify, g, Response
 import logging
 import os
 from document_processing import document_chunking_and_uploading_to_vectorstore
-from main_chat import start_chatting
+from preflight import PreflightRejected
+import deletion
+from main_chat import MULTI_CHAT_MAX_NAMESPACES, start_chatting, start_multi_chat
 from functools import wraps
-import gc
+from metrics import REQUEST_SECONDS, REQUESTS_TOTAL, start_request_timings, get_request_timings, render_prometheus
+import admission
+import log_config
+import memory_management
+import resilience
+import services
+import sessions
+import workloads
 import time
 
 app = Flask(__name__)
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# Configure logging (see log_config.py for the LOG_* settings)
+log_config.configure()
 logger = logging.getLogger(__name__)
 
 # Load valid API keys from the API_KEYS environment variable
 # Expected format: a comma-separated string, e.g., "key1,key2,key3"
 api_keys_str = os.environ.get("API_KEYS", "")
-VALID_API_KEYS = set(filter(None, api_keys_str.split(",")))
-logger.info(f"Loaded {len(VALID_API_KEYS)} API keys from environment.")
-
-import os
-import logging
-
-logger = logging.getLogger(__name__)
-api_keys_str = os.environ.get("API_KEYS", "")
 VALID_API_KEYS = set(key.strip() for key in filter(None, api_keys_str.split(",")))
-logger.info(f"Loaded API keys: {VALID_API_KEYS}")
+logger.info(f"Loaded {len(VALID_API_KEYS)} API keys from environment.")
 
-# Track last memory cleanup time
-last_gc_time = time.time()
-gc_interval = 60  # Perform garbage collection every 60 seconds
+# Apply the garbage collection policy (see memory_management.py for the GC_* settings)
+memory_management.configure()
 
 def require_api_key(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         api_key = request.headers.get("x-api-key", "").strip()
-        logger.info(f"Received API key: {api_key}")
         if api_key not in VALID_API_KEYS:
-            logger.warning("Unauthorized access attempt.")
+            logger.warning(f"Unauthorized access attempt from {request.remote_addr}.")
             return jsonify({"error": "Unauthorized"}), 401
         return f(*args, **kwargs)
     return decorated_function
 
-# Middleware for periodic garbage collection
+def admit(workload):
+    """Apply per-key rate limits, concurrency caps and fair queuing (see admission.py); 429 when rejected"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            api_key = request.headers.get("x-api-key", "").strip()
+            try:
+                ticket = admission.acquire(api_key, workload)
+            except admission.Rejected as e:
+                response = jsonify({"success": False, "error": e.reason})
+                response.status_code = 429
+                response.headers["Retry-After"] = str(max(1, int(e.retry_after + 0.999)))
+                return response
+            try:
+                return f(*args, **kwargs)
+            finally:
+                admission.release(ticket)
+        return decorated_function
+    return decorator
+
+def wants_timings(data):
+    """Whether the client asked for the per-stage timing breakdown in the response"""
+    return bool(data.get("include_timings")) or request.args.get("include_timings") == "true"
+
+def upstream_unavailable(error):
+    """503 for an upstream that timed out or whose circuit is open, with Retry-After when known"""
+    logger.warning(f"Upstream unavailable: {error}")
+    response = jsonify({
+        "success": False,
+        "error": f"Upstream service unavailable: {error.upstream}"
+    })
+    response.status_code = 503
+    if isinstance(error, resilience.CircuitOpenError):
+        response.headers["Retry-After"] = str(max(1, int(error.retry_after + 0.5)))
+    return response
+
+def workload_at_capacity(error):
+    """503 when the chat or ingestion executor and its queue are full"""
+    logger.warning(f"Rejected request: {error}")
+    response = jsonify({
+        "success": False,
+        "error": str(error)
+    })
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
 @app.before_request
 def before_request():
-    global last_gc_time
-    current_time = time.time()
-    
-    # Trigger garbage collection periodically
-    if current_time - last_gc_time > gc_interval:
-        logger.info("Performing scheduled garbage collection")
-        gc.collect()
-        last_gc_time = current_time
+    g.request_start = time.perf_counter()
+    start_request_timings()
+    # Correlates every log record of the request, including work done on the bulkhead executors
+    g.request_id = (request.headers.get("X-Request-ID") or "").strip()[:64] or log_config.new_request_id()
+    g.request_id_token = log_config.set_request_id(g.request_id)
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get("request_start")
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        status = str(response.status_code)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, status=status)
+        REQUESTS_TOTAL.inc(endpoint=endpoint, status=status)
+    if g.get("request_id"):
+        response.headers["X-Request-ID"] = g.request_id
+    return response
+
+@app.teardown_request
+def reset_request_id(error=None):
+    token = g.pop("request_id_token", None)
+    if token is not None:
+        log_config.reset_request_id(token)
+
+# Collect garbage only when RSS growth calls for it, after the response is sent
+app.after_request(memory_management.schedule_collection)
 
 # Error Handlers
 @app.errorhandler(404)
@@ -61,7 +130,7 @@ def not_found_error(error):
 
 @app.errorhandler(500)
 def internal_server_error(error):
-    logging.error(f"Internal server error: {error}")
+    logger.error(f"Internal server error: {error}")
     return jsonify({"error": "Internal server error"}), 500
 
 @app.errorhandler(400)
@@ -71,41 +140,79 @@ def bad_request_error(error):
 # Document Processing Endpoint
 @app.route("/api/v1/document/process", methods=["POST"])
 @require_api_key
+@admit("ingest")
 def process_document():
     try:
         data = request.get_json()
-        if not data or "link" not in data or "unique_id" not in data:
-            logging.error("Invalid request body: Missing 'link' or 'unique_id'.")
+        # A dry run only estimates the upload, so it needs no unique_id
+        dry_run = bool(data.get("dry_run", False)) if data else False
+        if not data or "link" not in data or ("unique_id" not in data and not dry_run):
+            logger.error("Invalid request body: Missing 'link' or 'unique_id'.")
             return jsonify({
                 "success": False,
                 "error": 'Missing "link" or "unique_id" in request body'
             }), 400
         
         link = data["link"]
-        unique_id = data["unique_id"]
-        
-        logging.info(f"Processing document: link={link}, unique_id={unique_id}")
+        unique_id = data.get("unique_id")
+        reingest = bool(data.get("reingest", False))
+        api_key = request.headers.get("x-api-key", "").strip()
         
-        result = document_chunking_and_uploading_to_vectorstore(link, unique_id)
+        logger.info(f"Processing document: link={link}, unique_id={unique_id}, reingest={reingest}, dry_run={dry_run}")
         
-        logging.info(f"Document processed successfully for unique_id={unique_id}.")
+        result = workloads.run(workloads.INGEST, document_chunking_and_uploading_to_vectorstore,
+                               link, unique_id, reingest=reingest, key_id=services.key_id(api_key), dry_run=dry_run)
         
-        # Force garbage collection after processing
-        gc.collect()
+        logger.info(f"Document processed successfully for unique_id={unique_id}.")
         
-        return jsonify({
+        response = {
             "success": True,
             "result": result
-        }), 200
+        }
+        if wants_timings(data):
+            response["timings"] = get_request_timings()
+        return jsonify(response), 200
 
+    except PreflightRejected as e:
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "reason": e.reason,
+            "estimate": e.estimate
+        }), 422
     except ValueError as ve:
-        logging.error(f"ValueError: {ve}")
+        logger.error(f"ValueError: {ve}")
         return jsonify({
             "success": False,
             "error": str(ve)
         }), 400
+    except resilience.UpstreamError as e:
+        return upstream_unavailable(e)
+    except workloads.BulkheadFull as e:
+        return workload_at_capacity(e)
     except Exception as e:
-        logging.exception("An unexpected error occurred.")
+        logger.exception("An unexpected error occurred.")
+        return jsonify({
+            "success": False,
+            "error": "An unexpected error occurred"
+        }), 500
+
+# Document Deletion Endpoint
+@app.route("/api/v1/document/<namespace>", methods=["DELETE"])
+@require_api_key
+@admit("ingest")
+def delete_document(namespace):
+    try:
+        result = workloads.run(workloads.INGEST, deletion.delete_document, namespace)
+        return jsonify({"success": True, "result": result}), 200
+    except deletion.NamespaceNotFound:
+        return jsonify({"success": False, "error": f"Unknown document: {namespace}"}), 404
+    except resilience.UpstreamError as e:
+        return upstream_unavailable(e)
+    except workloads.BulkheadFull as e:
+        return workload_at_capacity(e)
+    except Exception as e:
+        logger.exception("An unexpected error occurred while deleting a document")
         return jsonify({
             "success": False,
             "error": "An unexpected error occurred"
@@ -114,6 +221,7 @@ def process_document():
 # Chat Endpoint
 @app.route("/api/v1/chat", methods=["POST"])
 @require_api_key
+@admit("chat")
 def chat():
     try:
         data = request.get_json()
@@ -125,24 +233,122 @@ def chat():
         
         index_name = data["index_name"]
         user_input = data["user_input"]
-        
-        result = start_chatting(index_name, user_input)
-        
-        # Force garbage collection after chat processing
-        gc.collect()
-        
+
+        # A list of index names chats across several documents at once
+        if isinstance(index_name, list):
+            index_name = list(dict.fromkeys(index_name))
+        if isinstance(index_name, list) and len(index_name) == 1:
+            index_name = index_name[0]
+        if isinstance(index_name, list):
+            if not index_name or len(index_name) > MULTI_CHAT_MAX_NAMESPACES:
+                return jsonify({
+                    "success": False,
+                    "error": f'"index_name" must list between 1 and {MULTI_CHAT_MAX_NAMESPACES} documents'
+                }), 400
+            result, sources = workloads.run(workloads.CHAT, start_multi_chat, index_name, user_input)
+            response = {
+                "success": True,
+                "result": result,
+                "sources": sources
+            }
+        else:
+            result = workloads.run(workloads.CHAT, start_chatting, index_name, user_input)
+            response = {
+                "success": True,
+                "result": result
+            }
+        if wants_timings(data):
+            response["timings"] = get_request_timings()
+        return jsonify(response), 200
+
+    except resilience.UpstreamError as e:
+        return upstream_unavailable(e)
+    except workloads.BulkheadFull as e:
+        return workload_at_capacity(e)
+    except Exception as e:
+        logger.exception("An unexpected error occurred in chat endpoint")
         return jsonify({
-            "success": True,
-            "result": result
-        }), 200
+            "success": False,
+            "error": str(e)
+        }), 500
+
+# Chat Session Endpoints: follow-up questions with server-side history (see sessions.py)
+@app.route("/api/v1/chat/session", methods=["POST"])
+@require_api_key
+@admit("chat")
+def create_chat_session():
+    try:
+        data = request.get_json(silent=True)
+        if not data or "index_name" not in data:
+            return jsonify({
+                "success": False,
+                "error": 'Missing "index_name" in request body'
+            }), 400
+
+        # A session is on one document; a one-element list is accepted as in /api/v1/chat
+        index_name = data["index_name"]
+        if isinstance(index_name, list) and index_name and all(name == index_name[0] for name in index_name):
+            index_name = index_name[0]
+        if not isinstance(index_name, str) or not index_name.strip():
+            return jsonify({
+                "success": False,
+                "error": '"index_name" must name a single document'
+            }), 400
+        if not deletion.exists(index_name):
+            return jsonify({"success": False, "error": f"Unknown document: {index_name}"}), 404
+
+        api_key = request.headers.get("x-api-key", "").strip()
+        session = sessions.create(services.key_id(api_key), index_name)
+        return jsonify({"success": True, **session}), 201
+
+    except Exception as e:
+        logger.exception("An unexpected error occurred while creating a chat session")
+        return jsonify({
+            "success": False,
+            "error": "An unexpected error occurred"
+        }), 500
+
+@app.route("/api/v1/chat/session/<session_id>", methods=["POST"])
+@require_api_key
+@admit("chat")
+def session_chat(session_id):
+    try:
+        data = request.get_json()
+        if not data or "user_input" not in data:
+            return jsonify({
+                "success": False,
+                "error": 'Missing "user_input" in request body'
+            }), 400
+        api_key = request.headers.get("x-api-key", "").strip()
+        result = workloads.run(workloads.CHAT, sessions.ask, session_id, services.key_id(api_key), data["user_input"])
+        response = {"success": True, **result}
+        if wants_timings(data):
+            response["timings"] = get_request_timings()
+        return jsonify(response), 200
 
+    except sessions.SessionNotFound:
+        return jsonify({"success": False, "error": "Session not found or expired"}), 404
+    except resilience.UpstreamError as e:
+        return upstream_unavailable(e)
+    except workloads.BulkheadFull as e:
+        return workload_at_capacity(e)
     except Exception as e:
-        logging.exception("An unexpected error occurred in chat endpoint")
+        logger.exception("An unexpected error occurred in session chat endpoint")
         return jsonify({
             "success": False,
             "error": str(e)
         }), 500
 
+@app.route("/api/v1/chat/session/<session_id>", methods=["DELETE"])
+@require_api_key
+def delete_chat_session(session_id):
+    api_key = request.headers.get("x-api-key", "").strip()
+    try:
+        sessions.delete(session_id, services.key_id(api_key))
+    except sessions.SessionNotFound:
+        return jsonify({"success": False, "error": "Session not found or expired"}), 404
+    return jsonify({"success": True}), 200
+
 # Health Check Endpoint
 @app.route("/api/v1/health", methods=["GET"])
 def health_check():
@@ -151,21 +357,55 @@ def health_check():
         "version": "1.0"
     }), 200
 
-@app.route("/api/v1/memory", methods=["POST"])
+# Readiness Endpoint: 503 until this worker has pre-created its clients
+@app.route("/api/v1/ready", methods=["GET"])
+def readiness_check():
+    report = services.readiness()
+    return jsonify(report), 200 if report["ready"] else 503
+
+# Prometheus scrape endpoint
+@app.route("/api/v1/metrics", methods=["GET"])
+def metrics():
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/v1/memory", methods=["GET"])
 @require_api_key
-def force_memory_cleanup():
-    """Endpoint to manually trigger garbage collection"""
+def memory_diagnostics():
+    """Endpoint reporting RSS, gc statistics and top tracemalloc allocation sites for this worker"""
     try:
-        # Force full garbage collection
-        collected = gc.collect()
-        
+        top = int(request.args.get("top", 10))
         return jsonify({
             "success": True,
-            "collected_objects": collected,
-            "message": "Memory cleanup completed"
+            "result": memory_management.diagnostics(top=top)
         }), 200
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "error": '"top" must be an integer'
+        }), 400
+    except Exception as e:
+        logger.exception("Error collecting memory diagnostics")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@app.route("/api/v1/memory", methods=["POST"])
+@require_api_key
+def force_memory_cleanup():
+    """Endpoint to manually trigger garbage collection and toggle allocation tracing"""
+    try:
+        data = request.get_json(silent=True) or {}
+        response = {"success": True}
+        if "tracemalloc" in data:
+            response["tracemalloc"] = memory_management.set_tracemalloc(bool(data["tracemalloc"]))
+        
+        # Force full garbage collection
+        response["collected_objects"] = memory_management.collect("manual")
+        response["message"] = "Memory cleanup completed"
+        return jsonify(response), 200
     except Exception as e:
-        logging.exception("Error during memory cleanup")
+        logger.exception("Error during memory cleanup")
         return jsonify({
             "success": False,
             "error": str(e)
@@ -175,7 +415,13 @@ if __name__ == "__main__":
     # Get port from environment variable (Railway sets this automatically)
     port = int(os.environ.get("PORT", 5000))
     
-    if os.environ.get("ENVIRONMENT") == "production":
+    # Single-process servers have no post_fork hook, so warm up here
+    services.start_warm_up()
+    
+    if serving_mode.is_async():
+        # Async: gevent server holding many concurrent requests in one process
+        serving_mode.serve_async(app, host="0.0.0.0", port=port)
+    elif os.environ.get("ENVIRONMENT") == "production":
         # Production: use waitress
         from waitress import serve
         serve(app, host="0.0.0.0", port=port)
@@ -0,0 +1,363 @@
+"""
+Deadlines, hedging, retry budgets and circuit breakers for upstream calls.
+
+Every call to an external dependency on the request path goes through
+call(upstream, fn, ...), where upstream names one of UPSTREAMS:
+
+- Deadline: the whole call, retries and hedges included, must finish within
+  `timeout` seconds or DeadlineExceeded is raised. The abandoned attempt keeps
+  running on its worker thread until the client's own timeout ends it.
+- Hedging (idempotent reads only): if the first attempt has not answered after
+  the upstream's observed p95 latency, a second identical attempt is sent and
+  whichever answers first wins.
+- Retries with exponential backoff and jitter, limited by a retry budget:
+  retries and hedges together may add at most RESILIENCE_RETRY_RATIO extra
+  load on top of normal traffic (plus a small per-second allowance), so an
+  outage is not amplified into a retry storm.
+- Circuit breaker: after `failure_threshold` consecutive failures the upstream
+  is considered down and calls fail immediately with CircuitOpenError for
+  `open_seconds`; then a single probe call decides whether to close it again.
+- Errors that another attempt cannot fix are raised at once, and do not count
+  against the breaker: the upstream answered. Those are 4xx responses other
+  than 408 and 429, and ValueError and TypeError (a bad request built here).
+
+Attempts run on a bounded thread pool per upstream (`max_workers`), so a slow
+or stuck upstream, e.g. the LLM, cannot take the threads that vector queries
+need. In async mode the chat path's pools default to WORKER_CONNECTIONS (see
+serving_mode.py).
+
+Settings are per upstream, from RESILIENCE_<UPSTREAM>_<SETTING> environment
+variables, e.g. RESILIENCE_LLM_TIMEOUT=30 or RESILIENCE_VECTOR_QUERY_HEDGE=false.
+RESILIENCE_ENABLED=false calls functions directly.
+"""
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+import serving_mode
+from metrics import counter, gauge, histogram
+
+RESILIENCE_ENABLED = os.environ.get("RESILIENCE_ENABLED", "true").lower() == "true"
+RESILIENCE_MAX_WORKERS = int(os.environ.get("RESILIENCE_MAX_WORKERS", "8"))
+RESILIENCE_RETRY_RATIO = float(os.environ.get("RESILIENCE_RETRY_RATIO", "0.1"))
+RESILIENCE_MIN_RETRIES_PER_SECOND = float(os.environ.get("RESILIENCE_MIN_RETRIES_PER_SECOND", "1"))
+
+# Pool size of the upstreams every chat calls
+_CHAT_WORKERS = serving_mode.concurrent_requests(16)
+
+# Per-upstream defaults; any of these can be overridden from the environment
+UPSTREAMS: Dict[str, Dict[str, Any]] = {
+    # Query embedding on the chat path: small, idempotent, worth hedging
+    "embed_query": {"timeout": 10.0, "hedge": True, "max_retries": 2, "max_workers": _CHAT_WORKERS},
+    # Pinecone index.query: idempotent read, worth hedging
+    "vector_query": {"timeout": 10.0, "hedge": True, "max_retries": 2, "max_workers": _CHAT_WORKERS},
+    # Gemini completion: billed per call, so retried but never hedged
+    "llm": {"timeout": 60.0, "hedge": False, "max_retries": 1, "max_workers": _CHAT_WORKERS},
+    # Batch embedding during ingestion: large and billed, so not hedged
+    "embed_documents": {"timeout": 120.0, "hedge": False, "max_retries": 2, "max_workers": 8},
+    # Upserts use deterministic vector IDs, so a retried batch overwrites rather than duplicates
+    "vector_upsert": {"timeout": 60.0, "hedge": False, "max_retries": 2, "max_workers": 8},
+    # Pinecone index.fetch of stored vectors, in bulk off the chat path: idempotent, but not worth hedging
+    "vector_fetch": {"timeout": 30.0, "hedge": False, "max_retries": 2, "max_workers": 4},
+}
+_SETTING_DEFAULTS = {
+    "hedge_min_delay": 0.05,   # never hedge sooner than this, in seconds
+    "hedge_delay": 1.0,        # hedge delay until enough latencies are observed for a p95
+    "backoff": 0.2,            # base of the exponential backoff, in seconds
+    "failure_threshold": 5,
+    "open_seconds": 30.0,
+    "max_workers": RESILIENCE_MAX_WORKERS,
+}
+# HTTP statuses that are the client's fault yet worth retrying
+_RETRYABLE_4XX = (408, 429)
+
+# Latency samples kept per upstream for the hedge delay, and the minimum before it is trusted
+_LATENCY_WINDOW = 200
+_MIN_LATENCY_SAMPLES = 20
+
+CALLS = counter("caseon_upstream_calls_total", "Upstream calls by final outcome.", ("upstream", "outcome"))
+ATTEMPT_SECONDS = histogram("caseon_upstream_attempt_seconds", "Latency of successful upstream attempts.", ("upstream",))
+RETRIES = counter("caseon_upstream_retries_total", "Retries sent after a failed attempt.", ("upstream",))
+HEDGES = counter("caseon_upstream_hedges_total", "Hedged second attempts sent.", ("upstream",))
+HEDGE_WINS = counter("caseon_upstream_hedge_wins_total", "Hedged attempts that answered first.", ("upstream",))
+BUDGET_EXHAUSTED = counter(
+    "caseon_upstream_retry_budget_exhausted_total",
+    "Retries or hedges skipped because the retry budget was spent.",
+    ("upstream",),
+)
+CIRCUIT_STATE = gauge("caseon_upstream_circuit_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open.", ("upstream",))
+CIRCUIT_OPENED = counter("caseon_upstream_circuit_opened_total", "Times the circuit breaker opened.", ("upstream",))
+
+
+class UpstreamError(Exception):
+    """An upstream call failed fast or ran out of time."""
+
+    def __init__(self, upstream: str, message: str):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+
+
+class DeadlineExceeded(UpstreamError, TimeoutError):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(upstream, f"circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def _status(error: BaseException) -> Optional[int]:
+    # Pinecone errors carry status, HTTP clients status_code, Google API errors code
+    for attr in ("status", "status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """False for errors another attempt cannot fix: 4xx responses (but 408 and 429), ValueError and TypeError."""
+    if isinstance(error, (ValueError, TypeError)):
+        return False
+    status = _status(error)
+    return not (status is not None and 400 <= status < 500 and status not in _RETRYABLE_4XX)
+
+
+def _setting(upstream: str, name: str, default):
+    raw = os.environ.get(f"RESILIENCE_{upstream.upper()}_{name.upper()}")
+    if raw is None:
+        return default
+    if isinstance(default, bool):
+        return raw.lower() == "true"
+    return type(default)(raw)
+
+
+class RetryBudget:
+    """Token bucket refilled by normal requests (ratio per request) and slowly over time."""
+
+    def __init__(self, ratio: float, min_per_second: float, cap: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.cap = cap
+        self._balance = cap
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._balance = min(self.cap, self._balance + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self._balance = min(self.cap, self._balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, upstream: str, failure_threshold: int, open_seconds: float):
+        self.upstream = upstream
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(self.state, upstream=upstream)
+
+    def _set_state(self, state: int) -> None:
+        self.state = state
+        CIRCUIT_STATE.set(state, upstream=self.upstream)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probe_in_flight = False
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+                CIRCUIT_OPENED.inc(upstream=self.upstream)
+
+
+class Upstream:
+    def __init__(self, name: str):
+        self.name = name
+        defaults = {**_SETTING_DEFAULTS, **UPSTREAMS.get(name, {"timeout": 30.0, "hedge": False, "max_retries": 1})}
+        settings = {key: _setting(name, key, value) for key, value in defaults.items()}
+        self.timeout: float = settings["timeout"]
+        self.hedge: bool = settings["hedge"]
+        self.max_retries: int = settings["max_retries"]
+        self.hedge_min_delay: float = settings["hedge_min_delay"]
+        self.default_hedge_delay: float = settings["hedge_delay"]
+        self.backoff: float = settings["backoff"]
+        self.max_workers: int = max(1, settings["max_workers"])
+        self.breaker = CircuitBreaker(name, settings["failure_threshold"], settings["open_seconds"])
+        self.budget = RetryBudget(RESILIENCE_RETRY_RATIO, RESILIENCE_MIN_RETRIES_PER_SECOND)
+        self._latencies = deque(maxlen=_LATENCY_WINDOW)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix=f"upstream-{self.name}"
+                    )
+        return self._executor
+
+    def shutdown(self) -> None:
+        """Let the pool's threads exit once their attempts finish."""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def hedge_delay(self) -> float:
+        """Observed p95 latency, once there are enough samples to trust it."""
+        samples = sorted(self._latencies)
+        if len(samples) < _MIN_LATENCY_SAMPLES:
+            return self.default_hedge_delay
+        return max(self.hedge_min_delay, samples[int(len(samples) * 0.95) - 1])
+
+    def _run(self, fn: Callable, args, kwargs):
+        # Each attempt runs in a copy of the caller's context so per-request
+        # stage timings and tracing still attach to the right request
+        ctx = contextvars.copy_context()
+
+        def attempt():
+            start = time.perf_counter()
+            result = ctx.run(fn, *args, **kwargs)
+            elapsed = time.perf_counter() - start
+            self._latencies.append(elapsed)
+            ATTEMPT_SECONDS.observe(elapsed, upstream=self.name)
+            return result
+
+        return self._get_executor().submit(attempt)
+
+    def _attempt(self, fn: Callable, args, kwargs, deadline: float):
+        primary = self._run(fn, args, kwargs)
+        pending = {primary}
+        if self.hedge:
+            done, _ = wait(pending, timeout=max(0.0, min(self.hedge_delay(), deadline - time.monotonic())))
+            if not done and time.monotonic() < deadline:
+                if self.budget.withdraw():
+                    HEDGES.inc(upstream=self.name)
+                    pending.add(self._run(fn, args, kwargs))
+                else:
+                    BUDGET_EXHAUSTED.inc(upstream=self.name)
+
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded(self.name, f"no response within {self.timeout:g}s")
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        HEDGE_WINS.inc(upstream=self.name)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def call(self, fn: Callable, *args, **kwargs):
+        self.budget.deposit()
+        if not self.breaker.allow():
+            CALLS.inc(upstream=self.name, outcome="circuit_open")
+            raise CircuitOpenError(self.name, self.breaker.retry_after())
+
+        deadline = time.monotonic() + self.timeout
+        retries = 0
+        while True:
+            try:
+                result = self._attempt(fn, args, kwargs, deadline)
+            except DeadlineExceeded:
+                self.breaker.record_failure()
+                CALLS.inc(upstream=self.name, outcome="timeout")
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    # The upstream answered, so this says nothing about its health
+                    self.breaker.record_success()
+                    CALLS.inc(upstream=self.name, outcome="rejected")
+                    raise
+                self.breaker.record_failure()
+                delay = random.uniform(0, self.backoff * 2 ** retries)
+                if retries < self.max_retries and time.monotonic() + delay < deadline and self.breaker.allow():
+                    if self.budget.withdraw():
+                        retries += 1
+                        RETRIES.inc(upstream=self.name)
+                        time.sleep(delay)
+                        continue
+                    BUDGET_EXHAUSTED.inc(upstream=self.name)
+                CALLS.inc(upstream=self.name, outcome="error")
+                raise
+            self.breaker.record_success()
+            CALLS.inc(upstream=self.name, outcome="success")
+            return result
+
+
+_upstreams: Dict[str, Upstream] = {}
+_upstreams_lock = threading.Lock()
+
+
+def get_upstream(name: str) -> Upstream:
+    upstream = _upstreams.get(name)
+    if upstream is None:
+        with _upstreams_lock:
+            upstream = _upstreams.get(name)
+            if upstream is None:
+                upstream = _upstreams[name] = Upstream(name)
+    return upstream
+
+
+def call(upstream: str, fn: Callable, *args, **kwargs):
+    """Call fn(*args, **kwargs) under the named upstream's deadline, hedging, retry and breaker policy."""
+    if not RESILIENCE_ENABLED:
+        return fn(*args, **kwargs)
+    return get_upstream(upstream).call(fn, *args, **kwargs)
+
+
+def reset() -> None:
+    """Forget all breaker, budget and latency state (settings are re-read from the environment)."""
+    with _upstreams_lock:
+        for upstream in _upstreams.values():
+            upstream.shutdown()
+        _upstreams.clear()
@@ -0,0 +1,259 @@
+"""
+Lazily-initialized clients shared by the request path.
+
+Nothing here touches the network or imports the heavy SDKs at import time, so
+workers boot quickly. Each client is created on first use (or by warm_up() after
+gunicorn forks the worker) and reused for the life of the process.
+"""
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from metrics import gauge, histogram
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = "models/embedding-001"
+CHAT_MODEL = "gemini-2.0-flash"
+CHAT_TEMPERATURE = 0.2
+
+WARM_UP_SECONDS = histogram(
+    "caseon_warm_up_seconds",
+    "Time spent pre-creating clients after a worker starts.",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+READY = gauge("caseon_worker_ready", "1 once this worker has finished warming up.")
+
+_lock = threading.RLock()
+_instances: Dict[str, Any] = {}
+_factories: Dict[str, Callable[[], Any]] = {}
+_ready = threading.Event()
+_warm_up_error = None
+
+
+def register(name: str, factory: Callable[[], Any]) -> None:
+    """Register the factory used to build a named service on first access."""
+    with _lock:
+        _factories[name] = factory
+
+
+def get(name: str) -> Any:
+    """Return the named service, building it on first use."""
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _lock:
+        instance = _instances.get(name)
+        if instance is None:
+            if name not in _factories:
+                raise KeyError(f"No service registered as {name!r}")
+            instance = _factories[name]()
+            _instances[name] = instance
+        return instance
+
+
+def override(name: str, instance: Any) -> None:
+    """Replace a service with a ready-made instance, e.g. a local stand-in."""
+    with _lock:
+        _instances[name] = instance
+
+
+def reset(name: str = None) -> None:
+    """Drop one (or every) built service so the next access rebuilds it."""
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
+
+
+def _build_llm():
+    # These imports resolve forward references ChatGoogleGenerativeAI needs for model_rebuild()
+    from langchain_core.caches import BaseCache  # noqa: F401
+    from langchain_core.callbacks import Callbacks  # noqa: F401
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    ChatGoogleGenerativeAI.model_rebuild()
+    return ChatGoogleGenerativeAI(model=CHAT_MODEL, temperature=CHAT_TEMPERATURE)
+
+
+def _build_embeddings():
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, google_api_key=os.environ["GOOGLE_API_KEY"])
+
+
+def _build_langsmith_client():
+    from langsmith import Client
+    return Client(api_key=os.environ["LANGSMITH_API_KEY"])
+
+
+def _build_trace_exporter():
+    import tracing
+    return tracing.build_exporter()
+
+
+def _build_shared_cache():
+    import shared_cache
+    return shared_cache.build_backend()
+
+
+def _build_context_cache():
+    from context_cache import GeminiContextCache
+    return GeminiContextCache(CHAT_MODEL)
+
+
+register("llm", _build_llm)
+register("embeddings", _build_embeddings)
+register("langsmith_client", _build_langsmith_client)
+register("trace_exporter", _build_trace_exporter)
+register("context_cache", _build_context_cache)
+register("shared_cache", _build_shared_cache)
+
+
+def get_llm():
+    return get("llm")
+
+
+def get_context_cache():
+    return get("context_cache")
+
+
+def get_embeddings():
+    return get("embeddings")
+
+
+def get_langsmith_client():
+    return get("langsmith_client")
+
+
+def key_id(api_key: str) -> str:
+    """Short stable identifier for an API key, safe to put in service names, metrics and logs."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:8]
+
+
+def load_key_limits(env_var: str, limits_class: type) -> Dict[str, Any]:
+    """
+    Per-key limits from env_var, a JSON object mapping key_id(api_key) to
+    overrides of limits_class's fields. Invalid JSON, unknown fields and
+    non-numeric values are logged and ignored, so a typo falls back to the
+    defaults instead of keeping workers from starting.
+    """
+    raw = os.environ.get(env_var, "").strip()
+    if not raw:
+        return {}
+    try:
+        parsed = json.loads(raw)
+    except ValueError as e:
+        logger.warning(f"{env_var} is not valid JSON, default limits apply to every key: {e}")
+        return {}
+    if not isinstance(parsed, dict):
+        logger.warning(f"{env_var} is not a JSON object, default limits apply to every key")
+        return {}
+    defaults = limits_class()
+    fields = {field.name for field in dataclasses.fields(limits_class)}
+    limits = {}
+    for key, overrides in parsed.items():
+        if not isinstance(overrides, dict):
+            logger.warning(f"{env_var} entry for {key} is not an object, default limits apply to it")
+            continue
+        valid = {}
+        for name, value in overrides.items():
+            if name not in fields:
+                logger.warning(f"Ignoring unknown limit {name!r} for {key} in {env_var}")
+            elif isinstance(value, bool) or not isinstance(value, (int, float)):
+                logger.warning(f"Ignoring non-numeric limit {name!r} for {key} in {env_var}: {value!r}")
+            else:
+                valid[name] = type(getattr(defaults, name))(value)
+        limits[key] = dataclasses.replace(defaults, **valid)
+    return limits
+
+
+def _build_pinecone(api_key: str):
+    from pinecone import Pinecone
+    return Pinecone(api_key=api_key)
+
+
+_pinecone_factory: Callable[[str], Any] = _build_pinecone
+
+
+def set_pinecone_factory(factory: Callable[[str], Any]) -> None:
+    """Build Pinecone clients with factory(api_key) from now on, e.g. a local stand-in index."""
+    global _pinecone_factory
+    with _lock:
+        _pinecone_factory = factory
+        for name in list(_instances):
+            if name.startswith("pinecone"):
+                del _instances[name]
+
+
+def get_pinecone(api_key: str):
+    """Return the Pinecone client for an API key, creating it on first use."""
+    name = f"pinecone:{key_id(api_key)}"
+    if name not in _factories:
+        register(name, lambda: _pinecone_factory(api_key))
+    return get(name)
+
+
+def get_index(api_key: str, index_name: str):
+    """Return a reusable handle to a Pinecone index so its connection pool is kept warm."""
+    name = f"pinecone-index:{key_id(api_key)}:{index_name}"
+    if name not in _factories:
+        register(name, lambda: get_pinecone(api_key).Index(index_name))
+    return get(name)
+
+
+def warm_up() -> None:
+    """
+    Pre-create the clients used on the request path.
+
+    Meant to run in the worker after gunicorn forks it, so sockets and gRPC
+    channels are never shared between processes. Failures are logged and the
+    worker still becomes ready; the affected client is built on first use instead.
+    """
+    global _warm_up_error
+    start = time.perf_counter()
+    try:
+        get_embeddings()
+        get_llm()
+        if os.environ.get("LANGSMITH_API_KEY"):
+            get_langsmith_client()
+        import shard_map
+        for project in shard_map.get_shard_map().projects:
+            if project.is_configured:
+                get_pinecone(project.api_key)
+        from connection import getconnection, release_connection
+        conn = getconnection()
+        if conn:
+            release_connection(conn)
+    except Exception as e:
+        _warm_up_error = str(e)
+        logger.exception("Warm-up failed; clients will be created on first use")
+    finally:
+        WARM_UP_SECONDS.observe(time.perf_counter() - start)
+        READY.set(1)
+        _ready.set()
+
+
+def start_warm_up() -> threading.Thread:
+    """Run warm_up() on a background thread so the worker can accept requests meanwhile."""
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def readiness() -> Dict:
+    """Readiness report for the /api/v1/ready endpoint."""
+    return {
+        "ready": _ready.is_set(),
+        "pid": os.getpid(),
+        "warm_up_error": _warm_up_error,
+        "services": sorted(_instances),
+    }
@@ -0,0 +1,62 @@
+"""
+Serving mode selection.
+
+SERVING_MODE=sync (default) keeps the existing model: gunicorn sync workers, or
+waitress / the Flask dev server when started with ``python rag.py``.
+
+SERVING_MODE=async runs the same Flask app on gevent. The standard library is
+monkey-patched so the MySQL (pymysql), Pinecone (urllib3) and PDF download
+(requests) sockets yield instead of blocking, and gRPC is switched to its gevent
+integration for the Gemini clients. One worker process can then hold up to
+WORKER_CONNECTIONS concurrent chats while they wait on upstreams.
+
+A chat passes several per-worker limits, and the lowest one caps how many run at
+once: the server's connections (WORKER_CONNECTIONS in async mode), admission
+(ADMISSION_MAX_CONCURRENT in total, ADMISSION_KEY_CONCURRENCY per API key), the
+chat bulkhead (BULKHEAD_CHAT_WORKERS running, BULKHEAD_CHAT_QUEUE waiting) and
+the upstream pools of the chat path (RESILIENCE_<UPSTREAM>_MAX_WORKERS for
+embed_query, vector_query and llm). Their defaults suit sync workers; in async
+mode they default to WORKER_CONNECTIONS instead (see concurrent_requests()), so
+they do not hold a gevent worker far below the chats it accepts. Set any of them
+explicitly to cap it lower, e.g. to protect an upstream's quota.
+
+This module must stay importable before patching, so it only imports ``os`` at
+module level.
+"""
+import os
+
+SERVING_MODE = os.environ.get("SERVING_MODE", "sync").lower()
+WORKER_CONNECTIONS = int(os.environ.get("WORKER_CONNECTIONS", "500"))
+
+
+def is_async() -> bool:
+    return SERVING_MODE == "async"
+
+
+def concurrent_requests(sync_default: int) -> int:
+    """Default for a per-worker limit on concurrent chats: WORKER_CONNECTIONS in async mode, else sync_default."""
+    return WORKER_CONNECTIONS if is_async() else sync_default
+
+
+def patch_for_async() -> None:
+    """Monkey-patch the standard library for gevent. Call before anything else is imported."""
+    from gevent import monkey
+    if not monkey.is_module_patched("socket"):
+        monkey.patch_all()
+    init_grpc_for_async()
+
+
+def init_grpc_for_async() -> None:
+    """Let gRPC calls (Gemini chat and embeddings) cooperate with the gevent hub."""
+    try:
+        from grpc.experimental import gevent as grpc_gevent
+    except ImportError:
+        return
+    grpc_gevent.init_gevent()
+
+
+def serve_async(app, host: str, port: int) -> None:
+    """Serve a WSGI app on gevent with at most WORKER_CONNECTIONS concurrent requests."""
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+    WSGIServer((host, port), app, spawn=Pool(WORKER_CONNECTIONS)).serve_forever()
@@ -0,0 +1,284 @@
+"""
+Multi-turn chat sessions with bounded server-side history.
+
+A session belongs to one API key and one case (namespace). Each turn:
+
+1. rewrites the follow-up question into a standalone one using the history
+   (SESSION_REWRITE=llm, the default), so retrieval searches for what is
+   actually being asked ("what did it decide on that?" -> "What did the court
+   decide on the limitation issue?"); "off" uses the question as asked;
+2. answers it through main_chat.start_chatting with the history in the prompt;
+3. stores the turn. Once more than SESSION_RECENT_TURNS turns are stored, the
+   oldest are folded into a rolling summary in the background, capped at
+   SESSION_SUMMARY_MAX_CHARS, so the history sent with each prompt stays bounded
+   however long the conversation runs.
+
+Sessions expire SESSION_TTL_SECONDS after their last turn. At most
+SESSION_MAX_SESSIONS are kept per host; creating one beyond that evicts the
+least recently used. State lives in the local store, so clients must keep a
+session on the same host (or LOCAL_DATA_DIR must be shared).
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from local_store import ensure_schema, local_db
+from metrics import counter, stage
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", "1800"))
+SESSION_MAX_SESSIONS = int(os.environ.get("SESSION_MAX_SESSIONS", "10000"))
+SESSION_RECENT_TURNS = int(os.environ.get("SESSION_RECENT_TURNS", "4"))
+SESSION_SUMMARY_MAX_CHARS = int(os.environ.get("SESSION_SUMMARY_MAX_CHARS", "2000"))
+# Longer answers are cut when they are put back into the prompt as history
+SESSION_TURN_MAX_CHARS = int(os.environ.get("SESSION_TURN_MAX_CHARS", "1500"))
+SESSION_REWRITE = os.environ.get("SESSION_REWRITE", "llm").lower()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_session (
+    session_id TEXT PRIMARY KEY,
+    key_id TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    summary TEXT NOT NULL DEFAULT '',
+    summarized_through INTEGER NOT NULL DEFAULT 0,
+    turns INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chat_session_updated ON chat_session (updated_at);
+CREATE TABLE IF NOT EXISTS chat_session_turn (
+    turn_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chat_session_turn_session ON chat_session_turn (session_id, turn_id);
+"""
+
+REWRITE_INSTRUCTION = (
+    "You rewrite follow-up questions about a legal case. Given the conversation so far and a follow-up "
+    "question, reply with a single standalone question that can be understood without the conversation. "
+    "Resolve pronouns and references to earlier turns. If the question is already standalone, repeat it. "
+    "Reply with the question only."
+)
+SUMMARY_INSTRUCTION = (
+    "You maintain a running summary of a conversation about a legal case. Given the current summary and "
+    "the next turns, reply with an updated summary that keeps the questions asked, the facts, holdings, "
+    "page references and names established so far, and drops pleasantries and repetition. "
+    f"Keep it under {SESSION_SUMMARY_MAX_CHARS // 6} words. Reply with the summary only."
+)
+
+SESSION_EVENTS = counter(
+    "caseon_chat_sessions_total",
+    "Chat session lifecycle: created, turn, rewritten, summarized, expired, evicted, deleted.",
+    ("event",),
+)
+
+
+class SessionNotFound(Exception):
+    """No live session with this ID for this API key (never created, expired, evicted or deleted)."""
+
+
+_summarizer: Optional[ThreadPoolExecutor] = None
+_summarizer_lock = threading.Lock()
+
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit] + " [...]"
+
+
+def purge_expired() -> int:
+    ensure_schema(_SCHEMA)
+    cutoff = time.time() - SESSION_TTL_SECONDS
+    with local_db() as conn:
+        expired = [row["session_id"] for row in
+                   conn.execute("SELECT session_id FROM chat_session WHERE updated_at < ?", (cutoff,))]
+        _delete_rows(conn, expired)
+    if expired:
+        SESSION_EVENTS.inc(len(expired), event="expired")
+    return len(expired)
+
+
+def _delete_rows(conn, session_ids: List[str]) -> None:
+    for session_id in session_ids:
+        conn.execute("DELETE FROM chat_session_turn WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM chat_session WHERE session_id = ?", (session_id,))
+
+
+def create(key_id: str, namespace: str) -> Dict:
+    purge_expired()
+    now = time.time()
+    session_id = uuid.uuid4().hex
+    with local_db() as conn:
+        conn.execute(
+            "INSERT INTO chat_session (session_id, key_id, namespace, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (session_id, key_id, namespace, now, now),
+        )
+        excess = conn.execute("SELECT COUNT(*) FROM chat_session").fetchone()[0] - SESSION_MAX_SESSIONS
+        if excess > 0:
+            evicted = [row["session_id"] for row in conn.execute(
+                "SELECT session_id FROM chat_session WHERE session_id != ? ORDER BY updated_at LIMIT ?",
+                (session_id, excess),
+            )]
+            _delete_rows(conn, evicted)
+            SESSION_EVENTS.inc(len(evicted), event="evicted")
+    SESSION_EVENTS.inc(event="created")
+    return {"session_id": session_id, "index_name": namespace, "expires_in": SESSION_TTL_SECONDS}
+
+
+def _load(session_id: str, key_id: str):
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        session = conn.execute(
+            "SELECT * FROM chat_session WHERE session_id = ? AND key_id = ?", (session_id, key_id)
+        ).fetchone()
+        if session is None:
+            raise SessionNotFound(session_id)
+        if session["updated_at"] < time.time() - SESSION_TTL_SECONDS:
+            _delete_rows(conn, [session_id])
+            SESSION_EVENTS.inc(event="expired")
+            raise SessionNotFound(session_id)
+        turns = conn.execute(
+            "SELECT turn_id, question, answer FROM chat_session_turn WHERE session_id = ? AND turn_id > ? ORDER BY turn_id",
+            (session_id, session["summarized_through"]),
+        ).fetchall()
+    return session, turns
+
+
+def format_history(summary: str, turns) -> str:
+    parts = [f"Summary of earlier turns: {summary}"] if summary else []
+    for turn in turns:
+        parts.append(f"User: {turn['question']}\nAssistant: {_truncate(turn['answer'], SESSION_TURN_MAX_CHARS)}")
+    return "\n\n".join(parts)
+
+
+def rewrite_question(history: str, user_input: str) -> str:
+    """A standalone version of user_input given the conversation, for retrieval and the prompt."""
+    if not history or SESSION_REWRITE != "llm":
+        return user_input
+    from generative_model import complete_task
+    from token_usage_database_update import update_token_usage
+    try:
+        with stage("chat", "query_rewrite"):
+            rewritten, usage = complete_task(
+                REWRITE_INSTRUCTION, f"Conversation so far:\n{history}\n\nFollow-up question: {user_input}"
+            )
+    except Exception as e:
+        # The history in the prompt still gives the model the context
+        logger.warning(f"Rewriting the follow-up question failed, using it as asked: {e}")
+        return user_input
+    update_token_usage(usage["input_tokens"], usage["output_tokens"])
+    rewritten = (rewritten or "").strip()
+    if not rewritten:
+        return user_input
+    SESSION_EVENTS.inc(event="rewritten")
+    return rewritten
+
+
+def ask(session_id: str, key_id: str, user_input: str) -> Dict:
+    """Answer the next question of a session and record the turn."""
+    from main_chat import start_chatting
+
+    session, turns = _load(session_id, key_id)
+    # Turns not yet folded into the summary (it runs in the background) are capped too
+    history = format_history(session["summary"], turns[-2 * SESSION_RECENT_TURNS:])
+    question = rewrite_question(history, user_input)
+    answer = start_chatting(session["namespace"], question, history=history)
+
+    with local_db() as conn:
+        conn.execute(
+            "INSERT INTO chat_session_turn (session_id, question, answer) VALUES (?, ?, ?)",
+            (session_id, user_input, answer),
+        )
+        conn.execute(
+            "UPDATE chat_session SET turns = turns + 1, updated_at = ? WHERE session_id = ?",
+            (time.time(), session_id),
+        )
+    SESSION_EVENTS.inc(event="turn")
+    if len(turns) + 1 > SESSION_RECENT_TURNS:
+        _schedule_summary(session_id)
+    return {"result": answer, "question": question, "turn": session["turns"] + 1}
+
+
+def summarize(session_id: str) -> None:
+    """Fold the turns beyond the most recent SESSION_RECENT_TURNS into the session's summary."""
+    from generative_model import complete_task
+    from token_usage_database_update import update_token_usage
+
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        session = conn.execute("SELECT summary, summarized_through FROM chat_session WHERE session_id = ?",
+                               (session_id,)).fetchone()
+        if session is None:
+            return
+        turns = conn.execute(
+            "SELECT turn_id, question, answer FROM chat_session_turn WHERE session_id = ? AND turn_id > ? ORDER BY turn_id",
+            (session_id, session["summarized_through"]),
+        ).fetchall()
+    fold = turns[:len(turns) - SESSION_RECENT_TURNS]
+    if not fold:
+        return
+    summary, usage = complete_task(
+        SUMMARY_INSTRUCTION,
+        f"Current summary: {session['summary'] or '(none)'}\n\nNext turns:\n\n{format_history('', fold)}",
+    )
+    update_token_usage(usage["input_tokens"], usage["output_tokens"])
+    summary = _truncate((summary or "").strip(), SESSION_SUMMARY_MAX_CHARS)
+    through = fold[-1]["turn_id"]
+    with local_db() as conn:
+        # Another worker may have folded these turns already
+        updated = conn.execute(
+            "UPDATE chat_session SET summary = ?, summarized_through = ? WHERE session_id = ? AND summarized_through = ?",
+            (summary, through, session_id, session["summarized_through"]),
+        ).rowcount
+        if updated:
+            conn.execute("DELETE FROM chat_session_turn WHERE session_id = ? AND turn_id <= ?", (session_id, through))
+    if updated:
+        SESSION_EVENTS.inc(event="summarized")
+
+
+def _summarize_quietly(session_id: str) -> None:
+    try:
+        summarize(session_id)
+    except Exception as e:
+        # The turns stay in full and the next turn tries again
+        logger.warning(f"Summarizing session {session_id} failed: {e}")
+
+
+def _schedule_summary(session_id: str) -> None:
+    global _summarizer
+    if _summarizer is None:
+        with _summarizer_lock:
+            if _summarizer is None:
+                _summarizer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-summary")
+    _summarizer.submit(contextvars.copy_context().run, _summarize_quietly, session_id)
+
+
+def delete(session_id: str, key_id: str) -> None:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        found = conn.execute(
+            "SELECT 1 FROM chat_session WHERE session_id = ? AND key_id = ?", (session_id, key_id)
+        ).fetchone()
+        if found is None:
+            raise SessionNotFound(session_id)
+        _delete_rows(conn, [session_id])
+    SESSION_EVENTS.inc(event="deleted")
+
+
+def delete_namespace(namespace: str) -> int:
+    """End every session on namespace, e.g. because its document was deleted. Returns how many."""
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        ended = [row["session_id"] for row in
+                 conn.execute("SELECT session_id FROM chat_session WHERE namespace = ?", (namespace,))]
+        _delete_rows(conn, ended)
+    if ended:
+        SESSION_EVENTS.inc(len(ended), event="deleted")
+    return len(ended)
@@ -0,0 +1,137 @@
+"""
+Manage the Pinecone shard map without code changes.
+
+Usage:
+    python shard_admin.py list
+    python shard_admin.py add QA3 --api-key-env PINECONE_API_KEY_QA3 [--max-indexes 20] [--namespaces-per-index 25000]
+    python shard_admin.py retire QA1        # stop placing new namespaces in QA1
+    python shard_admin.py activate QA1
+    python shard_admin.py policy spread     # or fill_first
+    python shard_admin.py reconcile [--apply] [--grace-seconds 3600]
+
+Changes are written to SHARD_MAP_FILE (created from the built-in QA1/QA2 layout
+if missing) and picked up by workers on their next restart. Set the API key
+environment variable on every instance before adding a project.
+
+reconcile lists namespaces in Pinecone without a route and routes without
+vectors (see deletion.py); --apply cleans up those seen for the grace period.
+"""
+import argparse
+import sys
+
+import shard_map
+from shard_map import Project
+
+
+def cmd_list(current, args):
+    from volume_handler import get_index_loads
+
+    print(f"Shard map: {shard_map.SHARD_MAP_FILE} (allocation policy: {current.allocation_policy})")
+    for project in current.projects:
+        state = "accepting writes" if project.accepting_writes else "retired"
+        print(f"\n{project.name}  key env {project.api_key_env}  {state}  "
+              f"max {project.max_indexes} indexes x {project.namespaces_per_index} namespaces")
+        if not project.is_configured:
+            print("  (API key not set in this environment)")
+            continue
+        if args.usage:
+            loads = get_index_loads(project)
+            for index_name, ns_count in loads:
+                print(f"  {index_name:<20} {ns_count:>7} namespaces")
+            total = sum(count for _, count in loads)
+            capacity = project.max_indexes * project.namespaces_per_index
+            print(f"  {len(loads)} indexes, {total} of {capacity} namespace slots used")
+    return False
+
+
+def cmd_add(current, args):
+    if any(project.name == args.name for project in current.projects):
+        raise SystemExit(f"Project {args.name} already exists")
+    current.projects.append(Project(
+        name=args.name,
+        api_key_env=args.api_key_env,
+        max_indexes=args.max_indexes,
+        namespaces_per_index=args.namespaces_per_index,
+    ))
+    print(f"Added project {args.name}")
+    return True
+
+
+def _set_accepting(current, name, accepting):
+    current.project(name).accepting_writes = accepting
+    print(f"Project {name} {'accepts' if accepting else 'no longer accepts'} new namespaces")
+    return True
+
+
+def cmd_retire(current, args):
+    return _set_accepting(current, args.name, False)
+
+
+def cmd_activate(current, args):
+    return _set_accepting(current, args.name, True)
+
+
+def cmd_policy(current, args):
+    current.allocation_policy = args.policy
+    print(f"Allocation policy set to {args.policy}")
+    return True
+
+
+def cmd_reconcile(current, args):
+    import deletion
+
+    report = deletion.reconcile(apply=args.apply, grace_seconds=args.grace_seconds)
+    for orphan in report["orphans"]:
+        print(f"  {orphan['kind']:<8} {orphan['namespace']:<40} {orphan['index_name']:<20} "
+              f"{orphan['project']:<8} seen for {orphan['age_seconds']:.0f}s")
+    print(f"{len(report['orphans'])} orphans, {report['due']} past the grace period, {report['cleaned']} cleaned up")
+    if report["due"] and not args.apply:
+        print("Run with --apply to clean them up")
+    return False
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("list", help="show projects and, with --usage, their index usage")
+    p.add_argument("--usage", action="store_true", help="query Pinecone for namespace counts")
+    p.set_defaults(func=cmd_list)
+
+    p = sub.add_parser("add", help="add a project")
+    p.add_argument("name")
+    p.add_argument("--api-key-env", required=True, help="environment variable holding the project's API key")
+    p.add_argument("--max-indexes", type=int, default=shard_map.DEFAULT_MAX_INDEXES)
+    p.add_argument("--namespaces-per-index", type=int, default=shard_map.DEFAULT_NAMESPACES_PER_INDEX)
+    p.set_defaults(func=cmd_add)
+
+    for name, func in (("retire", cmd_retire), ("activate", cmd_activate)):
+        p = sub.add_parser(name)
+        p.add_argument("name")
+        p.set_defaults(func=func)
+
+    p = sub.add_parser("policy", help="set the allocation policy")
+    p.add_argument("policy", choices=shard_map.ALLOCATION_POLICIES)
+    p.set_defaults(func=cmd_policy)
+
+    p = sub.add_parser("reconcile", help="find and clean up orphaned namespaces and routes")
+    p.add_argument("--apply", action="store_true", help="delete orphans seen for at least the grace period")
+    p.add_argument("--grace-seconds", type=float, default=None,
+                   help="how long an orphan must have been seen before it is cleaned up (default RECONCILE_GRACE_SECONDS)")
+    p.set_defaults(func=cmd_reconcile)
+
+    args = parser.parse_args(argv)
+    current = shard_map.load_shard_map()
+    try:
+        changed = args.func(current, args)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if changed:
+        # Re-validate before writing
+        shard_map.save_shard_map(shard_map.parse_shard_map(current.to_dict()))
+        print(f"Wrote {shard_map.SHARD_MAP_FILE}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
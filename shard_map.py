@@ -0,0 +1,150 @@
+"""
+Declarative map of the Pinecone projects ("shards") documents are spread over.
+
+The map is read once per process from SHARD_MAP_FILE (JSON, default
+shard_map.json) and falls back to the original two-project layout, QA1 and QA2
+keyed by PINECONE_API_KEY and PINECONE_API_KEY_SECOND_PROJECT, when no file
+exists. Example:
+
+    {
+        "allocation_policy": "fill_first",
+        "projects": [
+            {"name": "QA1", "api_key_env": "PINECONE_API_KEY"},
+            {"name": "QA2", "api_key_env": "PINECONE_API_KEY_SECOND_PROJECT"},
+            {"name": "QA3", "api_key_env": "PINECONE_API_KEY_QA3", "max_indexes": 20,
+             "namespaces_per_index": 25000, "accepting_writes": true}
+        ]
+    }
+
+API keys never live in the file, only the names of the environment variables
+holding them. Use shard_admin.py to add or retire projects.
+"""
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+import services
+
+SHARD_MAP_FILE = os.environ.get("SHARD_MAP_FILE", "shard_map.json")
+
+DEFAULT_MAX_INDEXES = 20
+DEFAULT_NAMESPACES_PER_INDEX = 25000
+
+# fill_first: fill every index of a project before touching the next project
+# spread: place each namespace on the least-loaded index across all projects
+ALLOCATION_POLICIES = ("fill_first", "spread")
+
+
+@dataclass
+class Project:
+    name: str
+    api_key_env: str
+    max_indexes: int = DEFAULT_MAX_INDEXES
+    namespaces_per_index: int = DEFAULT_NAMESPACES_PER_INDEX
+    accepting_writes: bool = True
+
+    @property
+    def api_key(self) -> str:
+        key = os.environ.get(self.api_key_env)
+        if not key:
+            raise ValueError(f"Environment variable {self.api_key_env} for project {self.name} is not set")
+        return key
+
+    @property
+    def is_configured(self) -> bool:
+        return bool(os.environ.get(self.api_key_env))
+
+
+@dataclass
+class ShardMap:
+    projects: List[Project]
+    allocation_policy: str = "fill_first"
+    _by_name: Dict[str, Project] = field(default_factory=dict, repr=False)
+
+    def __post_init__(self):
+        if self.allocation_policy not in ALLOCATION_POLICIES:
+            raise ValueError(f"Unknown allocation_policy {self.allocation_policy!r}, expected one of {ALLOCATION_POLICIES}")
+        names = [project.name for project in self.projects]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate project names in shard map: {names}")
+        self._by_name = {project.name: project for project in self.projects}
+
+    def project(self, name: str) -> Project:
+        try:
+            return self._by_name[name]
+        except KeyError:
+            raise ValueError(f"Invalid project: {name}")
+
+    def writable_projects(self) -> List[Project]:
+        return [p for p in self.projects if p.accepting_writes and p.is_configured]
+
+    def to_dict(self) -> Dict:
+        return {
+            "allocation_policy": self.allocation_policy,
+            "projects": [asdict(project) for project in self.projects],
+        }
+
+
+def default_shard_map() -> ShardMap:
+    """The original layout: QA1 and QA2."""
+    return ShardMap(projects=[
+        Project(name="QA1", api_key_env="PINECONE_API_KEY"),
+        Project(name="QA2", api_key_env="PINECONE_API_KEY_SECOND_PROJECT"),
+    ])
+
+
+def parse_shard_map(data: Dict) -> ShardMap:
+    projects = [Project(**project) for project in data.get("projects", [])]
+    if not projects:
+        raise ValueError("Shard map must define at least one project")
+    return ShardMap(projects=projects, allocation_policy=data.get("allocation_policy", "fill_first"))
+
+
+def load_shard_map(path: Optional[str] = None) -> ShardMap:
+    path = path or SHARD_MAP_FILE
+    if not os.path.exists(path):
+        return default_shard_map()
+    with open(path) as f:
+        return parse_shard_map(json.load(f))
+
+
+def save_shard_map(shard_map: ShardMap, path: Optional[str] = None) -> None:
+    path = path or SHARD_MAP_FILE
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(shard_map.to_dict(), f, indent=2)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+_lock = threading.Lock()
+_shard_map: Optional[ShardMap] = None
+
+
+def get_shard_map() -> ShardMap:
+    """The shard map for this process, loaded on first use."""
+    global _shard_map
+    if _shard_map is None:
+        with _lock:
+            if _shard_map is None:
+                _shard_map = load_shard_map()
+    return _shard_map
+
+
+def set_shard_map(shard_map: Optional[ShardMap]) -> None:
+    """Replace the process's shard map (None reloads it from disk on next use)."""
+    global _shard_map
+    with _lock:
+        _shard_map = shard_map
+
+
+def get_pinecone_client(project: str):
+    """Shared Pinecone client for a project."""
+    return services.get_pinecone(get_shard_map().project(project).api_key)
+
+
+def get_index(index_name: str, project: str):
+    """Shared handle to index_name in a project. Every module routes through here."""
+    return services.get_index(get_shard_map().project(project).api_key, index_name)
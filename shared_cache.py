@@ -0,0 +1,297 @@
+"""
+Cache shared by every worker process, for routing lookups, query embeddings
+and answers.
+
+Private per-process caches divide the hit rate by the worker count and warm up
+once per process; this tier is shared instead. SHARED_CACHE_BACKEND picks the
+store:
+
+- sqlite (default): a SQLite file in LOCAL_DATA_DIR, shared by the workers on
+  the host. Reads hit the OS page cache and the WAL's shared-memory index.
+- memory: a dict in this process; for single-process runs and tests.
+- off: no caching.
+
+Any store implementing CacheBackend (get/set/delete/invalidate) can be
+registered as the "shared_cache" service, e.g. one backed by a networked
+key-value store to share entries between instances.
+
+Values are bytes: JSON for routes and answers, packed float32 for embeddings;
+nothing is pickled. Entries for a namespace (its route and answers) are tagged
+with it and dropped together by invalidate_namespace(), which re-ingestion
+calls. Answers are keyed by the prompt version and model as well, so a prompt
+or model change never serves old answers.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from local_store import LOCAL_DATA_DIR
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_BACKEND = os.environ.get("SHARED_CACHE_BACKEND", "sqlite").lower()
+SHARED_CACHE_FILE = os.environ.get("SHARED_CACHE_FILE", "shared_cache.sqlite3")
+SHARED_CACHE_MAX_ENTRIES = int(os.environ.get("SHARED_CACHE_MAX_ENTRIES", "100000"))
+SHARED_CACHE_ROUTE_TTL = int(os.environ.get("SHARED_CACHE_ROUTE_TTL", "3600"))
+SHARED_CACHE_EMBEDDING_TTL = int(os.environ.get("SHARED_CACHE_EMBEDDING_TTL", "86400"))
+# 0 disables answer caching
+SHARED_CACHE_ANSWER_TTL = int(os.environ.get("SHARED_CACHE_ANSWER_TTL", "900"))
+
+if SHARED_CACHE_BACKEND not in ("sqlite", "memory", "off"):
+    logger.warning(f"Unknown SHARED_CACHE_BACKEND {SHARED_CACHE_BACKEND!r}, shared cache disabled")
+    SHARED_CACHE_BACKEND = "off"
+
+# Expired and excess entries are pruned once every this many writes
+_PRUNE_EVERY = 500
+
+CACHE_REQUESTS = counter(
+    "caseon_shared_cache_requests_total",
+    "Shared cache lookups by kind (route, embedding, answer) and outcome (hit, miss, error).",
+    ("kind", "outcome"),
+)
+
+
+class CacheBackend:
+    """The operations a shared cache store provides. Keys are strings, values bytes."""
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl_seconds: int, namespace: Optional[str] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def invalidate(self, namespace: str) -> None:
+        """Drop every entry set with this namespace."""
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    def __init__(self, max_entries: int = SHARED_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[bytes, float, Optional[str]]] = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                return None
+            return entry[0]
+
+    def set(self, key, value, ttl_seconds, namespace=None):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl_seconds, namespace)
+            if len(self._entries) > self.max_entries:
+                # Dicts keep insertion order; drop the oldest writes
+                for old in list(self._entries)[:len(self._entries) - self.max_entries]:
+                    del self._entries[old]
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate(self, namespace):
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[2] == namespace]:
+                del self._entries[key]
+
+
+class SqliteCacheBackend(CacheBackend):
+    """
+    Entries in their own SQLite file, so cache traffic does not queue behind
+    the local store's connection lock.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS cache_entry (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expire_at REAL NOT NULL,
+        namespace TEXT
+    );
+    CREATE INDEX IF NOT EXISTS cache_entry_namespace ON cache_entry (namespace);
+    CREATE INDEX IF NOT EXISTS cache_entry_expire ON cache_entry (expire_at);
+    """
+
+    def __init__(self, path: str, max_entries: int = SHARED_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._writes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Reopened after a fork so workers never share the master's handle
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.executescript(self._SCHEMA)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value FROM cache_entry WHERE key = ? AND expire_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl_seconds, namespace=None):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entry (key, value, expire_at, namespace) VALUES (?, ?, ?, ?)",
+                (key, value, time.time() + ttl_seconds, namespace),
+            )
+            self._writes += 1
+            if self._writes % _PRUNE_EVERY == 0:
+                self._prune(conn)
+
+    def _prune(self, conn) -> None:
+        conn.execute("DELETE FROM cache_entry WHERE expire_at <= ?", (time.time(),))
+        excess = conn.execute("SELECT COUNT(*) FROM cache_entry").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM cache_entry WHERE key IN (SELECT key FROM cache_entry ORDER BY expire_at LIMIT ?)",
+                (excess,),
+            )
+
+    def delete(self, key):
+        with self._lock:
+            self._connection().execute("DELETE FROM cache_entry WHERE key = ?", (key,))
+
+    def invalidate(self, namespace):
+        with self._lock:
+            self._connection().execute("DELETE FROM cache_entry WHERE namespace = ?", (namespace,))
+
+
+def build_backend() -> CacheBackend:
+    if SHARED_CACHE_BACKEND == "memory":
+        return MemoryCacheBackend()
+    return SqliteCacheBackend(os.path.join(LOCAL_DATA_DIR, SHARED_CACHE_FILE))
+
+
+def enabled() -> bool:
+    return SHARED_CACHE_BACKEND != "off"
+
+
+def _backend() -> CacheBackend:
+    import services
+    return services.get("shared_cache")
+
+
+def _get(kind: str, key: str) -> Optional[bytes]:
+    try:
+        value = _backend().get(key)
+    except Exception as e:
+        # The cache is an optimisation; never fail the request over it
+        CACHE_REQUESTS.inc(kind=kind, outcome="error")
+        logger.warning(f"Shared cache read failed: {e}")
+        return None
+    CACHE_REQUESTS.inc(kind=kind, outcome="miss" if value is None else "hit")
+    return value
+
+
+def _set(key: str, value: bytes, ttl_seconds: int, namespace: Optional[str] = None) -> None:
+    try:
+        _backend().set(key, value, ttl_seconds, namespace)
+    except Exception as e:
+        logger.warning(f"Shared cache write failed: {e}")
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:32]
+
+
+def get_route(namespace: str) -> Tuple[Optional[str], Optional[str]]:
+    """(index_name, project) for namespace, from the cache or volume_handling_table."""
+    import pinecone_index_manager
+    if not enabled():
+        return pinecone_index_manager.get_index_project_by_namespace(namespace)
+    key = f"route:{namespace}"
+    cached = _get("route", key)
+    if cached is not None:
+        index_name, project = json.loads(cached)
+        return index_name, project
+    index_name, project = pinecone_index_manager.get_index_project_by_namespace(namespace)
+    # Unknown namespaces are not cached; they may be ingested any moment
+    if index_name and project:
+        _set(key, json.dumps([index_name, project]).encode(), SHARED_CACHE_ROUTE_TTL, namespace)
+    return index_name, project
+
+
+def get_routes(namespaces: List[str]) -> Dict[str, Tuple[str, str]]:
+    """(index_name, project) of each routed namespace, with one database query for all cache misses."""
+    import pinecone_index_manager
+    routes = {}
+    missing = list(namespaces)
+    if enabled():
+        missing = []
+        for namespace in namespaces:
+            cached = _get("route", f"route:{namespace}")
+            if cached is None:
+                missing.append(namespace)
+            else:
+                index_name, project = json.loads(cached)
+                routes[namespace] = (index_name, project)
+    if missing:
+        found = pinecone_index_manager.get_routes_by_namespaces(missing)
+        for namespace, (index_name, project) in found.items():
+            routes[namespace] = (index_name, project)
+            if enabled():
+                _set(f"route:{namespace}", json.dumps([index_name, project]).encode(), SHARED_CACHE_ROUTE_TTL, namespace)
+    return routes
+
+
+def get_embedding(model: str, text: str) -> Optional[List[float]]:
+    if not enabled():
+        return None
+    cached = _get("embedding", f"embedding:{_digest(model, text)}")
+    return array("f", cached).tolist() if cached is not None else None
+
+
+def set_embedding(model: str, text: str, vector: List[float]) -> None:
+    if enabled():
+        _set(f"embedding:{_digest(model, text)}", array("f", vector).tobytes(), SHARED_CACHE_EMBEDDING_TTL)
+
+
+def _answer_key(namespace: str, question: str) -> str:
+    import services
+    from generative_model import PROMPT_VERSION
+    return f"answer:{_digest(namespace, question, PROMPT_VERSION, services.CHAT_MODEL)}"
+
+
+def get_answer(namespace: str, question: str) -> Optional[str]:
+    """A cached answer to question (already normalized) on namespace."""
+    if not enabled() or SHARED_CACHE_ANSWER_TTL <= 0:
+        return None
+    cached = _get("answer", _answer_key(namespace, question))
+    return json.loads(cached) if cached is not None else None
+
+
+def set_answer(namespace: str, question: str, answer: str) -> None:
+    if enabled() and SHARED_CACHE_ANSWER_TTL > 0:
+        _set(_answer_key(namespace, question), json.dumps(answer).encode(), SHARED_CACHE_ANSWER_TTL, namespace)
+
+
+def invalidate_namespace(namespace: str) -> None:
+    """Drop namespace's cached route and answers, e.g. after its document changed."""
+    if not enabled():
+        return
+    try:
+        _backend().invalidate(namespace)
+    except Exception as e:
+        logger.warning(f"Shared cache invalidation of {namespace} failed: {e}")
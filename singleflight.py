@@ -0,0 +1,78 @@
+"""
+Coalesce concurrent identical calls into one.
+
+The first caller for a key (the leader) runs the function; callers arriving
+with the same key while it is running (followers) wait for and share its
+result or exception. Nothing is cached once the leader finishes, so a later
+call runs the function again.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from metrics import counter, gauge
+
+COALESCED_CALLS = counter(
+    "caseon_singleflight_calls_total",
+    "Calls through a single-flight group, by role (leader ran the work, follower shared a leader's result, "
+    "timeout gave up waiting and ran the work itself).",
+    ("group", "role"),
+)
+IN_FLIGHT = gauge("caseon_singleflight_in_flight", "Distinct keys currently being computed.", ("group",))
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Per-process group of in-flight calls keyed by a hashable key."""
+
+    def __init__(self, name: str, wait_timeout: Optional[float] = None):
+        self.name = name
+        # Followers stop waiting after this many seconds and run the work themselves
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                call.followers += 1
+                leader = False
+
+        if not leader:
+            if call.done.wait(self.wait_timeout):
+                COALESCED_CALLS.inc(group=self.name, role="follower")
+                if call.error is not None:
+                    raise call.error
+                return call.result
+            COALESCED_CALLS.inc(group=self.name, role="timeout")
+            return fn()
+
+        COALESCED_CALLS.inc(group=self.name, role="leader")
+        IN_FLIGHT.inc(group=self.name)
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            IN_FLIGHT.dec(group=self.name)
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,62 @@
+"""
+Shared fixtures. Tests run offline: upstreams are the stand-ins from
+benchmarks/standins.py, and each test gets its own empty local store.
+
+Run with `python -m pytest tests` from the repository root.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (REPO_ROOT, os.path.join(REPO_ROOT, "benchmarks")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# Read at import by modules that keep files there (hot tier, traces); the store itself is per test
+os.environ["LOCAL_DATA_DIR"] = tempfile.mkdtemp(prefix="caseon-tests-")
+# Its entries would outlive the per-test local store
+os.environ["SHARED_CACHE_BACKEND"] = "off"
+
+
+@pytest.fixture(autouse=True)
+def local_data(tmp_path, monkeypatch):
+    """Point the local store at a fresh directory for the test."""
+    import local_store
+
+    def close():
+        if local_store._connection is not None:
+            local_store._connection.close()
+        local_store._connection = None
+        local_store._applied_schemas.clear()
+
+    close()
+    monkeypatch.setattr(local_store, "LOCAL_DATA_DIR", str(tmp_path))
+    yield tmp_path
+    close()
+
+
+@pytest.fixture
+def fakes():
+    """
+    Fresh stand-ins for Gemini, Pinecone and MySQL. Returns (Pinecone projects
+    by API key, SqliteDatabase).
+    """
+    import standins
+    # The modules whose database helpers the stand-in replaces must be imported first
+    import deletion  # noqa: F401
+    import document_processing  # noqa: F401
+    import one_adder  # noqa: F401
+    import token_usage_database_update  # noqa: F401
+
+    database = standins.SqliteDatabase(latency_ms=0)
+    projects = standins.install(
+        embeddings=standins.FakeEmbeddings(latency_ms=0),
+        llm=standins.FakeLLM(first_token_ms=0, ms_per_token=0, output_tokens=3),
+        pinecone_options={"query_latency_ms": 0, "write_latency_ms": 0},
+        database=database,
+    )
+    return projects, database
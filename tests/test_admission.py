@@ -0,0 +1,135 @@
+import threading
+import time
+from dataclasses import dataclass
+
+import pytest
+
+import admission
+from admission import AdmissionController, KeyLimits, Rejected, TokenBucket
+from services import key_id, load_key_limits
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_allows_a_burst_then_refills(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    bucket = TokenBucket(rate_per_second=2, burst=3)
+
+    assert [bucket.take(1) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(1) == pytest.approx(0.5)
+
+    clock.now += 1.0
+    assert bucket.take(2) == 0.0
+    assert bucket.take(1) > 0
+
+
+def test_token_bucket_caps_cost_at_burst(monkeypatch):
+    monkeypatch.setattr(admission.time, "monotonic", Clock())
+    bucket = TokenBucket(rate_per_second=1, burst=2)
+    # An ingestion costing more than the burst can still be admitted on a full bucket
+    assert bucket.take(5) == 0.0
+
+
+def test_rate_limited_request_is_rejected_with_retry_after(monkeypatch):
+    monkeypatch.setattr(admission.time, "monotonic", Clock())
+    monkeypatch.setattr(admission, "ADMISSION_KEY_LIMITS",
+                        {key_id("k"): KeyLimits(rate_per_second=1, burst=1, concurrency=4)})
+    controller = AdmissionController(max_concurrent=4, queue_size=4, queue_per_key=4, queue_timeout=1)
+
+    controller.release(controller.acquire("k", "chat"))
+    with pytest.raises(Rejected) as rejected:
+        controller.acquire("k", "chat")
+    assert rejected.value.retry_after == pytest.approx(1.0)
+
+
+def acquire_in_thread(controller, api_key, granted):
+    def run():
+        try:
+            granted.append((api_key, controller.acquire(api_key, "chat")))
+        except Rejected as e:
+            granted.append((api_key, e))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_fair_queue_hands_slots_to_keys_round_robin():
+    controller = AdmissionController(max_concurrent=1, queue_size=8, queue_per_key=8, queue_timeout=5)
+    running = controller.acquire("busy", "chat")
+    granted = []
+
+    threads = []
+    # The busy key queues first, yet the quiet key is served second, not third
+    for api_key in ("busy", "busy", "quiet"):
+        threads.append(acquire_in_thread(controller, api_key, granted))
+        wait_until(lambda: controller._queued == len(threads))
+
+    for expected in ("busy", "quiet", "busy"):
+        controller.release(running)
+        wait_until(lambda: len(granted) == 1)
+        api_key, running = granted.pop()
+        assert api_key == expected
+    controller.release(running)
+    for thread in threads:
+        thread.join(5)
+    assert controller.usage() == {}
+
+
+def test_full_queue_is_rejected():
+    controller = AdmissionController(max_concurrent=1, queue_size=8, queue_per_key=1, queue_timeout=5)
+    running = controller.acquire("k", "chat")
+    granted = []
+    thread = acquire_in_thread(controller, "k", granted)
+    wait_until(lambda: controller._queued == 1)
+
+    with pytest.raises(Rejected, match="Server busy"):
+        controller.acquire("k", "chat")
+
+    controller.release(running)
+    thread.join(5)
+    controller.release(granted[0][1])
+
+
+def test_queue_timeout_is_rejected_and_dequeued():
+    controller = AdmissionController(max_concurrent=1, queue_size=8, queue_per_key=8, queue_timeout=0.05)
+    running = controller.acquire("k", "chat")
+    with pytest.raises(Rejected):
+        controller.acquire("other", "chat")
+    assert controller._queued == 0
+    controller.release(running)
+    assert controller.usage() == {}
+
+
+@dataclass
+class Limits:
+    rate: float = 1.0
+    slots: int = 2
+
+
+def test_key_limits_are_validated(monkeypatch, caplog):
+    monkeypatch.setenv("TEST_KEY_LIMITS", '{"a": {"rate": 3, "slot": 9, "slots": "4"}, "b": 5, "c": {"slots": 8.0}}')
+    limits = load_key_limits("TEST_KEY_LIMITS", Limits)
+    assert limits == {"a": Limits(rate=3.0, slots=2), "c": Limits(slots=8)}
+    assert isinstance(limits["c"].slots, int)
+    assert "unknown limit 'slot'" in caplog.text
+
+
+@pytest.mark.parametrize("raw", ["", "{not json", "[1, 2]"])
+def test_invalid_key_limits_fall_back_to_defaults(monkeypatch, raw):
+    monkeypatch.setenv("TEST_KEY_LIMITS", raw)
+    assert load_key_limits("TEST_KEY_LIMITS", Limits) == {}
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import chunk_manifest
+
+
+def doc(text, page=0):
+    return SimpleNamespace(page_content=text, metadata={"page": page})
+
+
+def test_vector_ids_are_stable_and_per_namespace():
+    docs = [doc("alpha", 0), doc("beta", 1)]
+    assert chunk_manifest.assign_ids("ns", docs) == chunk_manifest.assign_ids("ns", docs)
+    ids = [vid for vid, _, _ in chunk_manifest.assign_ids("ns", docs)]
+    other = [vid for vid, _, _ in chunk_manifest.assign_ids("other", docs)]
+    assert len(set(ids)) == 2
+    assert not set(ids) & set(other)
+
+
+def test_repeated_chunks_get_distinct_positions():
+    entries = chunk_manifest.assign_ids("ns", [doc("same"), doc("same"), doc("same", 1)])
+    assert [position for _, _, position in entries] == [0, 1, 0]
+    assert len({vid for vid, _, _ in entries}) == 3
+
+
+def test_page_is_part_of_the_chunk_hash():
+    assert chunk_manifest.chunk_hash("text", 0) != chunk_manifest.chunk_hash("text", 1)
+
+
+def test_diff_against_stored_manifest():
+    old = chunk_manifest.assign_ids("ns", [doc("intro", 0), doc("facts", 1), doc("held", 2)])
+    chunk_manifest.save_manifest("ns", old)
+
+    new = chunk_manifest.assign_ids("ns", [doc("intro", 0), doc("facts, amended", 1), doc("held", 2), doc("costs", 3)])
+    to_upsert, to_delete = chunk_manifest.diff("ns", new)
+
+    assert to_upsert == [1, 3]
+    assert to_delete == [old[1][0]]
+
+
+def test_unchanged_document_has_nothing_to_do():
+    entries = chunk_manifest.assign_ids("ns", [doc("intro", 0), doc("facts", 1)])
+    chunk_manifest.save_manifest("ns", entries)
+    assert chunk_manifest.diff("ns", entries) == ([], [])
+
+
+def test_save_replaces_and_delete_drops_the_manifest():
+    chunk_manifest.save_manifest("ns", chunk_manifest.assign_ids("ns", [doc("a"), doc("b")]))
+    entries = chunk_manifest.assign_ids("ns", [doc("c")])
+    chunk_manifest.save_manifest("ns", entries)
+    assert chunk_manifest.load_manifest("ns") == {entries[0][0]: entries[0][1]}
+
+    chunk_manifest.delete_manifest("ns")
+    assert not chunk_manifest.has_manifest("ns")
+    assert chunk_manifest.diff("ns", entries) == ([0], [])
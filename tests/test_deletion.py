@@ -0,0 +1,119 @@
+import pytest
+
+import deletion
+import shard_map
+from local_store import local_db
+from standins import FakeEmbeddings
+
+GRACE = 3600
+
+
+def upsert_vectors(index_name, namespace, count=3):
+    vectors = FakeEmbeddings(latency_ms=0).embed_documents([f"{namespace} chunk {i}" for i in range(count)])
+    shard_map.get_index(index_name, "QA1").upsert(
+        [{"id": f"{namespace}-{i}", "values": vector} for i, vector in enumerate(vectors)], namespace=namespace
+    )
+
+
+def live_namespaces(index_name):
+    return set(shard_map.get_index(index_name, "QA1").describe_index_stats()["namespaces"])
+
+
+def age_orphans(seconds):
+    """Pretend every tracked orphan was first seen seconds earlier."""
+    with local_db() as conn:
+        conn.execute("UPDATE reconcile_orphan SET first_seen = first_seen - ?", (seconds,))
+
+
+def orphans(report):
+    return {(o["kind"], o["namespace"]) for o in report["orphans"]}
+
+
+@pytest.fixture
+def database(fakes):
+    _, database = fakes
+    # A routed namespace with its vectors: never an orphan
+    database.insert_case("routed", "idx-1", "QA1")
+    upsert_vectors("idx-1", "routed")
+    return database
+
+
+def test_orphans_are_kept_during_the_grace_period(database):
+    upsert_vectors("idx-1", "unrouted")
+    database.insert_case("missing", "idx-1", "QA1")
+
+    report = deletion.reconcile(apply=True, grace_seconds=GRACE)
+    assert orphans(report) == {("vectors", "unrouted"), ("route", "missing")}
+    assert report["due"] == 0 and report["cleaned"] == 0
+    assert live_namespaces("idx-1") == {"routed", "unrouted"}
+    assert database.get_index_project_by_namespace("missing") == ("idx-1", "QA1")
+
+    # Seen again later, still within the grace period: first_seen is kept, not reset
+    age_orphans(GRACE / 2)
+    assert deletion.reconcile(apply=True, grace_seconds=GRACE)["cleaned"] == 0
+
+    age_orphans(GRACE / 2)
+    report = deletion.reconcile(apply=True, grace_seconds=GRACE)
+    assert report["due"] == 2 and report["cleaned"] == 2
+    assert live_namespaces("idx-1") == {"routed"}
+    assert database.get_index_project_by_namespace("missing") == (None, None)
+    assert database.get_index_project_by_namespace("routed") == ("idx-1", "QA1")
+    assert orphans(deletion.reconcile(grace_seconds=GRACE)) == set()
+
+
+def test_without_apply_nothing_is_cleaned(database):
+    upsert_vectors("idx-1", "unrouted")
+    deletion.reconcile(grace_seconds=GRACE)
+    age_orphans(2 * GRACE)
+    report = deletion.reconcile(grace_seconds=GRACE)
+    assert report["due"] == 1 and report["cleaned"] == 0
+    assert "unrouted" in live_namespaces("idx-1")
+
+
+def test_an_ingestion_that_completes_is_no_longer_tracked(database):
+    # Vectors upserted before the route is written look like an orphan for a moment
+    upsert_vectors("idx-1", "ingesting")
+    assert orphans(deletion.reconcile(grace_seconds=GRACE)) == {("vectors", "ingesting")}
+
+    database.insert_case("ingesting", "idx-1", "QA1")
+    assert orphans(deletion.reconcile(apply=True, grace_seconds=0)) == set()
+    with local_db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM reconcile_orphan").fetchone()[0] == 0
+    assert "ingesting" in live_namespaces("idx-1")
+
+
+def test_delete_document_drops_the_sanitized_trending_column(database):
+    import one_adder
+
+    for namespace in ("case-bench-1", "9case"):
+        database.insert_case(namespace, "idx-1", "QA1")
+        upsert_vectors("idx-1", namespace)
+        one_adder.increment_column_for_today(namespace)
+    assert sorted(database.trending_columns()) == ["casebench1", "idx_9case"]
+
+    for namespace in ("case-bench-1", "9case"):
+        result = deletion.delete_document(namespace)
+        assert result["vectors_deleted"] and result["trending_dropped"]
+    assert database.trending_columns() == []
+    assert live_namespaces("idx-1") == {"routed"}
+
+
+def test_deleting_an_unknown_document_raises(database):
+    assert not deletion.exists("nothing-here")
+    with pytest.raises(deletion.NamespaceNotFound):
+        deletion.delete_document("nothing-here")
+
+
+def test_a_trending_column_shared_with_a_live_namespace_is_kept(database):
+    import one_adder
+
+    # Both sanitize to the column "ab"
+    for namespace in ("a-b", "ab"):
+        database.insert_case(namespace, "idx-1", "QA1")
+        upsert_vectors("idx-1", namespace)
+        one_adder.increment_column_for_today(namespace)
+
+    assert deletion.delete_document("a-b")["trending_dropped"]
+    assert database.trending_columns() == ["ab"]
+    deletion.delete_document("ab")
+    assert database.trending_columns() == []
@@ -0,0 +1,51 @@
+import pytest
+
+import context_cache
+import generative_model
+import resilience
+
+
+class Rejected(Exception):
+    code = 400
+
+
+def completion_failing_with(monkeypatch, error):
+    """Make the first completion raise error and record discarded handles and the handle of each call."""
+    calls, discarded = [], []
+
+    def call(upstream, fn, prompt, cached_content):
+        calls.append(cached_content)
+        if len(calls) == 1:
+            raise error
+        return "answer", {}
+
+    monkeypatch.setattr(resilience, "call", call)
+    monkeypatch.setattr(context_cache, "discard", discarded.append)
+    monkeypatch.setattr(generative_model, "system_prompt_cache", lambda: "cachedContents/system")
+    return calls, discarded
+
+
+def test_a_rejected_system_prompt_cache_is_discarded_and_resent_in_full(monkeypatch):
+    calls, discarded = completion_failing_with(monkeypatch, Rejected("cached content not found"))
+    assert generative_model.get_completion("question") == ("answer", {})
+    assert calls == ["cachedContents/system", None]
+    assert discarded == ["cachedContents/system"]
+
+
+def test_a_wrapped_rejection_is_recognised(monkeypatch):
+    try:
+        raise RuntimeError("Invalid argument provided to Gemini") from Rejected("cached content not found")
+    except RuntimeError as e:
+        error = e
+    _, discarded = completion_failing_with(monkeypatch, error)
+    with pytest.raises(generative_model.CachedContentRejected):
+        generative_model.get_completion("question", cached_content="cachedContents/document")
+    assert discarded == ["cachedContents/document"]
+
+
+@pytest.mark.parametrize("cached_content", [None, "cachedContents/document"])
+def test_transient_failures_keep_the_handle(monkeypatch, cached_content):
+    calls, discarded = completion_failing_with(monkeypatch, ConnectionError("reset by peer"))
+    with pytest.raises(ConnectionError):
+        generative_model.get_completion("question", cached_content=cached_content)
+    assert len(calls) == 1 and discarded == []
@@ -0,0 +1,32 @@
+import pytest
+
+import main_chat
+import shard_map
+import shared_cache
+from standins import FakeEmbeddings
+
+
+@pytest.fixture
+def cached_answers(fakes, monkeypatch):
+    """Answers main_chat hands to the shared cache, as (namespace, question) pairs."""
+    stored = []
+    monkeypatch.setattr(shared_cache, "set_answer", lambda namespace, question, answer: stored.append((namespace, question)))
+    return stored
+
+
+def test_answer_without_context_is_not_cached(cached_answers):
+    # No route yet: the chat arrived before ingestion created it
+    assert main_chat.start_chatting("not-ingested", "Who is the appellant?")
+    assert cached_answers == []
+
+
+def test_answer_from_retrieval_is_cached(fakes, cached_answers):
+    _, database = fakes
+    database.insert_case("ingested", "idx-1", "QA1")
+    vectors = FakeEmbeddings(latency_ms=0).embed_documents(["the appellant is a company"])
+    shard_map.get_index("idx-1", "QA1").upsert(
+        [{"id": "v1", "values": vectors[0], "metadata": {"text": "the appellant is a company", "page": 0}}],
+        namespace="ingested",
+    )
+    main_chat.start_chatting("ingested", "Who is the appellant?")
+    assert cached_answers == [("ingested", "who is the appellant?")]
@@ -0,0 +1,115 @@
+import threading
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def start_callers(group, key, fn, count):
+    """Start count callers of group.do(key, fn); returns their threads and a list collecting results."""
+    results = []
+
+    def call():
+        try:
+            results.append(group.do(key, fn))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def wait_for_call(group, key, count):
+    """Wait until a leader is running key and count followers are waiting on it."""
+    for _ in range(1000):
+        with group._lock:
+            call = group._calls.get(key)
+            if call is not None and call.followers >= count:
+                return
+        threading.Event().wait(0.005)
+    raise AssertionError("callers did not arrive")
+
+
+def test_followers_share_the_leaders_result():
+    group = SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return "answer"
+
+    leader, leader_results = start_callers(group, "k", work, 1)
+    wait_for_call(group, "k", 0)
+    followers, results = start_callers(group, "k", work, 4)
+    wait_for_call(group, "k", 4)
+    release.set()
+    for thread in leader + followers:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert leader_results + results == ["answer"] * 5
+    assert group.in_flight() == 0
+
+
+def test_followers_get_the_leaders_exception():
+    group = SingleFlight("test")
+    release = threading.Event()
+
+    def work():
+        release.wait(5)
+        raise ValueError("upstream failed")
+
+    leader, leader_results = start_callers(group, "k", work, 1)
+    wait_for_call(group, "k", 0)
+    followers, results = start_callers(group, "k", work, 2)
+    wait_for_call(group, "k", 2)
+    release.set()
+    for thread in leader + followers:
+        thread.join(5)
+
+    assert all(isinstance(result, ValueError) for result in leader_results + results)
+
+
+def test_follower_runs_the_work_itself_after_wait_timeout():
+    group = SingleFlight("test", wait_timeout=0.05)
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return "leader"
+
+    leader, leader_results = start_callers(group, "k", slow, 1)
+    wait_for_call(group, "k", 0)
+    assert group.do("k", lambda: "follower") == "follower"
+    release.set()
+    leader[0].join(5)
+    assert leader_results == ["leader"]
+
+
+def test_nothing_is_cached_after_the_leader_finishes():
+    group = SingleFlight("test")
+    calls = []
+    for _ in range(3):
+        group.do("k", lambda: calls.append(1))
+    assert len(calls) == 3
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    group = SingleFlight("test")
+    release = threading.Event()
+    leader, _ = start_callers(group, "a", lambda: release.wait(5), 1)
+    wait_for_call(group, "a", 0)
+    assert group.do("b", lambda: "b") == "b"
+    release.set()
+    leader[0].join(5)
+
+
+def test_leader_exception_propagates():
+    group = SingleFlight("test")
+    with pytest.raises(KeyError):
+        group.do("k", lambda: {}["missing"])
+    assert group.in_flight() == 0
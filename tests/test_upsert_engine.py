@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+import resilience
+import upsert_engine
+from standins import FakeEmbeddings, FakeIndex
+
+
+class FlakyIndex(FakeIndex):
+    """FakeIndex whose upserts fail for the given vector IDs, failures[id] times each."""
+
+    def __init__(self, failures=None):
+        super().__init__("flaky", query_latency_ms=0, write_latency_ms=0)
+        self.failures = dict(failures or {})
+        self.upserted = []
+        self._failures_lock = threading.Lock()
+
+    def upsert(self, vectors, namespace="", **kwargs):
+        with self._failures_lock:
+            failing = [v["id"] for v in vectors if self.failures.get(v["id"], 0) > 0]
+            for vid in failing:
+                self.failures[vid] -= 1
+        if failing:
+            raise ConnectionError(f"upsert of {failing[0]} failed")
+        self.upserted += [v["id"] for v in vectors]
+        return super().upsert(vectors, namespace=namespace, **kwargs)
+
+
+def items(count):
+    return [(f"id-{i:03d}", f"chunk {i}", {"page": i}) for i in range(count)]
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    # Without resilience.py's per-call retries, failures reach upsert_engine's retry rounds
+    monkeypatch.setattr(resilience, "RESILIENCE_ENABLED", False)
+    monkeypatch.setattr(upsert_engine, "UPSERT_BATCH_SIZE", 10)
+    monkeypatch.setattr(upsert_engine, "UPSERT_RETRY_ROUNDS", 2)
+    monkeypatch.setattr(upsert_engine, "UPSERT_CHECKPOINT", True)
+
+
+def test_upserts_every_chunk_and_checkpoints_them():
+    index = FlakyIndex()
+    assert upsert_engine.upsert(index, FakeEmbeddings(latency_ms=0), "ns", items(25)) == 25
+    assert sorted(index.upserted) == [vid for vid, _, _ in items(25)]
+    assert index.fetch(["id-007"], namespace="ns")["vectors"]["id-007"]["metadata"] == {"page": 7}
+    assert upsert_engine.committed("ns") == {vid for vid, _, _ in items(25)}
+
+
+def test_failed_batches_are_retried_in_later_rounds():
+    index = FlakyIndex({"id-003": 1, "id-017": 2})
+    assert upsert_engine.upsert(index, FakeEmbeddings(latency_ms=0), "ns", items(25)) == 25
+    assert sorted(set(index.upserted)) == [vid for vid, _, _ in items(25)]
+    # Committed batches were not sent again
+    assert len(index.upserted) == 25
+
+
+def test_gives_up_after_the_retry_rounds_and_resumes_next_time():
+    index = FlakyIndex({"id-012": 3})
+    embeddings = FakeEmbeddings(latency_ms=0)
+    with pytest.raises(ConnectionError):
+        upsert_engine.upsert(index, embeddings, "ns", items(25))
+    committed = upsert_engine.committed("ns")
+    assert len(committed) == 15
+    assert not any(vid.startswith("id-01") for vid in committed)
+
+    # Submitted again, only the batch that never committed is embedded and upserted
+    embeddings.calls = 0
+    index.upserted = []
+    assert upsert_engine.upsert(index, embeddings, "ns", items(25)) == 10
+    assert embeddings.calls == 1
+    assert sorted(index.upserted) == [f"id-{i:03d}" for i in range(10, 20)]
+
+
+def test_clear_forgets_the_checkpoint():
+    upsert_engine.upsert(FlakyIndex(), FakeEmbeddings(latency_ms=0), "ns", items(5))
+    upsert_engine.clear("ns")
+    assert upsert_engine.committed("ns") == set()
+
+
+def test_no_checkpoint_when_disabled(monkeypatch):
+    monkeypatch.setattr(upsert_engine, "UPSERT_CHECKPOINT", False)
+    upsert_engine.upsert(FlakyIndex(), FakeEmbeddings(latency_ms=0), "ns", items(5))
+    assert upsert_engine.committed("ns") == set()
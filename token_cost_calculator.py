@@ -1,8 +1,6 @@
 import pymysql
 from datetime import datetime
-from connection import getconnection
-
-connection = getconnection()
+from connection import getconnection, release_connection
 
 def calculate_token_cost(date: str, input_token_cost: float, output_token_cost: float) -> dict:
     """
@@ -16,6 +14,8 @@ def calculate_token_cost(date: str, input_token_cost: float, output_token_cost:
     Returns:
         dict: A dictionary containing total input cost, total output cost, and combined total cost.
     """
+    connection = None
+    cursor = None
     try:
         # Validate the date format
         try:
@@ -27,6 +27,9 @@ def calculate_token_cost(date: str, input_token_cost: float, output_token_cost:
         if input_token_cost < 0 or output_token_cost < 0:
             raise ValueError("Token costs must be non-negative.")
 
+        connection = getconnection()
+        if not connection:
+            raise RuntimeError("Failed to connect to database")
         cursor = connection.cursor()
 
         # Fetch the token usage for the given date
@@ -61,4 +64,10 @@ def calculate_token_cost(date: str, input_token_cost: float, output_token_cost:
         # Handle database errors
         raise RuntimeError(f"Database error: {e}")
 
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
 
@@ -1,6 +1,9 @@
+import logging
 import pymysql
 from datetime import datetime
-from connection import getconnection
+from connection import getconnection, release_connection
+
+logger = logging.getLogger(__name__)
 
 def update_token_usage(input_tokens: int, output_tokens: int):
     """
@@ -18,6 +21,7 @@ def update_token_usage(input_tokens: int, output_tokens: int):
     if connection is None:
         return
 
+    cursor = None
     try:
         cursor = connection.cursor()
 
@@ -35,15 +39,16 @@ def update_token_usage(input_tokens: int, output_tokens: int):
         
         # Commit the transaction
         connection.commit()
-        print(f"Token usage updated successfully for {datetime.now().date()}. || Input tokens: {input_tokens}, Output tokens: {output_tokens}")
+        logger.debug(f"Token usage updated successfully for {datetime.now().date()}. || Input tokens: {input_tokens}, Output tokens: {output_tokens}")
 
     except pymysql.MySQLError as e:
         # Handle database errors
-        print(f"Database error: {e}")
+        logger.error(f"Database error: {e}")
         connection.rollback()
 
     finally:
-        # Clean up the connection
-        cursor.close()
-        connection.close()
+        # Return the connection to the pool
+        if cursor:
+            cursor.close()
+        release_connection(connection)
 
@@ -0,0 +1,239 @@
+"""
+Sampled, batched tracing of LLM calls.
+
+Each completion is recorded as a span; whether it is kept is decided when it
+ends, so every failed call and every call slower than TRACE_SLOW_SECONDS is
+kept, plus a TRACE_SAMPLE_RATE fraction of the rest. Kept spans go onto a
+bounded buffer (TRACE_BUFFER_SIZE) and a background thread exports them in
+batches of up to TRACE_BATCH_SIZE, at least every TRACE_FLUSH_SECONDS. When the
+exporter falls behind, new spans are dropped and counted; the request path
+never waits on it.
+
+TRACE_EXPORTER picks where spans go:
+
+- langsmith (default): LangSmith's batch ingestion API, into TRACE_PROJECT.
+- file: JSON lines appended to TRACE_FILE, for offline use.
+- off: no tracing.
+
+The exporter is the "trace_exporter" service (see services.py), so a local
+stand-in can replace it.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from local_store import LOCAL_DATA_DIR
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.environ.get("TRACE_EXPORTER", "langsmith").lower()
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_SLOW_SECONDS = float(os.environ.get("TRACE_SLOW_SECONDS", "10"))
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", "1000"))
+TRACE_BATCH_SIZE = int(os.environ.get("TRACE_BATCH_SIZE", "50"))
+TRACE_FLUSH_SECONDS = float(os.environ.get("TRACE_FLUSH_SECONDS", "5"))
+TRACE_PROJECT = os.environ.get("TRACE_PROJECT", "Fiverr")
+TRACE_FILE = os.environ.get("TRACE_FILE", os.path.join(LOCAL_DATA_DIR, "traces.jsonl"))
+
+if TRACE_EXPORTER not in ("langsmith", "file", "off"):
+    logger.warning(f"Unknown TRACE_EXPORTER {TRACE_EXPORTER!r}, tracing disabled")
+    TRACE_EXPORTER = "off"
+
+TRACES = counter(
+    "caseon_traces_total",
+    "Spans by outcome: kept (error, slow or sampled), unsampled, dropped (buffer full), exported, export_failed.",
+    ("outcome",),
+)
+
+
+class Span:
+    def __init__(self, name: str, run_type: str, inputs: Dict, metadata: Optional[Dict] = None):
+        self.id = str(uuid.uuid4())
+        self.name = name
+        self.run_type = run_type
+        self.inputs = inputs
+        self.outputs: Optional[Dict] = None
+        self.metadata = metadata or {}
+        self.error: Optional[str] = None
+        self.start_time = datetime.now(timezone.utc)
+        self.end_time: Optional[datetime] = None
+        self._started = time.perf_counter()
+        self.duration = 0.0
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.duration = time.perf_counter() - self._started
+        self.end_time = datetime.now(timezone.utc)
+        if error is not None:
+            self.error = "".join(traceback.format_exception_only(type(error), error)).strip()
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "run_type": self.run_type,
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+            "error": self.error,
+            "start_time": self.start_time.isoformat(),
+            "end_time": self.end_time.isoformat() if self.end_time else None,
+            "duration_seconds": round(self.duration, 4),
+            "metadata": self.metadata,
+        }
+
+
+class LangSmithExporter:
+    """Each span as a single-run trace through LangSmith's batch ingestion."""
+
+    def __init__(self, client, project_name: str):
+        self.client = client
+        self.project_name = project_name
+
+    def export(self, spans: List[Span]) -> None:
+        runs = []
+        for span in spans:
+            runs.append({
+                "id": span.id,
+                "trace_id": span.id,
+                "dotted_order": f"{span.start_time:%Y%m%dT%H%M%S%fZ}{span.id}",
+                "name": span.name,
+                "run_type": span.run_type,
+                "inputs": span.inputs,
+                "outputs": span.outputs,
+                "error": span.error,
+                "start_time": span.start_time,
+                "end_time": span.end_time,
+                "session_name": self.project_name,
+                "extra": {"metadata": span.metadata},
+            })
+        self.client.batch_ingest_runs(create=runs)
+
+
+class FileExporter:
+    """Spans as JSON lines appended to a local file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def export(self, spans: List[Span]) -> None:
+        with open(self.path, "a") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+
+def build_exporter():
+    if TRACE_EXPORTER == "file":
+        return FileExporter(TRACE_FILE)
+    import services
+    return LangSmithExporter(services.get_langsmith_client(), TRACE_PROJECT)
+
+
+_buffer: "queue.Queue[Span]" = queue.Queue(maxsize=TRACE_BUFFER_SIZE)
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return TRACE_EXPORTER != "off"
+
+
+def _export(batch: List[Span]) -> None:
+    import services
+    try:
+        services.get("trace_exporter").export(batch)
+    except Exception as e:
+        TRACES.inc(len(batch), outcome="export_failed")
+        logger.warning(f"Exporting {len(batch)} spans failed: {e}")
+        return
+    TRACES.inc(len(batch), outcome="exported")
+
+
+def _run_exporter() -> None:
+    while True:
+        batch = [_buffer.get()]
+        deadline = time.monotonic() + TRACE_FLUSH_SECONDS
+        while len(batch) < TRACE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_buffer.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _export(batch)
+        for _ in batch:
+            _buffer.task_done()
+
+
+def _ensure_worker() -> None:
+    # Started on first use, so it runs in the worker process rather than a forking parent
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_exporter, name="trace-exporter", daemon=True)
+            _worker.start()
+
+
+def _keep(span: Span) -> bool:
+    return span.error is not None or span.duration >= TRACE_SLOW_SECONDS or random.random() < TRACE_SAMPLE_RATE
+
+
+def submit(span: Span) -> None:
+    """Queue a finished span for export if it is sampled, dropping it when the buffer is full."""
+    if not _keep(span):
+        TRACES.inc(outcome="unsampled")
+        return
+    _ensure_worker()
+    try:
+        _buffer.put_nowait(span)
+    except queue.Full:
+        TRACES.inc(outcome="dropped")
+        return
+    TRACES.inc(outcome="kept")
+
+
+@contextmanager
+def span(name: str, run_type: str = "chain", inputs: Optional[Dict] = None, metadata: Optional[Dict] = None):
+    """Record the block as a span; set .outputs on the yielded span. Exceptions mark it as an error."""
+    if not enabled():
+        yield Span(name, run_type, {}, {})
+        return
+    import log_config
+    metadata = dict(metadata or {})
+    request_id = log_config.get_request_id()
+    if request_id:
+        metadata["request_id"] = request_id
+    current = Span(name, run_type, inputs or {}, metadata)
+    try:
+        yield current
+    except BaseException as e:
+        current.finish(e)
+        submit(current)
+        raise
+    current.finish()
+    submit(current)
+
+
+def flush(timeout: float = 10.0) -> None:
+    """Wait (up to timeout) for buffered spans to be exported, e.g. before exit."""
+    if _worker is None or not _worker.is_alive():
+        return
+    deadline = time.monotonic() + timeout
+    while _buffer.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+atexit.register(flush)
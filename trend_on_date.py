@@ -1,10 +1,7 @@
 import pymysql
 from datetime import datetime
 from typing import List, Dict, Tuple
-from connection import getconnection
-
-connection = getconnection()
-
+from connection import getconnection, release_connection
 
 
 def get_trending_on_date(target_date: str) -> Tuple[bool, str, List[Dict]]:
@@ -20,6 +17,7 @@ def get_trending_on_date(target_date: str) -> Tuple[bool, str, List[Dict]]:
             trending_data contains dicts with {'category': str, 'count': int}
     """
     cursor = None
+    connection = None
     try:
         # Validate date format
         try:
@@ -27,6 +25,9 @@ def get_trending_on_date(target_date: str) -> Tuple[bool, str, List[Dict]]:
         except ValueError:
             return False, "Invalid date format. Please use YYYY-MM-DD", []
 
+        connection = getconnection()
+        if not connection:
+            return False, "Failed to connect to database", []
         cursor = connection.cursor()
         
         # First, get all column names except 'date'
@@ -81,6 +82,8 @@ def get_trending_on_date(target_date: str) -> Tuple[bool, str, List[Dict]]:
     finally:
         if cursor:
             cursor.close()
+        if connection:
+            release_connection(connection)
 
 # Helper function to format the trending results nicely
 def print_trending_results(success: bool, message: str, trending_data: List[Dict]) -> None:
@@ -0,0 +1,151 @@
+"""
+Parallel, resumable embedding and upsert of a document's chunks.
+
+Chunks are embedded and upserted in batches of UPSERT_BATCH_SIZE, with up to
+UPSERT_CONCURRENCY batches in flight per worker process (shared by every
+ingestion it runs). Each call already gets resilience.py's retries; a batch
+that still fails does not stop the others, and once they are done only the
+failed batches are tried again, for up to UPSERT_RETRY_ROUNDS more rounds.
+
+Every committed batch is checkpointed in the local store. Vector IDs are
+deterministic (see chunk_manifest.py), so an ID in the checkpoint means that
+exact chunk is already in the index: when an interrupted ingestion is
+submitted again, those chunks are skipped and it resumes where it stopped. The
+checkpoint is cleared once the ingestion has saved its manifest.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Set, Tuple
+
+import resilience
+import workloads
+from local_store import ensure_schema, local_db
+from metrics import counter
+
+logger = logging.getLogger(__name__)
+
+UPSERT_BATCH_SIZE = int(os.environ.get("UPSERT_BATCH_SIZE", "100"))
+UPSERT_CONCURRENCY = int(os.environ.get("UPSERT_CONCURRENCY", "4"))
+UPSERT_RETRY_ROUNDS = int(os.environ.get("UPSERT_RETRY_ROUNDS", "2"))
+UPSERT_CHECKPOINT = os.environ.get("UPSERT_CHECKPOINT", "true").lower() == "true"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS upsert_checkpoint (
+    namespace TEXT NOT NULL,
+    vector_id TEXT NOT NULL,
+    committed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, vector_id)
+);
+"""
+
+# (vector_id, text, metadata); metadata may be empty
+UpsertItem = Tuple[str, str, Dict]
+
+BATCHES = counter(
+    "caseon_upsert_batches_total",
+    "Ingestion upsert batches by outcome (committed, failed, retried).",
+    ("outcome",),
+)
+RESUMED_VECTORS = counter(
+    "caseon_upsert_resumed_vectors_total",
+    "Chunks skipped because an earlier, interrupted ingestion had already upserted them.",
+)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, UPSERT_CONCURRENCY), thread_name_prefix="upsert")
+    return _executor
+
+
+def committed(namespace: str) -> Set[str]:
+    """IDs of the vectors upserted for namespace since its last completed ingestion."""
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        return {row["vector_id"] for row in
+                conn.execute("SELECT vector_id FROM upsert_checkpoint WHERE namespace = ?", (namespace,))}
+
+
+def _checkpoint(namespace: str, vector_ids: List[str]) -> None:
+    now = time.time()
+    with local_db() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO upsert_checkpoint (namespace, vector_id, committed_at) VALUES (?, ?, ?)",
+            [(namespace, vid, now) for vid in vector_ids],
+        )
+
+
+def clear(namespace: str) -> None:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.execute("DELETE FROM upsert_checkpoint WHERE namespace = ?", (namespace,))
+
+
+def _upsert_batch(index, embeddings, namespace: str, batch: List[UpsertItem]) -> None:
+    # Let queued chats go first; they share the embedding and Pinecone quotas
+    workloads.yield_to_interactive()
+    values = resilience.call("embed_documents", embeddings.embed_documents, [text for _, text, _ in batch])
+    vectors = []
+    for (vid, _, metadata), vector in zip(batch, values):
+        item = {"id": vid, "values": vector}
+        if metadata:
+            item["metadata"] = metadata
+        vectors.append(item)
+    resilience.call("vector_upsert", index.upsert, vectors=vectors, namespace=namespace)
+    if UPSERT_CHECKPOINT:
+        _checkpoint(namespace, [vid for vid, _, _ in batch])
+
+
+def _run_round(index, embeddings, namespace: str, batches: List[List[UpsertItem]]):
+    """Run batches in parallel; returns the failed ones and the last error."""
+    executor = _get_executor()
+    futures = {
+        executor.submit(contextvars.copy_context().run, _upsert_batch, index, embeddings, namespace, batch): batch
+        for batch in batches
+    }
+    wait(futures)
+    failed, error = [], None
+    for future, batch in futures.items():
+        if future.exception() is None:
+            BATCHES.inc(outcome="committed")
+        else:
+            BATCHES.inc(outcome="failed")
+            failed.append(batch)
+            error = future.exception()
+    return failed, error
+
+
+def upsert(index, embeddings, namespace: str, items: List[UpsertItem]) -> int:
+    """
+    Embed and upsert items under namespace, skipping those already committed by
+    an interrupted earlier run. Returns the number upserted now; raises the last
+    batch error if some batches still fail after the retry rounds.
+    """
+    done = committed(namespace) if UPSERT_CHECKPOINT else set()
+    pending = [item for item in items if item[0] not in done]
+    if len(pending) < len(items):
+        RESUMED_VECTORS.inc(len(items) - len(pending))
+        logger.info(f"Resuming {namespace}: {len(items) - len(pending)} of {len(items)} chunks already upserted")
+    batches = [pending[start:start + UPSERT_BATCH_SIZE] for start in range(0, len(pending), UPSERT_BATCH_SIZE)]
+
+    error = None
+    for attempt in range(UPSERT_RETRY_ROUNDS + 1):
+        if attempt:
+            BATCHES.inc(len(batches), outcome="retried")
+            logger.warning(f"Retrying {len(batches)} failed upsert batches for {namespace}: {error}")
+        batches, error = _run_round(index, embeddings, namespace, batches)
+        if not batches:
+            return len(pending)
+    logger.error(f"{len(batches)} upsert batches for {namespace} failed; "
+                 f"committed batches are skipped when the upload is submitted again")
+    raise error
@@ -1,64 +1,110 @@
-from pinecone_index_manager import create_unique_pinecone_index, insert_case, count_namespaces_in_index
-import os
-from typing import Tuple, Dict
-from pinecone import Pinecone
-
-# Constants for Pinecone limit
-NAMESPACES_PER_INDEX = 25000
-INDEXES_PER_PROJECT = 20
+from pinecone_index_manager import create_unique_pinecone_index, insert_case, count_namespaces_in_index, get_index_project_by_namespace
+from typing import List, Optional, Tuple
+import shard_map
+from shard_map import Project
+
+# Constants for Pinecone limit (defaults for projects that don't override them in the shard map)
+NAMESPACES_PER_INDEX = shard_map.DEFAULT_NAMESPACES_PER_INDEX
+INDEXES_PER_PROJECT = shard_map.DEFAULT_MAX_INDEXES
 TARGET_TOTAL_NAMESPACES = 1000000
 
-# Project constants
-PROJECT_1 = "QA1"
-PROJECT_2 = "QA2"
 
-def get_project_status(api_key: str) -> Tuple[str, int]:
+def get_index_loads(project: Project) -> List[Tuple[str, int]]:
+    """Return (index_name, namespace_count) for every index in a project."""
+    pc = shard_map.get_pinecone_client(project.name)
+    return [
+        (index.name, count_namespaces_in_index(index_name=index.name, api_key=project.api_key))
+        for index in pc.list_indexes()
+    ]
+
+
+def get_project_status(project: Project) -> Tuple[Optional[str], Optional[int]]:
     """Get current project status including available index and total namespaces."""
-    # Initialize Pinecone
-    pc = Pinecone(api_key=api_key)
-    
+    pc = shard_map.get_pinecone_client(project.name)
+
     # Get list of existing indexes
     indexes = pc.list_indexes()
-    
+
     # If no indexes exist, create first one
     if not indexes:
-        return create_unique_pinecone_index(dimension=768, metric="cosine", api_key=api_key), 0
-    
+        return create_unique_pinecone_index(dimension=768, metric="cosine", api_key=project.api_key), 0
+
     # Check each existing index for available capacity
     for index in indexes:
-        ns_count = count_namespaces_in_index(index_name=index.name, api_key=api_key)
-        # ns_count = 25000
-        if ns_count < NAMESPACES_PER_INDEX:
+        ns_count = count_namespaces_in_index(index_name=index.name, api_key=project.api_key)
+        if ns_count < project.namespaces_per_index:
             return index.name, ns_count
-    
+
     # If all indexes are full and we haven't reached project limit
-    if len(indexes) < INDEXES_PER_PROJECT:
-        return create_unique_pinecone_index(dimension=768, metric="cosine", api_key=api_key), 0
-    
+    if len(indexes) < project.max_indexes:
+        return create_unique_pinecone_index(dimension=768, metric="cosine", api_key=project.api_key), 0
+
+    return None, None
+
+
+def allocate_fill_first(projects: List[Project]) -> Tuple[Optional[str], Optional[str]]:
+    """First project, in shard map order, with room in an existing or new index."""
+    for project in projects:
+        index_name, _ = get_project_status(project)
+        if index_name is not None:
+            return index_name, project.name
+    return None, None
+
+
+def allocate_spread(projects: List[Project]) -> Tuple[Optional[str], Optional[str]]:
+    """Least-loaded index with room across all projects, so query load is spread evenly."""
+    best = None
+    growable = []
+    for project in projects:
+        loads = get_index_loads(project)
+        for index_name, ns_count in loads:
+            if ns_count < project.namespaces_per_index and (best is None or ns_count < best[0]):
+                best = (ns_count, index_name, project.name)
+        if len(loads) < project.max_indexes:
+            growable.append((len(loads), project))
+    if best is not None:
+        return best[1], best[2]
+    if growable:
+        # Every index is full: open a new one in the project with the fewest indexes
+        _, project = min(growable, key=lambda item: item[0])
+        return create_unique_pinecone_index(dimension=768, metric="cosine", api_key=project.api_key), project.name
     return None, None
 
+
+def allocate_index(namespace: str) -> Tuple[str, str]:
+    """
+    Pick the index for a new namespace according to the shard map's allocation policy.
+    Returns: (index_name, project)
+    """
+    current = shard_map.get_shard_map()
+    projects = current.writable_projects()
+    if current.allocation_policy == "spread":
+        index_name, project = allocate_spread(projects)
+    else:
+        index_name, project = allocate_fill_first(projects)
+    if index_name is None:
+        raise Exception("All projects are at capacity. Cannot create more indexes.")
+    return index_name, project
+
+
+def allocate_namespace(namespace: str) -> Tuple[str, str]:
+    """
+    Allocate an index for a new namespace and record the route in volume_handling_table.
+    A namespace that is already routed keeps its index.
+    Returns: (index_name, project)
+    """
+    index_name, project = get_index_project_by_namespace(namespace)
+    if index_name and project:
+        return index_name, project
+    index_name, project = allocate_index(namespace)
+    insert_case(namespace=namespace, index_name=index_name, project=project)
+    return index_name, project
+
+
 def main_function(namespace_count: str) -> str:
     """
     Main handler for managing Pinecone indexes and namespaces across projects.
     Returns: index_name
     """
-    # Try first project
-    api_key = os.environ["PINECONE_API_KEY"]
-    index_name, current_ns_count = get_project_status(api_key)
-    
-    if index_name is not None:
-        # If first project has capacity, use it
-        insert_case(namespace=namespace_count, index_name=index_name, project=PROJECT_1)
-        return index_name
-    
-    # If first project is full, try second project
-    api_key = os.environ["PINECONE_API_KEY_SECOND_PROJECT"]
-    index_name, current_ns_count = get_project_status(api_key)
-    
-    if index_name is None:
-        raise Exception("Both projects are at capacity. Cannot create more indexes.")
-    
-    # Insert into second project
-    insert_case(namespace=namespace_count, index_name=index_name, project=PROJECT_2)
+    index_name, _ = allocate_namespace(namespace_count)
     return index_name
-
@@ -0,0 +1,88 @@
+"""
+Whole-document mode for short PDFs.
+
+Documents whose full text fits in WHOLE_DOCUMENT_MAX_TOKENS (default 4000,
+about the size of the 30 chunks retrieval would send anyway) have their text
+stored locally at ingestion, and chats on them send the whole document to the
+model instead of embedding the question and searching Pinecone.
+
+WHOLE_DOCUMENT_VECTORIZE (default true) still uploads vectors for these
+documents, so a chat served by an instance without the local copy falls back to
+retrieval. Set it to false to skip embedding and Pinecone for short documents
+entirely; only do that when LOCAL_DATA_DIR is on a persistent volume shared by
+every instance, since the local store then holds the only copy.
+WHOLE_DOCUMENT_MAX_TOKENS=0 turns the mode off.
+"""
+import json
+import os
+import time
+from typing import List, Optional, Tuple
+
+from local_store import ensure_schema, local_db
+
+WHOLE_DOCUMENT_MAX_TOKENS = int(os.environ.get("WHOLE_DOCUMENT_MAX_TOKENS", "4000"))
+WHOLE_DOCUMENT_VECTORIZE = os.environ.get("WHOLE_DOCUMENT_VECTORIZE", "true").lower() == "true"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS whole_document (
+    namespace TEXT PRIMARY KEY,
+    pages TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token
+    return len(text) // 4
+
+
+def page_texts(docs) -> List[Tuple[int, str]]:
+    """(page, text) for each loaded PDF page, numbered as in the chunk metadata."""
+    return [(doc.metadata.get("page", i), doc.page_content) for i, doc in enumerate(docs)]
+
+
+def fits(pages: List[Tuple[int, str]]) -> bool:
+    if WHOLE_DOCUMENT_MAX_TOKENS <= 0:
+        return False
+    return sum(estimate_tokens(text) for _, text in pages) <= WHOLE_DOCUMENT_MAX_TOKENS
+
+
+def save(namespace: str, pages: List[Tuple[int, str]]) -> None:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO whole_document (namespace, pages, tokens, updated_at) VALUES (?, ?, ?, ?)",
+            (namespace, json.dumps(pages), sum(estimate_tokens(text) for _, text in pages), time.time()),
+        )
+
+
+def load(namespace: str) -> Optional[List[Tuple[int, str]]]:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        row = conn.execute("SELECT pages FROM whole_document WHERE namespace = ?", (namespace,)).fetchone()
+    return [tuple(page) for page in json.loads(row["pages"])] if row else None
+
+
+def has(namespace: str) -> bool:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        return conn.execute("SELECT 1 FROM whole_document WHERE namespace = ?", (namespace,)).fetchone() is not None
+
+
+def namespaces() -> List[str]:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        return [row["namespace"] for row in conn.execute("SELECT namespace FROM whole_document")]
+
+
+def delete(namespace: str) -> None:
+    ensure_schema(_SCHEMA)
+    with local_db() as conn:
+        conn.execute("DELETE FROM whole_document WHERE namespace = ?", (namespace,))
+
+
+def format_document(pages: List[Tuple[int, str]]) -> str:
+    """The document as prompt context, each page headed by its number for citations."""
+    return "\n\n".join(f"[Page {page}]\n{text}" for page, text in pages)
@@ -0,0 +1,167 @@
+"""
+Bulkheads: separate, independently sized executors per workload class.
+
+Chat and ingestion run on their own thread pools inside each worker, so a burst
+of large /api/v1/document/process calls can only occupy the ingestion pool and
+never the threads interactive chats need. Each pool has a bounded queue; work
+submitted to a full pool is rejected with BulkheadFull (a 503 from rag.py)
+instead of piling up.
+
+Chat is prioritised: while chats are queued waiting for a thread, ingestion
+pauses between embedding batches (yield_to_interactive) for up to
+INGEST_YIELD_MAX_SECONDS per batch, leaving the CPU and the shared Gemini and
+Pinecone quotas to the chats.
+
+Settings, per class: BULKHEAD_<CLASS>_WORKERS and BULKHEAD_<CLASS>_QUEUE. In
+async mode the chat bulkhead defaults to WORKER_CONNECTIONS threads (greenlets,
+once patched), so it holds as many chats as the server accepts; serving_mode.py
+describes how this interacts with the admission and upstream limits.
+
+Isolation only matters when a worker serves requests concurrently
+(SERVING_MODE=async, gunicorn with --threads, or waitress). A gunicorn sync
+worker handles one request at a time, so gunicorn.conf.py switches those to
+run_inline(): workloads then run on the request's own thread, skipping the
+hand-off to a pool, with the same gauges.
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import serving_mode
+from metrics import counter, gauge, histogram
+
+CHAT = "chat"
+INGEST = "ingest"
+
+WORKLOAD_DEFAULTS = {
+    CHAT: {"workers": serving_mode.concurrent_requests(16), "queue": 64},
+    INGEST: {"workers": 2, "queue": 8},
+}
+INGEST_YIELD_MAX_SECONDS = float(os.environ.get("INGEST_YIELD_MAX_SECONDS", "5"))
+_YIELD_POLL_SECONDS = 0.05
+# Set by run_inline() in workers that serve one request at a time
+_inline = False
+
+QUEUE_DEPTH = gauge("caseon_bulkhead_queue_depth", "Tasks waiting for a thread, per workload class.", ("workload",))
+ACTIVE = gauge("caseon_bulkhead_active", "Tasks running, per workload class.", ("workload",))
+QUEUE_WAIT_SECONDS = histogram(
+    "caseon_bulkhead_queue_wait_seconds",
+    "Time tasks waited for a thread, per workload class.",
+    ("workload",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+REJECTED = counter("caseon_bulkhead_rejected_total", "Tasks rejected because the class's queue was full.", ("workload",))
+INGEST_YIELD_SECONDS = counter(
+    "caseon_ingest_yield_seconds_total", "Time ingestion spent paused so queued chats could run."
+)
+
+
+class BulkheadFull(Exception):
+    def __init__(self, workload: str):
+        super().__init__(f"{workload} workload is at capacity")
+        self.workload = workload
+
+
+class Bulkhead:
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-bulkhead")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+
+    def _update_gauges(self) -> None:
+        QUEUE_DEPTH.set(self.queued, workload=self.name)
+        ACTIVE.set(self.active, workload=self.name)
+
+    def _run_inline(self, fn: Callable, *args, **kwargs):
+        with self._lock:
+            self.active += 1
+            self._update_gauges()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self._update_gauges()
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """Run fn on this bulkhead's threads (or the caller's, see run_inline) and wait for its result."""
+        if _inline:
+            return self._run_inline(fn, *args, **kwargs)
+        with self._lock:
+            if self.queued + self.active >= self.workers + self.queue_size:
+                REJECTED.inc(workload=self.name)
+                raise BulkheadFull(self.name)
+            self.queued += 1
+            self._update_gauges()
+
+        # Run in the caller's context so per-request timings and tracing carry over
+        ctx = contextvars.copy_context()
+        submitted = time.perf_counter()
+
+        def task():
+            with self._lock:
+                self.queued -= 1
+                self.active += 1
+                self._update_gauges()
+            QUEUE_WAIT_SECONDS.observe(time.perf_counter() - submitted, workload=self.name)
+            try:
+                return ctx.run(fn, *args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self._update_gauges()
+
+        return self._executor.submit(task).result()
+
+
+_bulkheads: Dict[str, Bulkhead] = {}
+_bulkheads_lock = threading.Lock()
+
+
+def get_bulkhead(workload: str) -> Bulkhead:
+    bulkhead = _bulkheads.get(workload)
+    if bulkhead is None:
+        with _bulkheads_lock:
+            bulkhead = _bulkheads.get(workload)
+            if bulkhead is None:
+                defaults = WORKLOAD_DEFAULTS[workload]
+                prefix = f"BULKHEAD_{workload.upper()}"
+                bulkhead = _bulkheads[workload] = Bulkhead(
+                    workload,
+                    int(os.environ.get(f"{prefix}_WORKERS", defaults["workers"])),
+                    int(os.environ.get(f"{prefix}_QUEUE", defaults["queue"])),
+                )
+    return bulkhead
+
+
+def run_inline(enabled: bool = True) -> None:
+    """Run workloads on the calling thread, for workers that never serve two requests at once."""
+    global _inline
+    _inline = enabled
+
+
+def run(workload: str, fn: Callable, *args, **kwargs):
+    """Run fn in the bulkhead for workload ("chat" or "ingest") and return its result."""
+    return get_bulkhead(workload).run(fn, *args, **kwargs)
+
+
+def queue_depth(workload: str) -> int:
+    bulkhead: Optional[Bulkhead] = _bulkheads.get(workload)
+    return bulkhead.queued if bulkhead is not None else 0
+
+
+def yield_to_interactive() -> None:
+    """Called by ingestion between batches: pause while chats are waiting for a thread."""
+    if not queue_depth(CHAT):
+        return
+    start = time.perf_counter()
+    while queue_depth(CHAT) and time.perf_counter() - start < INGEST_YIELD_MAX_SECONDS:
+        time.sleep(_YIELD_POLL_SECONDS)
+    INGEST_YIELD_SECONDS.inc(time.perf_counter() - start)